@@ -105,6 +105,83 @@ def get_bitbake_env(proot, logfile):
     return source_cmd
 
 
+def get_bitbake_env_scripts(proot):
+    '''Return the scripts sourced by get_bitbake_env'''
+    arch = plnx_utils.get_system_arch(proot)
+    env_scirpt = '%s-%s' % (
+        plnx_vars.YoctoEnvPrefix, plnx_vars.YoctoEnvFile[arch]
+    )
+    return [os.path.join(plnx_vars.EsdkInstalledDir.format(proot), env_scirpt),
+            plnx_vars.BuildToolsEnvPath,
+            plnx_vars.OeInitEnv.format(proot)]
+
+
+def get_bitbake_env_key(proot):
+    '''Return the key of bitbake environment snapshot computed
+    from env scripts, tool paths and outer environment'''
+    import hashlib
+    method = hashlib.sha256()
+    for script in get_bitbake_env_scripts(proot):
+        method.update(script.encode())
+        fingerprint = plnx_utils.get_file_fingerprint(script)
+        if fingerprint:
+            method.update(str(fingerprint[:2]).encode())
+            method.update(plnx_utils.get_filehashvalue(script).encode())
+    for value in (proot, plnx_vars.PetaLinux, plnx_vars.PetaLinux_Ver,
+                  os.environ.get('PATH', ''),
+                  os.environ.get('LD_LIBRARY_PATH', ''),
+                  os.environ.get('BB_ENV_PASSTHROUGH_ADDITIONS', '')):
+        method.update(value.encode() + b'\0')
+    return method.hexdigest()
+
+
+def get_bitbake_env_snapshot(proot, logfile, force=False):
+    '''Return the environment to run bitbake commands.
+    Source the env scripts once and store the variables they
+    set/unset in build dir, reuse it till the snapshot key changes.
+    Returns None if unable to capture the environment'''
+    import json
+    import tempfile
+    snapshot_file = plnx_vars.BBEnvSnapshotFile.format(proot)
+    env_key = get_bitbake_env_key(proot)
+    snapshot = {}
+    if not force and os.path.isfile(snapshot_file):
+        try:
+            with open(snapshot_file, 'r') as file_data:
+                snapshot = json.load(file_data)
+        except ValueError:
+            snapshot = {}
+    if snapshot.get('key') != env_key:
+        logger.debug('Generating bitbake environment snapshot')
+        try:
+            plnx_utils.CreateDir(plnx_vars.BuildDir.format(proot))
+            # Temp file is removed on close
+            with tempfile.NamedTemporaryFile() as filehandle:
+                env_cmd = '%s env -0 > %s' % (
+                    get_bitbake_env(proot, logfile), filehandle.name)
+                plnx_utils.runCmd(env_cmd, proot, shell=True)
+                env_data = filehandle.read().decode('utf-8', 'replace')
+        except Exception as e:
+            logger.debug('Failed to capture bitbake environment: %s' % e)
+            return None
+        new_env = dict(var.split('=', 1)
+                       for var in env_data.split('\0') if '=' in var)
+        snapshot = {'key': env_key, 'set': {}, 'unset': []}
+        for var, value in new_env.items():
+            if var not in plnx_vars.BBEnvSkipVars and \
+                    os.environ.get(var) != value:
+                snapshot['set'][var] = value
+        for var in os.environ.keys():
+            if var not in plnx_vars.BBEnvSkipVars and var not in new_env:
+                snapshot['unset'].append(var)
+        plnx_utils.write_file_atomic(snapshot_file, json.dumps(snapshot))
+    env = os.environ.copy()
+    for var in snapshot['unset']:
+        env.pop(var, None)
+    env.update(snapshot['set'])
+    return env
+
+
 def setup_bitbake_env(proot, logfile):
     '''Copy esdk conf files into build directory and remove'''
     '''EXTRA_IMAGE_FEATURES from local.conf file and pre env '''
@@ -114,40 +191,37 @@ def setup_bitbake_env(proot, logfile):
             os.path.exists(plnx_vars.LocalConf.format(proot)):
         conf_generated = True
 
-    source_cmd = get_bitbake_env(proot, logfile)
-    plnx_utils.runCmd(source_cmd, proot, shell=True)
+    # Regenerate the environment snapshot, sourcing the scripts
+    # will generate the default build conf if not exists
+    get_bitbake_env_snapshot(proot, logfile, force=not conf_generated)
     if not conf_generated:
         plnx_utils.CopyDir(
             plnx_vars.EsdkConfDir.format(proot),
             plnx_vars.ConfDir.format(proot)
         )
         plnx_utils.RemoveFile(plnx_vars.DevtoolConfFile.format(proot))
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LocalConf.format(proot),
-            'EXTRA_IMAGE_FEATURES(.*)')
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LocalConf.format(proot),
-            'SSTATE_MIRRORS(.*)=(.*)"$')
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LocalConf.format(proot),
-            'include conf\/plnxbuild.conf')
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LocalConf.format(proot),
-            'require conf\/locked-sigs.inc')
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LocalConf.format(proot),
-            'require conf\/unlocked-sigs.inc')
     plnx_utils.replace_str_fromdir(
         plnx_vars.ConfDir.format(proot),
         'SDKBASEMETAPATH = "${TOPDIR}"',
         'SDKBASEMETAPATH = "%s"' % (
             plnx_vars.EsdkInstalledDir.format(proot)))
-    plnx_utils.add_str_to_file(
-        plnx_vars.LocalConf.format(proot),
-        'require conf/locked-sigs.inc\n', ignore_if_exists=True, mode='a+')
-    plnx_utils.add_str_to_file(
-        plnx_vars.LocalConf.format(proot),
-        'require conf/unlocked-sigs.inc\n', ignore_if_exists=True, mode='a+')
+    # Collect all local.conf edits and write them at once
+    localconf_trans = plnx_utils.config_transaction_begin(
+        plnx_vars.LocalConf.format(proot))
+    if not conf_generated:
+        for string in ('EXTRA_IMAGE_FEATURES(.*)',
+                       'SSTATE_MIRRORS(.*)=(.*)"$',
+                       'include conf\/plnxbuild.conf',
+                       'require conf\/locked-sigs.inc',
+                       'require conf\/unlocked-sigs.inc'):
+            plnx_utils.config_transaction_remove_str(localconf_trans, string)
+    plnx_utils.config_transaction_add_str(
+        localconf_trans, 'require conf/locked-sigs.inc\n',
+        ignore_if_exists=True)
+    plnx_utils.config_transaction_add_str(
+        localconf_trans, 'require conf/unlocked-sigs.inc\n',
+        ignore_if_exists=True)
+    plnx_utils.config_transaction_commit(localconf_trans)
 
 
 def get_yocto_source(proot):
@@ -195,14 +269,14 @@ def get_yocto_source(proot):
                                              plnx_vars.EsdkInstalledDir.format(proot))
         plnx_utils.runCmd(sdk_command, proot, shell=True)
 
-        plnx_utils.remove_str_from_file(
-            plnx_vars.LockedSigsFile.format(
-                proot), '^SIGGEN_LOCKEDSIGS_TYPES(.*)'
-        )
+        lockedsigs_trans = plnx_utils.config_transaction_begin(
+            plnx_vars.LockedSigsFile.format(proot))
+        plnx_utils.config_transaction_remove_str(
+            lockedsigs_trans, '^SIGGEN_LOCKEDSIGS_TYPES(.*)')
         locked_string = 'SIGGEN_LOCKEDSIGS_TYPES = "%s"' % (
             plnx_vars.LockedSigns[arch])
-        plnx_utils.add_str_to_file(
-            plnx_vars.LockedSigsFile.format(proot), locked_string, mode='a+')
+        plnx_utils.config_transaction_add_str(lockedsigs_trans, locked_string)
+        plnx_utils.config_transaction_commit(lockedsigs_trans)
         plnx_utils.remove_str_from_file(
             plnx_vars.EsdkBBLayerconf.format(proot), '\${SDKBASEMETAPATH}/workspace')
         plnx_utils.RemoveFile(plnx_vars.DevtoolFile.format(proot))
@@ -254,22 +328,189 @@ def run_genmachineconf(proot, xilinx_arch, config_args, add_layers=False, logfil
         xilinx_arch, hw_args, plnx_vars.SysConfDir.format(proot),
         plnx_vars.UsrRfsConfig.format(proot),
         config_args)
+    cache_dir = plnx_utils.get_cache_dir(plnx_vars.GenMachineConfCacheEnv,
+                                         plnx_vars.GenMachineConfCacheDir)
+    cache_key = ''
+    # menuconfig is interactive, always run gen-machineconf
+    if cache_dir and config_args.find('--menuconfig') == -1:
+        cache_key = get_genmachineconf_cache_key(
+            proot, xilinx_arch, config_args, add_layers)
+        if restore_genmachineconf_cache(proot, cache_dir, cache_key):
+            return
+    outputs = get_genmachineconf_outputs(proot)
     plnx_utils.RemoveFile(plnx_vars.SdtAutoConf.format(proot))
-    run_bitbakecmd(genconf_cmd, proot, builddir=proot,
+    run_bitbakecmd(genconf_cmd, proot,
                    logfile=logfile, extraenv=extraenv, shell=True)
+    if cache_key:
+        store_genmachineconf_cache(proot, cache_dir, cache_key, outputs)
+
+
+def read_file_prootless(filename, proot):
+    '''Read the file content replacing project path with a token,
+    so the content is same across the projects'''
+    with open(filename, 'r') as file_data:
+        return file_data.read().replace(proot, plnx_vars.CacheProotToken)
+
+
+def get_genmachineconf_cache_key(proot, xilinx_arch, config_args, add_layers):
+    '''Return the gen-machineconf cache key computed from hw file,
+    soc family, configs, args and PetaLinux version'''
+    import hashlib
+    method = hashlib.sha256()
+    for value in (xilinx_arch, config_args.strip(), str(add_layers),
+                  plnx_utils.is_hwflow_sdt(proot), plnx_vars.PetaLinux_Ver,
+                  plnx_utils.get_config_value(
+                      'YOCTO_SDK', plnx_vars.MetaDataFile.format(proot))):
+        method.update(value.encode() + b'\0')
+    hw_dir = plnx_vars.HWDescDir.format(proot)
+    if plnx_utils.is_hwflow_sdt(proot) == 'sdt':
+        hw_files = [os.path.join(dname, fname)
+                    for dname, dirs, files in os.walk(hw_dir)
+                    for fname in files]
+    else:
+        hw_files = [plnx_vars.DefXsaPath.format(proot)]
+    for hw_file in sorted(hw_files):
+        if os.path.isfile(hw_file):
+            method.update(os.path.relpath(hw_file, hw_dir).encode() + b'\0')
+            method.update(plnx_utils.get_filehashvalue_cached(
+                proot, hw_file).encode())
+    for conf_file in (plnx_vars.SysConfFile, plnx_vars.RfsConfig,
+                      plnx_vars.UsrRfsConfig, plnx_vars.BBLayersConf):
+        conf_file = conf_file.format(proot)
+        method.update(os.path.relpath(conf_file, proot).encode() + b'\0')
+        if os.path.isfile(conf_file):
+            method.update(read_file_prootless(conf_file, proot).encode())
+    return method.hexdigest()
+
+
+def get_genmachineconf_outputs(proot):
+    '''Return the fingerprints of files gen-machineconf may generate'''
+    outputs = {}
+    for out_dir in (plnx_vars.SysConfDir, plnx_vars.ConfDir):
+        for dname, dirs, files in os.walk(out_dir.format(proot)):
+            for fname in files:
+                filename = os.path.join(dname, fname)
+                outputs[filename] = plnx_utils.get_file_fingerprint(filename)
+    return outputs
+
+
+def restore_genmachineconf_cache(proot, cache_dir, cache_key):
+    '''Restore the gen-machineconf generated files from cache'''
+    import json
+    entry_dir = os.path.join(cache_dir, cache_key)
+    manifest_file = os.path.join(entry_dir, 'manifest.json')
+    try:
+        with open(manifest_file, 'r') as file_data:
+            manifest = json.load(file_data)
+        contents = {}
+        for relpath in manifest['files']:
+            with open(os.path.join(entry_dir, 'files', relpath), 'r') as file_data:
+                contents[relpath] = file_data.read().replace(
+                    plnx_vars.CacheProotToken, proot)
+    except (OSError, ValueError, KeyError):
+        return False
+    logger.info('Restoring machine configuration from cache')
+    plnx_utils.RemoveFile(plnx_vars.SdtAutoConf.format(proot))
+    for relpath, content in contents.items():
+        filename = os.path.join(proot, relpath)
+        plnx_utils.CreateDir(os.path.dirname(filename))
+        plnx_utils.write_file_atomic(filename, content)
+    # Mark the entry as recently used for LRU eviction
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    return True
+
+
+def store_genmachineconf_cache(proot, cache_dir, cache_key, old_outputs):
+    '''Store the files generated/modified by gen-machineconf in cache'''
+    import json
+    import tempfile
+    new_outputs = get_genmachineconf_outputs(proot)
+    out_files = [filename for filename, fingerprint in new_outputs.items()
+                 if old_outputs.get(filename) != fingerprint and
+                 filename != plnx_vars.GenMachLogFile.format(proot)]
+    for filename in (plnx_vars.SysConfFile, plnx_vars.RfsConfig,
+                     plnx_vars.PlnxToolConf, plnx_vars.SdtAutoConf,
+                     plnx_vars.BBLayersConf):
+        filename = filename.format(proot)
+        if filename in new_outputs and filename not in out_files:
+            out_files.append(filename)
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if os.path.exists(entry_dir):
+        return
+    try:
+        plnx_utils.CreateDir(cache_dir)
+        tmp_dir = tempfile.mkdtemp(prefix='.%s.' % cache_key, dir=cache_dir)
+    except OSError as e:
+        logger.debug('Unable to create gen-machineconf cache: %s' % e)
+        return
+    try:
+        manifest = {'files': []}
+        for filename in sorted(out_files):
+            relpath = os.path.relpath(filename, proot)
+            cache_file = os.path.join(tmp_dir, 'files', relpath)
+            plnx_utils.CreateDir(os.path.dirname(cache_file))
+            with open(cache_file, 'w') as file_data:
+                file_data.write(read_file_prootless(filename, proot))
+            manifest['files'].append(relpath)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as file_data:
+            json.dump(manifest, file_data)
+        os.rename(tmp_dir, entry_dir)
+    except (OSError, UnicodeDecodeError) as e:
+        logger.debug('Unable to store gen-machineconf cache: %s' % e)
+        plnx_utils.RemoveDir(tmp_dir)
+        return
+    plnx_utils.evict_lru_cache(cache_dir, plnx_vars.GenMachineConfCacheSizeEnv,
+                               plnx_vars.GenMachineConfCacheSize)
+
+
+def get_bb_server_timeout():
+    '''Return the resident bitbake server idle timeout in seconds
+    from PLNX_BB_SERVER_TIMEOUT env, empty if not enabled'''
+    timeout = os.environ.get(plnx_vars.BBServerTimeoutEnv, '').strip()
+    if not timeout:
+        return ''
+    try:
+        if int(timeout) > 0 or int(timeout) == -1:
+            return str(int(timeout))
+    except ValueError:
+        pass
+    logger.warning('Invalid %s value "%s", it should be seconds(>0) or -1. '
+                   'Not using resident bitbake server'
+                   % (plnx_vars.BBServerTimeoutEnv, timeout))
+    return ''
+
+
+def stop_bitbake_server(proot, logfile='/dev/null'):
+    '''Shutdown the resident bitbake server of project if running'''
+    if not os.path.exists(plnx_vars.BBServerSocket.format(proot)):
+        return
+    logger.info('Stopping resident bitbake server')
+    try:
+        run_bitbakecmd('bitbake -m', proot, logfile=logfile,
+                       shell=True, checkcall=False)
+    except Exception as e:
+        logger.debug('Failed to stop bitbake server: %s' % e)
 
 
 def run_bitbakecmd(command, proot, builddir=None, logfile='/dev/null',
                    extraenv=None, shell=False, checkcall=True):
-    '''Source the env script and Run bitbake commands'''
+    '''Run bitbake commands with build environment snapshot
+    Fallback to source the env scripts if no snapshot.
+    Commands runs in build dir same as after oe-init-build-env'''
     cmd = command
     command = command.split() if not shell else command
     if not builddir:
-        builddir = os.path.join(proot, 'build')
-    source_cmd = get_bitbake_env(proot, logfile)
-    command = '%s%s' % (source_cmd, command)
+        builddir = plnx_vars.BuildDir.format(proot)
+    env = get_bitbake_env_snapshot(proot, logfile)
+    if env is None:
+        source_cmd = get_bitbake_env(proot, logfile)
+        command = '%s%s' % (source_cmd, cmd)
+        shell = True
+        env = os.environ.copy()
     logger.debug(command)
-    env = os.environ.copy()
     if proot and not extraenv:
         extraenv = {'PROOT': proot}
     if extraenv:
@@ -278,6 +519,11 @@ def run_bitbakecmd(command, proot, builddir=None, logfile='/dev/null',
             env[k] = extraenv[k]
             env['BB_ENV_PASSTHROUGH_ADDITIONS'] = env.get(
                 'BB_ENV_PASSTHROUGH_ADDITIONS', '') + ' ' + k
+    # Bitbake server stays alive for BB_SERVER_TIMEOUT seconds after
+    # command exits and next commands in build dir reattach to it
+    server_timeout = get_bb_server_timeout()
+    if server_timeout:
+        env['BB_SERVER_TIMEOUT'] = server_timeout
     try:
         if checkcall:
             output = subprocess.check_call(
@@ -286,8 +532,11 @@ def run_bitbakecmd(command, proot, builddir=None, logfile='/dev/null',
             bb_tasklog = append_bitbake_log(proot, logfile)
             return bb_tasklog
         else:
+            # runCmd starts from os.environ, unset the vars removed by env scripts
+            unset_vars = [k for k in os.environ.keys() if k not in env]
             output, error = plnx_utils.runCmd(command, out_dir=builddir,
-                                              extraenv=env, shell=shell)
+                                              extraenv=env, shell=shell,
+                                              unsetenv=unset_vars)
             bb_tasklog = append_bitbake_log(proot, logfile)
             return output, error
     except (SystemExit, KeyboardInterrupt):
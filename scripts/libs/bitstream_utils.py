@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import plnx_utils
+import plnx_vars
+
+logger = logging.getLogger('PetaLinux')
+
+# Bytes of bitstream to inspect
+BitHeaderReadSize = 1024
+# .bit file header magic after the first length field
+BitHeaderMagic = b'\x00\x09\x0f\xf0\x0f\xf0\x0f\xf0\x0f\xf0\x00\x00\x01'
+# Dummy words, sync word and NOOP
+BitSyncSequence = b'\xff' * 8 + b'\xaa\x99\x55\x66' + b'\x20\x00\x00\x00'
+# SPI bus width byte offset from the sync sequence
+BitSpiWidthOffset = 22
+BitHeaderFields = {
+    'a': 'design',
+    'b': 'part',
+    'c': 'date',
+    'd': 'time'
+}
+SpiWidthIntf = {
+    0: 'SPIx1',
+    1: 'SPIx2',
+    2: 'SPIx4'
+}
+
+
+def parse_bit_header(data):
+    '''Parse the .bit header fields from data
+    Returns dict with design, userid, version, part, date, time and
+    data offset/length,
+    empty dict if data has no .bit header'''
+    header = {}
+    if not data.startswith(BitHeaderMagic):
+        return header
+    offset = len(BitHeaderMagic)
+    while offset < len(data):
+        key = chr(data[offset])
+        offset += 1
+        if key == 'e':
+            if offset + 4 > len(data):
+                break
+            header['data_length'] = struct.unpack_from('>I', data, offset)[0]
+            header['data_offset'] = offset + 4
+            break
+        if key not in BitHeaderFields or offset + 2 > len(data):
+            break
+        length = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+        value = data[offset:offset + length].rstrip(b'\0')
+        value = value.decode('utf-8', 'replace').split(';')
+        header[BitHeaderFields[key]] = value[0]
+        # Design name is followed by ;UserID=<id>;Version=<tool version>
+        for field in value[1:]:
+            if '=' in field:
+                header[field.split('=')[0].lower()] = field.split('=', 1)[1]
+        offset += length
+    return header
+
+
+def read_bitstream_info(bitfile):
+    '''Read the first KiB of bitstream once and return the header
+    fields, sync word offset and SPI bus width(None if not found)'''
+    with open(bitfile, 'rb') as file_data:
+        data = file_data.read(BitHeaderReadSize)
+    info = parse_bit_header(data)
+    info['sync_offset'] = data.find(BitSyncSequence)
+    info['bus_width'] = None
+    width_offset = info['sync_offset'] + BitSpiWidthOffset
+    if info['sync_offset'] != -1 and width_offset < len(data):
+        info['bus_width'] = data[width_offset]
+    return info
+
+
+def get_spi_width_intf(bitfile):
+    '''Return the SPI flash interface from bitstream bus width,
+    empty if unable to detect'''
+    bus_width = read_bitstream_info(bitfile)['bus_width']
+    if bus_width is None:
+        logger.warning('Failed to detect SPI width from bitstream.')
+        return ''
+    if bus_width not in SpiWidthIntf:
+        logger.warning('Unknown SPI width detected: %s.' % bus_width)
+        return ''
+    return SpiWidthIntf[bus_width]
+
+
+def log_bitstream_info(bitfile):
+    '''Log the design, part and date of bitstream
+    warn if the file is not having .bit header'''
+    info = read_bitstream_info(bitfile)
+    if not info.get('design'):
+        logger.warning('%s is not having a valid bitstream header' % bitfile)
+        return info
+    logger.info('Bitstream design: %s, part: %s, date: %s %s' % (
+        info['design'], info.get('part', ''), info.get('date', ''),
+        info.get('time', '')))
+    return info
+
+
+def get_bitbin_cache_key(bitfile, xilinx_arch, proot):
+    '''Return the .bit.bin cache key from bitstream content hash,
+    arch and bootgen binary'''
+    bootgen = shutil.which('bootgen') or ''
+    method = hashlib.sha256(b'bit.bin\0')
+    for value in (plnx_utils.get_filehashvalue_cached(proot, bitfile),
+                  xilinx_arch, bootgen,
+                  str(plnx_utils.get_file_fingerprint(bootgen))):
+        method.update(value.encode() + b'\0')
+    return method.hexdigest()
+
+
+def convert_bitstream_bin(bitfile, outfiles, xilinx_arch, cache_dir,
+                          cache_key):
+    '''Convert the bitstream into fpga-manager .bit.bin outfiles using
+    bootgen -process_bitstream bin, reuse from cache_dir if converted
+    before. Returns True if converted, False if restored from cache'''
+    outfile = outfiles[0]
+    plnx_utils.CreateDir(os.path.dirname(outfile))
+    tmp_dir = tempfile.mkdtemp(prefix='.bitbin.', dir=os.path.dirname(outfile))
+    converted = False
+    try:
+        bit_name = os.path.basename(outfile)[:-len('.bin')]
+        restored = []
+        if cache_dir:
+            restored = plnx_utils.restore_cache_entry(cache_dir, cache_key,
+                                                      tmp_dir)
+        if restored:
+            os.replace(restored[0], outfile)
+        else:
+            # bootgen writes <bit>.bin next to the bitstream
+            os.symlink(os.path.realpath(bitfile),
+                       os.path.join(tmp_dir, bit_name))
+            biffile = os.path.join(tmp_dir, 'bitbin.bif')
+            plnx_utils.add_str_to_file(biffile, plnx_vars.BitBinBif.format(
+                os.path.join(tmp_dir, bit_name)))
+            plnx_utils.runCmd('bootgen -image %s -arch %s '
+                              '-process_bitstream bin -w'
+                              % (biffile, xilinx_arch), tmp_dir,
+                              failed_msg='Fail to convert %s to bin' % bitfile,
+                              shell=True)
+            os.replace(os.path.join(tmp_dir, bit_name + '.bin'), outfile)
+            converted = True
+            if cache_dir:
+                plnx_utils.store_cache_entry(cache_dir, cache_key, [outfile])
+    finally:
+        plnx_utils.RemoveDir(tmp_dir)
+    # Same bitstream used in other apps
+    for other_outfile in outfiles[1:]:
+        plnx_utils.CreateDir(os.path.dirname(other_outfile))
+        plnx_utils.clone_file(outfile, other_outfile)
+    return converted
+
+
+def get_app_bitstreams(proot):
+    '''Return the (app, SRC_URI entry, bitstream, output .bit.bin) of
+    the .bit files in SRC_URI of dfx_user_dts apps'''
+    bitbin_dir = plnx_vars.BitBinDir.format(proot)
+    bitstreams = []
+    for recipe in sorted(glob.glob(os.path.join(
+            plnx_vars.UserAppsDir.format(proot), '*', '*.bb'))):
+        with open(recipe, 'r') as file_data:
+            content = file_data.read()
+        if not re.search(r'^inherit\s+.*\bdfx_user_dts\b', content, re.M):
+            continue
+        app = os.path.splitext(os.path.basename(recipe))[0]
+        files_dir = os.path.join(os.path.dirname(recipe), 'files')
+        srcuris = re.findall(r'file://[^\s"\\]+\.bit(?=[\s"\\])', content)
+        for srcuri in sorted(set(srcuris)):
+            bitfile = os.path.join(files_dir, srcuri[len('file://'):])
+            if os.path.isfile(bitfile):
+                bitstreams.append((app, srcuri, bitfile, os.path.join(
+                    bitbin_dir, app, os.path.basename(bitfile) + '.bin')))
+    return bitstreams
+
+
+def setup_bitbin_conf(proot, xilinx_arch):
+    '''Convert the .bit files of dfx_user_dts apps into .bit.bin in
+    parallel, bitstreams with same content are converted once. The apps
+    use the converted .bit.bin instead of .bit through BitBinConfFile'''
+    conf_file = plnx_vars.BitBinConfFile.format(proot)
+    bitstreams = []
+    if xilinx_arch in plnx_vars.BitBinArchs and plnx_utils.get_config_value(
+            'CONFIG_SUBSYSTEM_FPGA_MANAGER',
+            plnx_vars.SysConfFile.format(proot)) == 'y':
+        bitstreams = get_app_bitstreams(proot)
+    if bitstreams and not shutil.which('bootgen'):
+        logger.warning('bootgen not found, dfx apps convert their bitstreams '
+                       'while building. Source Xilinx Tools settings to '
+                       'convert them once')
+        bitstreams = []
+    if not bitstreams and not os.path.exists(conf_file):
+        return
+    cache_dir = plnx_utils.get_cache_dir(plnx_vars.BitBinCacheEnv,
+                                         plnx_vars.BitBinCacheDir)
+    # Hash in main thread, the hash cache is not thread safe
+    groups = {}
+    for app, srcuri, bitfile, outfile in bitstreams:
+        cache_key = get_bitbin_cache_key(bitfile, xilinx_arch, proot)
+        groups.setdefault(cache_key, (bitfile, []))[1].append(outfile)
+    if groups:
+        logger.info('Converting %d bitstreams to bin' % len(groups))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 1) as executor:
+        jobs = {executor.submit(convert_bitstream_bin, bitfile, outfiles,
+                                xilinx_arch, cache_dir, cache_key): outfiles
+                for cache_key, (bitfile, outfiles) in groups.items()}
+        for job in concurrent.futures.as_completed(jobs):
+            state = 'Converted' if job.result() else 'Reused'
+            logger.info('%s %s' % (state, ' '.join(jobs[job])))
+    if cache_dir and groups:
+        plnx_utils.evict_lru_cache(cache_dir, plnx_vars.BitBinCacheSizeEnv,
+                                   plnx_vars.BitBinCacheSize)
+    conf = ''
+    for app, srcuri, bitfile, outfile in bitstreams:
+        conf += plnx_vars.BitBinConfStr.format(app, srcuri, outfile)
+    plnx_utils.add_str_to_file(conf_file, conf)
+    localconf_trans = plnx_utils.config_transaction_begin(
+        plnx_vars.LocalConf.format(proot))
+    plnx_utils.config_transaction_add_str(
+        localconf_trans, plnx_vars.BitBinIncludeStr, ignore_if_exists=True)
+    plnx_utils.config_transaction_commit(localconf_trans)
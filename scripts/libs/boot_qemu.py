@@ -9,6 +9,7 @@
 # SPDX-License-Identifier: MIT
 
 import bitbake_utils
+import dtb_utils
 import plnx_utils
 import plnx_vars
 import boot_common
@@ -33,6 +34,8 @@ DEFAULT_ENDIAN = 'little'
 HOST_NET_DEV = "eth"
 SkipAddWic = False
 ExtraArgs = ''
+# MMC and GEM status by DTB hash
+MmcGemStatus = {}
 
 QemuHwDtb = {
     'no_multi_arch': 'zynqmp-qemu-arm.dtb',
@@ -105,27 +108,19 @@ def AutoMmc(Mmc, args, QemuCmd):
 
 def AutoSerial(dtb_file_path, args, QemuCmd):
     QemuSerialArgs = ''
-    dts_file = dtb_file_path.replace('.dtb', '.dts')
-    # Run the dtc command to convert DTB to DTS
-    DtbCmd = 'dtc -I dtb -O dts -o %s %s' % (dts_file, dtb_file_path)
-    stdout = plnx_utils.runCmd(DtbCmd, os.getcwd(),
-                               failed_msg='Fail to convert dtb cmd', shell=True)
-    with open(dts_file, 'r') as file:
-        content = file.read()
-        SerialRegexp = ['serial@[0-9a-zA-Z]+']
-        SerialAliases = re.search(
-            'stdout-path.*', content).group(0).split('=')[1].split(':')[0].replace('"', '')
-        if not SerialAliases:
-            SerialAliases = 'serial0'
-        aliases_match = re.search(r'aliases\s*{([^}]*)}', content)
-        aliases_node = aliases_match.group(1) if aliases_match else None
-        exp = SerialAliases.strip(' ') + '\s*=\s*([^;]+);'
-        SerialInstance = re.search(exp, aliases_node).group(
-            1).split('/')[2].strip(';').strip('"')
-        for lablekey in SerialRegexp:
-            serial_matches = re.findall(lablekey + r'\s*{', content)
-        SerialNum = serial_matches.index(SerialInstance + ' {')
-        SerialCnt = len(serial_matches)
+    dtb = dtb_utils.parse_dtb(dtb_file_path)
+    SerialAliases = dtb_utils.get_node_prop(
+        dtb, '/chosen', 'stdout-path').split(':')[0]
+    if not SerialAliases:
+        SerialAliases = 'serial0'
+    SerialInstance = dtb_utils.resolve_path(dtb, SerialAliases.strip(' '))
+    serial_nodes = [node for node in dtb['order']
+                    if re.search('serial@[0-9a-zA-Z]+$', node)]
+    if SerialInstance not in serial_nodes:
+        raise Exception('Unable to find the stdout serial %s in %s' %
+                        (SerialAliases, dtb_file_path))
+    SerialNum = serial_nodes.index(SerialInstance)
+    SerialCnt = len(serial_nodes)
     for i in range(0, SerialCnt):
         if i == SerialNum:
             QemuSerialArgs += ' -serial mon:stdio'
@@ -157,67 +152,45 @@ def AutoEth(GemCnt, TftpDir):
 
 
 def FindMmcAndGemStatus(dtb_file_path):
-    dts_file = dtb_file_path.replace('.dtb', '.dts')
-    # Run the dtc command to convert DTB to DTS
-    DtbCmd = 'dtc -I dtb -O dts -o %s %s' % (dts_file, dtb_file_path)
+    dtb = dtb_utils.parse_dtb(dtb_file_path)
+    if dtb['hash'] in MmcGemStatus:
+        return MmcGemStatus[dtb['hash']]
     counter = []
-    stdout = plnx_utils.runCmd(DtbCmd, os.getcwd(),
-                               failed_msg='Fail to convert dtb cmd', shell=True)
-    with open(dts_file, 'r') as file:
-        content = file.read()
-        sdhci_regexp = ['sdhci[0-9]+']
-        gem_regexp = ['gem[0-9]+', 'ethernet.*[0-9]+']
-        mmc_counter = []
-        gem_counter = []
-        symbol_match = re.search(r'__symbols__\s*{([^}]*)}', content)
-        symbol_node = symbol_match.group(1) if symbol_match else None
-        if symbol_node:
-            sdhci_labels = []
-            gem_labels = []
-            for lablekey in sdhci_regexp:
-                sdhci_matches = re.findall(
-                    lablekey + r'\s*=\s*([^;]+);', symbol_node)
-                sdhci_labels += [match.strip() for match in sdhci_matches]
-            for lablekey in gem_regexp:
-                gem_matches = re.findall(
-                    lablekey + r'\s*=\s*([^;]+);', symbol_node)
-                gem_labels += [match.strip() for match in gem_matches]
-            mmc_counter = FindMmcEthNode(sdhci_labels, content)
-            counter.append(mmc_counter)
-            gem_counter = FindMmcEthNode(gem_labels, content)
-            counter.append(gem_counter)
+    sdhci_regexp = ['sdhci[0-9]+']
+    gem_regexp = ['gem[0-9]+', 'ethernet.*[0-9]+']
+    if dtb['labels']:
+        sdhci_labels = []
+        gem_labels = []
+        for lablekey in sdhci_regexp:
+            sdhci_labels += [path for label, path in dtb['labels'].items()
+                             if re.search(lablekey + '$', label)]
+        for lablekey in gem_regexp:
+            gem_labels += [path for label, path in dtb['labels'].items()
+                           if re.search(lablekey + '$', label)]
+        counter.append(FindMmcEthNode(sdhci_labels, dtb))
+        counter.append(FindMmcEthNode(gem_labels, dtb))
+    MmcGemStatus[dtb['hash']] = counter
     return counter
 
 
-def FindMmcEthNode(labels, content):
-    generic_address = None
-    generic_status = None
+def FindMmcEthNode(labels, dtb):
     counter = []
-    gem_num = 0
     emmc_mode = 6
 
-    for label in labels:
-        generic_match = label.replace('"', '').split('/')[2]
-        if generic_match:
-            generic_node_match = re.search(
-                r'{}(\s*{{\s*[^}}]+}})'.format(re.escape(generic_match)), content)
-            gem_num += 1
-            if generic_node_match:
-                generic_node_content = generic_node_match.group(1)
-                non_removable_match = re.search(
-                    r'non-removable(\s*;)?', generic_node_content)
-                generic_status_match = re.search(
-                    r'status\s*=\s*"([^"]+)"', generic_node_content)
-                if generic_status_match:
-                    generic_status = generic_status_match.group(1)
-
-        if (generic_node_match and non_removable_match) and (generic_status == "okay" or not generic_status_match):
+    for gem_num, label in enumerate(labels):
+        node = dtb['nodes'].get(label)
+        if node is None:
+            continue
+        status = dtb_utils.get_node_prop(dtb, label, 'status')
+        if status and status != 'okay':
+            continue
+        if 'non-removable' in node:
             return emmc_mode
-        elif generic_node_match and (generic_status == "okay" or not generic_status_match):
-            counter.append(gem_num-1)
+        counter.append(gem_num)
 
     return counter
 
+
 def AddPmuConf(args, proot, arch, prebuilt, rootfs_type):
     '''Add pmc-conf.bin file to bootparam dict'''
     images_dir = plnx_vars.PreBuildsImagesDir.format(proot) if prebuilt \
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import time
+import bitstream_utils
+
+logger = logging.getLogger('PetaLinux')
+
+# Flash interfaces supported by native cfgmem writer, BPI/SMAP
+# bitstreams are bit swapped per byte by vivado so they are not supported
+CfgMemInterfaces = ('SPIx1', 'SPIx2', 'SPIx4')
+CfgMemBlockSize = 1024 * 1024
+# Intel HEX data bytes per record and address segment size
+McsRecordSize = 16
+McsSegmentSize = 0x10000
+
+
+def get_cfgmem_region(offset, filename, loadbit=False):
+    '''Return the (offset, file, data offset, data length) of file
+    For bitstream only the configuration data without .bit header'''
+    data_offset = 0
+    data_length = os.path.getsize(filename)
+    if loadbit:
+        with open(filename, 'rb') as file_data:
+            header = bitstream_utils.parse_bit_header(
+                file_data.read(bitstream_utils.BitHeaderReadSize))
+        if 'data_offset' in header:
+            data_offset = header['data_offset']
+            data_length = min(header['data_length'],
+                              data_length - data_offset)
+    return (offset, filename, data_offset, data_length)
+
+
+def validate_cfgmem_regions(regions, flash_size):
+    '''Check the regions are not overlapping and fit in flash size(MB)'''
+    regions = sorted(regions)
+    end = 0
+    for offset, filename, data_offset, data_length in regions:
+        if offset < end:
+            raise Exception('File %s at 0x%x overlaps with the previous file'
+                            % (filename, offset))
+        end = offset + data_length
+    if end > int(flash_size) * 1024 * 1024:
+        raise Exception('Files end at 0x%x, exceeds the flash size %sMB'
+                        % (end, flash_size))
+    return regions
+
+
+def read_cfgmem_region(region):
+    '''Yield the data of region in blocks'''
+    offset, filename, data_offset, data_length = region
+    with open(filename, 'rb') as file_data:
+        file_data.seek(data_offset)
+        while data_length > 0:
+            data = file_data.read(min(CfgMemBlockSize, data_length))
+            if not data:
+                break
+            data_length -= len(data)
+            yield data
+
+
+def mcs_record(address, record_type, data):
+    '''Return the Intel HEX record line'''
+    record = bytes([len(data), (address >> 8) & 0xff, address & 0xff,
+                    record_type]) + data
+    checksum = (-sum(record)) & 0xff
+    return ':%s%02X\n' % (record.hex().upper(), checksum)
+
+
+def mcs_data_records(address, data, segment):
+    '''Return the records of data at address and the last segment
+    Records are not crossing the 64KiB address segment boundary'''
+    lines = []
+    position = 0
+    while position < len(data):
+        if address // McsSegmentSize != segment:
+            segment = address // McsSegmentSize
+            lines.append(mcs_record(0, 0x04, segment.to_bytes(2, 'big')))
+        size = min(McsRecordSize, McsSegmentSize - address % McsSegmentSize,
+                   len(data) - position)
+        lines.append(mcs_record(address % McsSegmentSize, 0x00,
+                                data[position:position + size]))
+        position += size
+        address += size
+    return ''.join(lines), segment
+
+
+def write_mcs(regions, outfile):
+    '''Write the regions into Intel HEX MCS file'''
+    segment = None
+    with open(outfile, 'w') as out_data:
+        for region in regions:
+            address = region[0]
+            for data in read_cfgmem_region(region):
+                lines, segment = mcs_data_records(address, data, segment)
+                out_data.write(lines)
+                address += len(data)
+        out_data.write(mcs_record(0, 0x01, b''))
+
+
+def write_bin(regions, outfile, image_size=0, fill=0xff):
+    '''Write the regions into raw BIN file, gaps and the end up to
+    image_size filled with fill byte, zero fill gaps are left as holes'''
+    position = 0
+    padding = bytes([fill]) * CfgMemBlockSize
+
+    def pad_to(out_data, position, end):
+        if not fill:
+            position = max(position, end)
+            out_data.seek(position)
+            return position
+        while position < end:
+            size = min(CfgMemBlockSize, end - position)
+            out_data.write(padding[:size])
+            position += size
+        return position
+
+    with open(outfile, 'wb') as out_data:
+        for region in regions:
+            position = pad_to(out_data, position, region[0])
+            for data in read_cfgmem_region(region):
+                out_data.write(data)
+                position += len(data)
+        position = pad_to(out_data, position, image_size)
+        out_data.truncate(position)
+
+
+def write_prm(regions, flash_size, interface, outformat, outfile):
+    '''Write the PRM file of regions in vivado write_cfgmem layout,
+    address range and date of each file in the flash image'''
+    lines = ['// %s' % time.ctime(),
+             '// Memory Configuration File Settings',
+             '// -format %s' % outformat,
+             '// -size %s' % flash_size,
+             '// -interface %s' % interface,
+             '//',
+             '// Memory Configuration File Data Summary',
+             '// Start Address: 0x%08X' % (regions[0][0] if regions else 0),
+             '// End Address: 0x%08X' % (int(flash_size) * 1024 * 1024 - 1),
+             '//',
+             '// Addr1         Addr2         Date                    File(s)']
+    for offset, filename, data_offset, data_length in regions:
+        lines.append('0x%08X    0x%08X    %s    %s' % (
+            offset, offset + max(data_length, 1) - 1,
+            time.strftime('%b %d %H:%M:%S %Y',
+                          time.localtime(os.path.getmtime(filename))),
+            filename))
+    with open(outfile, 'w') as out_data:
+        out_data.write('\n'.join(lines) + '\n')
+
+
+def write_cfgmem(regions, flash_size, interface, outformat, outfile):
+    '''Write the MCS or BIN flash image of regions and the PRM file
+    next to it same as vivado write_cfgmem
+    regions - list of get_cfgmem_region, offsets in bytes'''
+    if interface not in CfgMemInterfaces:
+        raise Exception('Flash interface %s is not supported by native '
+                        'cfgmem writer, supported: %s'
+                        % (interface, ' '.join(CfgMemInterfaces)))
+    regions = validate_cfgmem_regions(regions, flash_size)
+    if outformat == 'MCS':
+        write_mcs(regions, outfile)
+    else:
+        write_bin(regions, outfile)
+    write_prm(regions, flash_size, interface, outformat,
+              os.path.splitext(outfile)[0] + '.prm')
+
+
+def read_mcs(filename):
+    '''Return the flash data of Intel HEX MCS file,
+    gaps are filled with 0xff'''
+    image = bytearray()
+    base = 0
+    with open(filename, 'r') as file_data:
+        for line in file_data:
+            line = line.strip()
+            if not line.startswith(':'):
+                continue
+            record = bytes.fromhex(line[1:])
+            if sum(record) & 0xff:
+                raise Exception('Invalid checksum in %s: %s'
+                                % (filename, line))
+            length, record_type = record[0], record[3]
+            data = record[4:4 + length]
+            if record_type == 0x00:
+                address = base + (record[1] << 8 | record[2])
+                if len(image) < address:
+                    image.extend(b'\xff' * (address - len(image)))
+                image[address:address + length] = data
+            elif record_type == 0x01:
+                break
+            elif record_type == 0x02:
+                base = int.from_bytes(data, 'big') << 4
+            elif record_type == 0x04:
+                base = int.from_bytes(data, 'big') << 16
+    return image
+
+
+def compare_cfgmem(reffile, outfile, outformat):
+    '''Compare the flash data of outfile with reffile(vivado generated)
+    Returns the first mismatched offset, None if same'''
+    images = []
+    for filename in (reffile, outfile):
+        if outformat == 'MCS':
+            image = read_mcs(filename)
+        else:
+            with open(filename, 'rb') as file_data:
+                image = bytearray(file_data.read())
+        images.append(bytes(image).rstrip(b'\xff'))
+    if images[0] == images[1]:
+        return None
+    for offset, (ref, out) in enumerate(zip(images[0], images[1])):
+        if ref != out:
+            return offset
+    return min(len(images[0]), len(images[1]))
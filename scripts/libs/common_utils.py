@@ -17,6 +17,11 @@ import sys
 
 logger = logging.getLogger('PetaLinux')
 
+HashBlockSize = 1024 * 1024
+HashThreadedEnv = 'PLNX_HASH_THREADED'
+# ioctl to reflink the file
+FICLONE = 0x40049409
+
 
 def CreateDir(dirpath):
     '''Creates Directory'''
@@ -47,6 +52,16 @@ def RenameFile(infile, outfile):
         os.rename(infile, outfile)
 
 
+def MoveFile(infile, outfile):
+    '''Rename File, copy keeping the holes if on other filesystem'''
+    try:
+        os.replace(infile, outfile)
+    except OSError:
+        clone_file(infile, outfile)
+        shutil.copystat(infile, outfile)
+        os.remove(infile)
+
+
 def RemoveDir(dirpath):
     '''Remove Directory'''
     if os.path.exists(dirpath):
@@ -73,9 +88,18 @@ def CopyDir(indir, outdir, exclude=''):
 
 
 def CopyFile(infile, dest, follow_symlinks=False):
-    '''Copy File to Dir'''
+    '''Copy File to Dir, holes in sparse files are kept'''
     if os.path.isfile(infile):
-        shutil.copy2(infile, dest, follow_symlinks=follow_symlinks)
+        if os.path.islink(infile) and not follow_symlinks:
+            shutil.copy2(infile, dest, follow_symlinks=follow_symlinks)
+            return
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(infile))
+        if os.path.exists(dest) and os.path.samefile(infile, dest):
+            raise shutil.SameFileError('%s and %s are the same file'
+                                       % (infile, dest))
+        clone_file(infile, dest)
+        shutil.copystat(infile, dest)
 
 
 def add_offsets(start, end):
@@ -117,14 +141,17 @@ def IsElfFile(filepath):
 
 
 def runCmd(command, out_dir, extraenv=None,
-           failed_msg='', shell=False, checkcall=False):
-    '''Run Shell commands from python'''
+           failed_msg='', shell=False, checkcall=False, unsetenv=None):
+    '''Run Shell commands from python
+    unsetenv - env variables to remove from the command environment'''
     command = command.split() if not shell else command
     logger.debug(command)
     env = os.environ.copy()
     if extraenv:
         for k in extraenv:
             env[k] = extraenv[k]
+    for k in unsetenv or []:
+        env.pop(k, None)
     if checkcall:
         subprocess.check_call(
             command, env=extraenv, cwd=out_dir, shell=shell)
@@ -170,34 +197,124 @@ def replace_str_fromdir(dirpath, search_str, replace_str, include_dir_names=Fals
                 fpath = os.path.join(dname, fname)
             with open(fpath, 'w') as f:
                 f.write(s)
+            invalidate_config_cache(fpath)
+
+
+def write_file_atomic(filename, content):
+    '''Write the content into a temp file in same directory and
+    rename it to filename, so the file never left half written'''
+    import tempfile
+    filepath = os.path.realpath(filename)
+    filedir = os.path.dirname(filepath)
+    if os.path.exists(filepath):
+        filemode = os.stat(filepath).st_mode & 0o7777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        filemode = 0o666 & ~umask
+    fd, tmpfile = tempfile.mkstemp(prefix='.%s.' % os.path.basename(filepath),
+                                   dir=filedir)
+    try:
+        with os.fdopen(fd, 'w') as file_data:
+            file_data.write(content)
+        os.chmod(tmpfile, filemode)
+        os.replace(tmpfile, filepath)
+    except BaseException:
+        RemoveFile(tmpfile)
+        raise
+    invalidate_config_cache(filename)
+    invalidate_config_cache(filepath)
+
+
+def split_file_lines(content):
+    '''Split the content into lines same as file readlines'''
+    import io
+    return io.StringIO(content, newline='\n').readlines()
+
+
+def config_transaction_begin(filename):
+    '''Start a config transaction on filename.
+    Edits are collected in memory and written at once by
+    config_transaction_commit'''
+    return {'filename': filename, 'edits': []}
+
+
+def config_transaction_update_value(trans, macro, value):
+    '''Queue update_config_value edit'''
+    trans['edits'].append(('update', re.compile(
+        '(?:# %s is not set)|(?:%s=)' % (macro, macro)), macro, value))
+
+
+def config_transaction_remove_str(trans, string):
+    '''Queue remove_str_from_file edit'''
+    trans['edits'].append(('remove', re.compile(string)))
+
+
+def config_transaction_add_str(trans, string, ignore_if_exists=False, mode='a+'):
+    '''Queue add_str_to_file edit, mode "w" replaces the file content'''
+    regex = re.compile(string) if ignore_if_exists else None
+    trans['edits'].append(('add', regex, string, mode))
+
+
+def config_transaction_replace_str(trans, search_str, replace_str):
+    '''Queue plain string replacement edit'''
+    trans['edits'].append(('replace', search_str, replace_str))
+
+
+def config_transaction_commit(trans):
+    '''Apply all the queued edits on file content and write it once'''
+    filename = trans['filename']
+    exists = os.path.exists(filename)
+    content = ''
+    if exists:
+        with open(filename, 'r') as file_data:
+            content = file_data.read()
+    old_content = content
+    create = False
+    for edit in trans['edits']:
+        if edit[0] == 'update':
+            regex, macro, value = edit[1:]
+            content = ''.join(line for line in split_file_lines(content)
+                              if not regex.search(line))
+            if value == 'disable':
+                content += '# %s is not set\n' % macro
+            else:
+                content += '%s=%s\n' % (macro, value)
+            create = True
+        elif edit[0] == 'remove':
+            regex = edit[1]
+            content = ''.join(line for line in split_file_lines(content)
+                              if not regex.search(line))
+        elif edit[0] == 'add':
+            regex, string, mode = edit[1:]
+            if regex and any(regex.match(line)
+                             for line in split_file_lines(content)):
+                continue
+            if mode == 'w':
+                content = string
+            else:
+                content += string
+            create = True
+        elif edit[0] == 'replace':
+            content = content.replace(edit[1], edit[2])
+    trans['edits'] = []
+    if content != old_content or (create and not exists):
+        write_file_atomic(filename, content)
 
 
 def remove_str_from_file(filename, string):
     '''Remove the line that matches with string'''
-    lines = []
     if os.path.exists(filename):
-        with open(filename, 'r') as file_data:
-            lines = file_data.readlines()
-        with open(filename, 'w') as file_data:
-            for line in lines:
-                if re.search(string, line):
-                    continue
-                file_data.write(line)
+        trans = config_transaction_begin(filename)
+        config_transaction_remove_str(trans, string)
+        config_transaction_commit(trans)
 
 
 def add_str_to_file(filename, string, ignore_if_exists=False, mode='w'):
     '''Add string or line into the given file and ignore if already exists in file'''
-    lines = []
-    string_found = False
-    if os.path.exists(filename):
-        with open(filename, 'r') as file_data:
-            lines = file_data.readlines()
-    for line in lines:
-        if re.match(string, line):
-            string_found = True
-    if not ignore_if_exists or not string_found:
-        with open(filename, mode) as file_f:
-            file_f.write(string)
+    trans = config_transaction_begin(filename)
+    config_transaction_add_str(trans, string, ignore_if_exists, mode)
+    config_transaction_commit(trans)
 
 
 def concate_files(fromfile, tofile):
@@ -205,24 +322,191 @@ def concate_files(fromfile, tofile):
     with open(tofile, 'a') as tofile_f:
         with open(fromfile, 'r') as fromfile_f:
             tofile_f.write(fromfile_f.read())
+    invalidate_config_cache(tofile)
 
 
-def get_filehashvalue(filename):
-    '''Get sha256 for given file'''
+def get_filehashvalue(filename, threaded=None):
+    '''Get sha256 for given file
+    threaded mode reads the next block in a separate thread while
+    hashing the current one, default from PLNX_HASH_THREADED env'''
     import hashlib
-    import mmap
     method = hashlib.sha256()
+    if threaded is None:
+        threaded = os.environ.get(HashThreadedEnv, '') == '1'
     with open(filename, "rb") as f:
-        try:
-            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                for chunk in iter(lambda: mm.read(8192), b''):
+        if not threaded:
+            for chunk in iter(lambda: f.read(HashBlockSize), b''):
+                method.update(chunk)
+        else:
+            # hashlib releases the GIL while hashing large blocks
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                chunk = f.read(HashBlockSize)
+                while chunk:
+                    future = executor.submit(f.read, HashBlockSize)
                     method.update(chunk)
-        except ValueError:
-            # You can't mmap() an empty file so silence this exception
-            pass
+                    chunk = future.result()
     return method.hexdigest()
 
 
+def get_data_ranges(fileno, size):
+    '''Return the (start, end) offsets of data in file skipping holes,
+    whole file is data if the filesystem does not report holes'''
+    import errno
+    if not hasattr(os, 'SEEK_DATA'):
+        return [(0, size)] if size else []
+    ranges = []
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fileno, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only hole till the end
+                break
+            return [(0, size)] if size else []
+        end = min(os.lseek(fileno, start, os.SEEK_HOLE), size)
+        ranges.append((start, end))
+        offset = end
+    return ranges
+
+
+def copy_file_data(src, dest, start, end):
+    '''Copy the src file data from start to end at same offset in dest
+    using in kernel copy_file_range if supported'''
+    offset = start
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(src.fileno(), dest.fileno(),
+                                            min(end - offset,
+                                                HashBlockSize * 64),
+                                            offset, offset)
+                if not copied:
+                    break
+                offset += copied
+            return
+        except OSError:
+            # Not supported, copy remaining with read and write
+            pass
+    src.seek(offset)
+    dest.seek(offset)
+    while offset < end:
+        data = src.read(min(HashBlockSize, end - offset))
+        if not data:
+            break
+        dest.write(data)
+        offset += len(data)
+
+
+def clone_file(infile, outfile):
+    '''Copy the file using reflink if the filesystem supports it,
+    fallback to in kernel copy_file_range and regular copy of the data
+    ranges, holes are kept in outfile'''
+    import fcntl
+    with open(infile, 'rb') as src, open(outfile, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+        size = os.fstat(src.fileno()).st_size
+        for start, end in get_data_ranges(src.fileno(), size):
+            copy_file_data(src, dest, start, end)
+        dest.truncate(size)
+
+
+def get_cache_dir(cache_env, default_dir):
+    '''Return the cache dir from env or default, empty if disabled'''
+    cache_dir = os.environ.get(cache_env)
+    if cache_dir is None:
+        cache_dir = default_dir
+    return os.path.expanduser(cache_dir.strip())
+
+
+def evict_lru_cache(cache_dir, size_env, default_size):
+    '''Remove least recently used cache entries(sub directories)
+    exceeding the size limit in MB given by size_env'''
+    size_limit = os.environ.get(size_env, default_size)
+    try:
+        size_limit = int(size_limit) * 1024 * 1024
+    except ValueError:
+        logger.warning('Invalid %s value "%s", it should be size in MB'
+                       % (size_env, size_limit))
+        return
+    entries = []
+    total_size = 0
+    for entry in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, entry)
+        if entry.startswith('.') or not os.path.isdir(entry_dir):
+            continue
+        entry_size = 0
+        for dname, dirs, files in os.walk(entry_dir):
+            for fname in files:
+                fingerprint = get_file_fingerprint(os.path.join(dname, fname))
+                if fingerprint:
+                    entry_size += fingerprint[1]
+        try:
+            entries.append((os.stat(entry_dir).st_mtime_ns,
+                            entry_dir, entry_size))
+        except OSError:
+            continue
+        total_size += entry_size
+    for mtime, entry_dir, entry_size in sorted(entries):
+        if total_size <= size_limit:
+            break
+        logger.debug('Evicting cache %s' % entry_dir)
+        RemoveDir(entry_dir)
+        total_size -= entry_size
+
+
+def store_cache_entry(cache_dir, cache_key, files):
+    '''Store the given files into cache_dir/cache_key entry'''
+    import json
+    import tempfile
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if os.path.exists(entry_dir):
+        return
+    try:
+        CreateDir(cache_dir)
+        tmp_dir = tempfile.mkdtemp(prefix='.%s.' % cache_key, dir=cache_dir)
+    except OSError as e:
+        logger.debug('Unable to create cache in %s: %s' % (cache_dir, e))
+        return
+    try:
+        CreateDir(os.path.join(tmp_dir, 'files'))
+        names = []
+        for filename in files:
+            names.append(os.path.basename(filename))
+            clone_file(filename, os.path.join(tmp_dir, 'files', names[-1]))
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as file_data:
+            json.dump({'files': names}, file_data)
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        logger.debug('Unable to store cache %s: %s' % (entry_dir, e))
+        RemoveDir(tmp_dir)
+
+
+def restore_cache_entry(cache_dir, cache_key, outdir):
+    '''Restore the files of cache_dir/cache_key entry into outdir
+    Returns the restored files, empty if not cached'''
+    import json
+    entry_dir = os.path.join(cache_dir, cache_key)
+    restored = []
+    try:
+        with open(os.path.join(entry_dir, 'manifest.json'), 'r') as file_data:
+            names = json.load(file_data)['files']
+        CreateDir(outdir)
+        for name in names:
+            restored.append(os.path.join(outdir, name))
+            clone_file(os.path.join(entry_dir, 'files', name), restored[-1])
+        # Mark the entry as recently used for LRU eviction
+        os.utime(entry_dir)
+    except (OSError, ValueError, KeyError):
+        return []
+    return restored
+
+
 def get_free_port(port=9000):
     '''Get the free port to use'''
     import socket, random
@@ -242,53 +526,99 @@ def get_free_port(port=9000):
 
 def update_config_value(macro, value, filename):
     '''Update the value for macro in a given filename'''
-    lines = []
-    if os.path.exists(filename):
-        with open(filename, 'r') as file_data:
-            lines = file_data.readlines()
-        file_data.close()
+    trans = config_transaction_begin(filename)
+    config_transaction_update_value(trans, macro, value)
+    config_transaction_commit(trans)
 
-    with open(filename, 'w') as file_data:
-        for line in lines:
-            if re.search('# %s is not set' % macro, line) or re.search('%s=' % macro, line):
-                continue
-            file_data.write(line)
-        if value == 'disable':
-            file_data.write('# %s is not set\n' % macro)
-        else:
-            file_data.write('%s=%s\n' % (macro, value))
-    file_data.close()
+
+# Parsed config files cache
+# Key is the config file path, value is a dict with the
+# stat fingerprint the file was parsed at and the parsed index
+ConfigFileCache = {}
+
+
+def get_file_fingerprint(filename):
+    '''Return the (mtime, size, inode) fingerprint of given file'''
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def invalidate_config_cache(filename=''):
+    '''Drop the parsed data of filename or all files from cache'''
+    if filename:
+        ConfigFileCache.pop(os.path.abspath(filename), None)
+    else:
+        ConfigFileCache.clear()
+
+
+def parse_config_file(filename):
+    '''Parse the config file once and keep it in ConfigFileCache
+    till the file (mtime, size, inode) changes.
+    lines  - stripped lines in file order
+    keys   - macro to first line index for "macro=value" lines
+    prefix - sorted (line, line index) list to search lines by prefix'''
+    filepath = os.path.abspath(filename)
+    fingerprint = get_file_fingerprint(filepath)
+    cached = ConfigFileCache.get(filepath)
+    if cached and cached['fingerprint'] == fingerprint:
+        return cached
+    lines = []
+    if fingerprint:
+        with open(filepath, 'r') as file_data:
+            lines = [line.strip() for line in file_data.readlines()]
+    keys = {}
+    for index, line in enumerate(lines):
+        if '=' in line:
+            keys.setdefault(line.split('=', 1)[0], index)
+    prefix = sorted((line, index) for index, line in enumerate(lines) if line)
+    cached = {'fingerprint': fingerprint, 'lines': lines,
+              'keys': keys, 'prefix': prefix}
+    ConfigFileCache[filepath] = cached
+    return cached
+
+
+def get_config_lines_startswith(macro, filename):
+    '''Return the lines starting with macro in file order'''
+    import bisect
+    config = parse_config_file(filename)
+    prefix = config['prefix']
+    matches = []
+    pos = bisect.bisect_left(prefix, (macro, -1))
+    while pos < len(prefix) and prefix[pos][0].startswith(macro):
+        matches.append(prefix[pos][1])
+        pos += 1
+    return [config['lines'][index] for index in sorted(matches)]
 
 
 def get_config_value(macro, filename, Type='bool', end_macro='=y'):
     '''Get the macro value from given filename'''
-    lines = []
-    if os.path.exists(filename):
-        with open(filename, 'r') as file_data:
-            lines = file_data.readlines()
-        file_data.close()
     value = ''
     if Type == 'bool':
-        for line in lines:
-            line = line.strip()
-            if line.startswith(macro + '='):
-                value = line.replace(macro + '=', '').replace('"', '')
-                break
+        config = parse_config_file(filename)
+        index = config['keys'].get(macro)
+        if index is None and '=' in macro:
+            # Macro itself has '=', fallback to prefix search
+            lines = get_config_lines_startswith(macro + '=', filename)
+            line = lines[0] if lines else ''
+        else:
+            line = config['lines'][index] if index is not None else ''
+        if line:
+            value = line.replace(macro + '=', '').replace('"', '')
     elif Type == 'choice':
-        for line in lines:
-            line = line.strip()
-            if line.startswith(macro) and line.endswith(end_macro):
+        for line in get_config_lines_startswith(macro, filename):
+            if line.endswith(end_macro):
                 value = line.replace(macro, '').replace(end_macro, '')
                 break
     elif Type == 'choicelist':
-        for line in lines:
-            line = line.strip()
-            if line.startswith(macro) and line.endswith(end_macro):
+        for line in get_config_lines_startswith(macro, filename):
+            if line.endswith(end_macro):
                 value += ' ' + line.replace(macro, '').replace(end_macro, '')
     elif Type == 'asterisk':
-        for line in lines:
-            line = line.strip()
-            if line.startswith(macro) and re.search(end_macro, line):
+        for line in get_config_lines_startswith(macro, filename):
+            if re.search(end_macro, line):
                 value = line.split('=')[1].replace('"', '')
                 break
     return value
@@ -363,7 +693,8 @@ def HighestPowerof2(FilePath):
         return Size_
 
 def MakePowerof2(Image):
+    '''Extend the raw image to power of 2 size for QEMU SD,
+    extended part is left as hole'''
     Power2Size = HighestPowerof2(Image)
-    QemuImgCmd = 'qemu-img resize -f raw %s %s' % (Image, Power2Size)
-    stdout = runCmd(QemuImgCmd, os.getcwd(),
-                               failed_msg='Fail to launch qemu img cmd', shell=True, checkcall=True)
+    if Power2Size and Power2Size != GetFileSize(Image):
+        os.truncate(Image, Power2Size)
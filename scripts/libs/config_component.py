@@ -45,10 +45,13 @@ def get_hw_file(hw_file, hw_ext, proot):
     '''Copy HW file into project and rename to system.xsa'''
     plnx_utils.RemoveDir(plnx_vars.HWDescDir.format(proot))
     plnx_utils.CreateDir(plnx_vars.HWDescDir.format(proot))
-    plnx_utils.update_config_value('HARDWARE_PATH', hw_file,
-                                   plnx_vars.MetaDataFile.format(proot))
-    plnx_utils.update_config_value('HDF_EXT', hw_ext,
-                                   plnx_vars.MetaDataFile.format(proot))
+    metadata_trans = plnx_utils.config_transaction_begin(
+        plnx_vars.MetaDataFile.format(proot))
+    plnx_utils.config_transaction_update_value(
+        metadata_trans, 'HARDWARE_PATH', hw_file)
+    plnx_utils.config_transaction_update_value(
+        metadata_trans, 'HDF_EXT', hw_ext)
+    plnx_utils.config_transaction_commit(metadata_trans)
     if hw_ext == 'sdt':
         plnx_utils.CopyDir(os.path.dirname(hw_file),
                            plnx_vars.HWDescDir.format(proot),
@@ -10,7 +10,6 @@
 
 import logging
 import os
-import re
 import subprocess
 import sys
 import bitbake_utils
@@ -143,79 +142,79 @@ def Createproject(args, proot, cpath):
         is_tmpdir_nfs(args.tmpdir)
     projects2extract = []
     if args.source:
-        # BSP project setup
-        projects = plnx_utils.get_plnx_projects_from_bsp(args.source)
-        if not projects:
+        # BSP project setup, extract all projects in single pass and
+        # move the selected ones from the staging dir
+        plnx_utils.CreateDir(cpath)
+        staging_dir, projects = plnx_utils.extract_bsp_projects(
+            args.source, cpath)
+        installed_proj = []
+        try:
+            if not projects:
+                if args.name:
+                    plnx_utils.RemoveDir(cpath)
+                logger.error(
+                    'No PetaLinux projects found in the BSP %s' % args.source)
+                sys.exit(255)
             if args.name:
-                plnx_utils.RemoveDir(cpath)
-            logger.error(
-                'No PetaLinux projects found in the BSP %s' % args.source)
-            sys.exit(255)
-        if args.name:
-            defaultproj = projects[0]
-            while defaultproj != ' '.join(projects):
-                # If component name specified and source has multiple projects
-                # Ask users to input the project name or use default project.
-                logger.info('Available projects: %s' % (' '.join(projects)))
-                user_in = input(
-                    'Please type the reference project? (%s):' % defaultproj)
-                user_in = user_in.strip()
-                refproject = ''
-                if not user_in:
-                    refproject = defaultproj
+                defaultproj = projects[0]
+                while defaultproj != ' '.join(projects):
+                    # If component name specified and source has multiple projects
+                    # Ask users to input the project name or use default project.
+                    logger.info('Available projects: %s' % (' '.join(projects)))
+                    user_in = input(
+                        'Please type the reference project? (%s):' % defaultproj)
+                    user_in = user_in.strip()
+                    refproject = ''
+                    if not user_in:
+                        refproject = defaultproj
+                    for p in projects:
+                        if p == user_in:
+                            refproject = p
+                    if refproject:
+                        projects2extract.append(refproject)
+                        break
+                if not projects2extract:
+                    projects2extract.append(defaultproj)
+            else:
                 for p in projects:
-                    if p == user_in:
-                        refproject = p
-                if refproject:
-                    projects2extract.append(refproject)
-                    break
-            if not projects2extract:
-                projects2extract.append(defaultproj)
-        else:
-            for p in projects:
-                if os.path.exists(p):
-                    user_force = False
-                    if not args.force:
-                        user_in = input(
-                            'Project %s/%s already exists. Please input "y" to overwrite:' % (cpath, p))
-                        user_in = user_in.strip()
-                        if user_in in ['y', 'Y']:
-                            user_force = True
-                        else:
-                            logger.info('Will skip project %s' % p)
+                    if os.path.exists(p):
+                        user_force = False
+                        if not args.force:
+                            user_in = input(
+                                'Project %s/%s already exists. Please input "y" to overwrite:' % (cpath, p))
+                            user_in = user_in.strip()
+                            if user_in in ['y', 'Y']:
+                                user_force = True
+                            else:
+                                logger.info('Will skip project %s' % p)
 
-                    if args.force or user_force:
-                        # Delete any earlier backup copy
-                        plnx_utils.RemoveDir(os.path.join(cpath, p) + '_old')
-                        # Rename the current dir
-                        plnx_utils.RenameDir(os.path.join(cpath, p),
-                                             os.path.join(cpath, p) + '_old')
+                        if args.force or user_force:
+                            # Delete any earlier backup copy
+                            plnx_utils.RemoveDir(os.path.join(cpath, p) + '_old')
+                            # Rename the current dir
+                            plnx_utils.RenameDir(os.path.join(cpath, p),
+                                                 os.path.join(cpath, p) + '_old')
+                            projects2extract.append(p)
+                    else:
                         projects2extract.append(p)
-                else:
-                    projects2extract.append(p)
 
-        installed_proj = []
+            for project in projects2extract:
+                if args.name:
+                    # Project content into the given name
+                    for entry in os.listdir(os.path.join(staging_dir, project)):
+                        plnx_utils.RemoveDir(os.path.join(cpath, entry))
+                        plnx_utils.RemoveFile(os.path.join(cpath, entry))
+                        os.rename(os.path.join(staging_dir, project, entry),
+                                  os.path.join(cpath, entry))
+                else:
+                    os.rename(os.path.join(staging_dir, project),
+                              os.path.join(cpath, project))
+        finally:
+            plnx_utils.RemoveDir(staging_dir)
         for project in projects2extract:
             proot = cpath
             if not args.name:
                 proot = os.path.join(cpath, project)
-            plnx_utils.CreateDir(cpath)
-            tar_extraargs = ''
-            if len(projects2extract) > 1:
-                tar_extraargs = '-C "%s"' % (cpath)
-            elif args.name:
-                tar_extraargs = '--strip-components=1'
-            # Use the tar args based on the compressed type
-            stdout = plnx_utils.GetFileType(args.source)
-            tar_args = '-xzf'
-            if bool(re.search('xz compressed', stdout.lower())):
-                tar_args = '-xJf'
-            tar_cmd = 'tar %s "%s" "%s" %s' % (tar_args,
-                args.source, project, tar_extraargs)
-            msgonfail = 'Failed to extract %s from BSP %s!' % (
-                project, args.source)
-            cmd_status = plnx_utils.runCmd(
-                tar_cmd, cpath, failed_msg=msgonfail, shell=True)
             create_tmpdir_ifnfs(proot, project, args.tmpdir)
             installed_proj.append(project)
 
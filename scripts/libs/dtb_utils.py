@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import logging
+import struct
+
+logger = logging.getLogger('PetaLinux')
+
+FdtMagic = 0xd00dfeed
+FdtBeginNode = 0x1
+FdtEndNode = 0x2
+FdtProp = 0x3
+FdtNop = 0x4
+FdtEnd = 0x9
+
+# Parsed DTBs by content hash
+DtbCache = {}
+
+
+def parse_dtb(dtb_file):
+    '''Parse the flattened device tree blob and return the index
+    {'hash', 'order': [node paths in tree order],
+     'nodes': {path: {property: value bytes}},
+     'labels': {label: path}, 'aliases': {alias: path}}'''
+    with open(dtb_file, 'rb') as file_data:
+        blob = file_data.read()
+    dtb_hash = hashlib.sha256(blob).hexdigest()
+    if dtb_hash in DtbCache:
+        return DtbCache[dtb_hash]
+    if len(blob) < 40 or struct.unpack_from('>I', blob, 0)[0] != FdtMagic:
+        raise Exception('Fail to parse dtb file %s: invalid header' % dtb_file)
+    off_struct, off_strings = struct.unpack_from('>II', blob, 8)
+    dtb = {'hash': dtb_hash, 'order': [], 'nodes': {},
+           'labels': {}, 'aliases': {}}
+    path = []
+    offset = off_struct
+    while True:
+        token = struct.unpack_from('>I', blob, offset)[0]
+        offset += 4
+        if token == FdtBeginNode:
+            end = blob.index(b'\0', offset)
+            name = blob[offset:end].decode('utf-8', 'replace')
+            offset = (end + 4) & ~3
+            path.append(name)
+            node_path = node_path_of(path)
+            dtb['order'].append(node_path)
+            dtb['nodes'][node_path] = {}
+        elif token == FdtEndNode:
+            if not path:
+                raise Exception('Fail to parse dtb file %s: '
+                                'unbalanced nodes' % dtb_file)
+            path.pop()
+        elif token == FdtProp:
+            length, nameoff = struct.unpack_from('>II', blob, offset)
+            offset += 8
+            name_start = off_strings + nameoff
+            name = blob[name_start:blob.index(b'\0', name_start)].decode()
+            dtb['nodes'][node_path_of(path)][name] = \
+                blob[offset:offset + length]
+            offset = (offset + length + 3) & ~3
+        elif token == FdtNop:
+            continue
+        elif token == FdtEnd:
+            break
+        else:
+            raise Exception('Fail to parse dtb file %s: unknown token 0x%x'
+                            % (dtb_file, token))
+    for label, value in dtb['nodes'].get('/__symbols__', {}).items():
+        dtb['labels'][label] = get_prop_string(value)
+    for alias, value in dtb['nodes'].get('/aliases', {}).items():
+        dtb['aliases'][alias] = get_prop_string(value)
+    DtbCache[dtb_hash] = dtb
+    return dtb
+
+
+def node_path_of(path):
+    '''Return the node path from list of node names'''
+    return '/' + '/'.join(path[1:])
+
+
+def get_prop_string(value):
+    '''Return the first string of string/stringlist property value'''
+    return value.split(b'\0')[0].decode('utf-8', 'replace')
+
+
+def get_node_prop(dtb, node_path, prop):
+    '''Return the string value of node property, empty if not found'''
+    value = dtb['nodes'].get(node_path, {}).get(prop)
+    if value is None:
+        return ''
+    return get_prop_string(value)
+
+
+def resolve_path(dtb, name):
+    '''Resolve the alias/label or path into node path'''
+    if name.startswith('/'):
+        return name
+    return dtb['aliases'].get(name, dtb['labels'].get(name, ''))
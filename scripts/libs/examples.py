@@ -114,6 +114,13 @@ Examples:
 
     Configure rootfs:
     $ petalinux-config -c rootfs
+
+    Share the generated machine configuration cache across projects(size in MB):
+    $ export PLNX_GENMACHINECONF_CACHE_DIR=/shared/plnx-cache
+    $ export PLNX_GENMACHINECONF_CACHE_SIZE=2048
+    $ petalinux-config --silentconfig
+    Default cache is ~/.cache/petalinux/gen-machineconf, set PLNX_GENMACHINECONF_CACHE_DIR
+    to empty to disable it.
 '''
 
 PBuild = '''
@@ -166,6 +173,27 @@ Examples:
     $ petalinux-build -x mrproper
     Above command will remove tmp files, <PROJECT>/images/,  <PROJECT>/build/
 		and <PROJECT>/components/plnx_workspace directories
+
+    Keep the bitbake server resident between commands(idle timeout in seconds):
+    $ export PLNX_BB_SERVER_TIMEOUT=600
+    $ petalinux-build -c myapp
+    Next petalinux-build/config/devtool commands reuse the running server and parsed
+    recipes. Server exits after 600 seconds of idle time, -1 keeps it until mrproper.
+
+    Rerun all the project setup steps, even if their inputs are unchanged:
+    $ petalinux-build --force-setup
+
+    Images are synced to CONFIG_SUBSYSTEM_TFTPBOOT_DIR incrementally, only changed files are copied.
+    Skip the sdk.sh, esdk.sh and archiver.tar.gz files while syncing:
+    $ export PLNX_TFTP_EXCLUDE_SDK=1
+    $ petalinux-build
+
+    With CONFIG_SUBSYSTEM_FPGA_MANAGER, the .bit files of dfx_user_dts apps are converted
+    once to build/bitbin/<app>/<bitstream>.bin, cached by bitstream content, and the apps
+    use them instead of converting in each recipe.
+    Change the cache directory(empty to disable) and size in MB:
+    $ export PLNX_BITBIN_CACHE_DIR=/tmp/bitbin-cache PLNX_BITBIN_CACHE_SIZE=1024
+    $ petalinux-build
 '''
 
 PPackageBoot = '''
@@ -201,6 +229,23 @@ Examples:
     Generate bitstream merged with fsbl
     $ petalinux-package boot --fsbl <FSBL_ELF> --fpga <BITSTREAM> --format DOWNLOAD.BIT
     It will generate a download.bit in <PROJECT>/images/linux, with specified <BITSTREAM> and <FSBL_ELF>.
+
+    Reuse BOOT.BIN when the BIF content, its files and bootgen args are unchanged(size in MB):
+    $ export PLNX_BOOTBIN_CACHE_DIR=/shared/plnx-cache/bootbin
+    $ export PLNX_BOOTBIN_CACHE_SIZE=4096
+    $ petalinux-package boot --u-boot
+    Default cache is ~/.cache/petalinux/bootbin, set PLNX_BOOTBIN_CACHE_DIR to empty to disable it.
+    MicroBlaze download.bit is also reused from this cache when the bitstream, MMI, FSBL,
+    processor instance and --updatemem-extra-args are unchanged.
+
+    Generate multiple boot images in parallel from a variants file:
+    $ cat boot-variants.txt
+    # <name> <package boot args>
+    sd     --boot-device sd
+    flash  --boot-device flash --fpga
+    mcs    --format MCS -o images/linux/mcs/boot.mcs
+    $ petalinux-package boot --u-boot --variants boot-variants.txt
+    Variant args are added to the command line args, images are generated in images/linux/<name>/.
 '''
 
 PPackageBsp = '''
@@ -247,6 +292,23 @@ Examples:
     Besides copying the images, it will copy myfile to <PROJECT>/pre-built/linux/images/myfile
 '''
 
+PPackageFlash = '''
+Examples:
+    Plan the flash partitions from the images/linux image sizes:
+    $ petalinux-package flash
+    It prints the current and planned layout, warns about partitions with less headroom and
+    writes build/flash-layout/flash-layout.cfg and flash-parts.dtsi.
+
+    Plan with 128KB erase blocks and 20% headroom, update the partition sizes in system config:
+    $ petalinux-package flash --erase-size 0x20000 --headroom 20 --apply
+
+    Package the partition images at their flash_parts.txt offsets into images/linux/flash.bin
+    and flash.mcs, unused flash padded with 0xFF:
+    $ petalinux-package flash --image --mcs
+    Program a different kernel image in the kernel partition:
+    $ petalinux-package flash --image --add kernel=images/linux/Image -o /tmp/qspi.bin
+'''
+
 PPackageSysroot = '''
 Examples:
     Install defaults
@@ -280,6 +342,11 @@ Examples:
     $ petalinux-package wic --size ,6G
     This will generate the wic image with boot partition 2G(default) and root partition 6G
 
+    Size the partitions to the boot files and rootfs content with 20% free space:
+    $ petalinux-package wic --auto-size
+    With 50% free space and grow the root partition to the SD card size on first boot:
+    $ petalinux-package wic --auto-size --headroom 50 --grow-rootfs
+
     Package custom bootfiles into /boot dir:
     $ petalinux-package wic --bootfiles "boot.bin userfile1 userfile2"
     This will generate the wic image with specified files copied into /boot dir.
@@ -298,6 +365,13 @@ Examples:
     Package custom rootfile system:
     $ petalinux-package wic --rootfs-file custom-rootfs.tar.gz
     This will unpack your custom-rootfs.tar.gz file and copy to the /rootfs dir.
+    The extracted rootfs is kept in build/wic-rootfs and reused until the rootfs file
+    content changes. pigz, zstd, xz or lbzip2 are used to decompress with threads if found.
+
+    With the default partition layout, the SD image is created directly without wic and
+    bitbake when pseudo-native is already built and mkfs.ext4 supports -d. Custom --wks,
+    --wic-extra-args or boot files in sub directories use wic. To always use wic:
+    $ export PLNX_WIC_NATIVE=0
 
     $ petalinux-package wic --wic-extra-args="-c xz"
     This will compress the wic image with sprecified compressor.
@@ -311,6 +385,17 @@ Examples:
     Copying the image SD card:
     $ dd if=petalinux-sdimage.wic of=/dev/sd<X> conv=fsync
     You need sudo access to do this.
+
+    Uncompressed images are written sparse with petalinux-sdimage.wic.bmap block map,
+    copy only the used blocks to SD card:
+    $ bmaptool copy petalinux-sdimage.wic /dev/sd<X>
+
+    Also write the compressed image with 8 threads, holes in image are not read:
+    $ petalinux-package wic --compress zstd --threads 8
+    Compressed image in independent zstd frames with seek table(seekable zstd format):
+    $ petalinux-package wic --compress zstd-seekable
+    Copy the compressed image to SD card with the block map of raw image:
+    $ bmaptool copy --bmap petalinux-sdimage.wic.bmap petalinux-sdimage.wic.zst /dev/sd<X>
 '''
 
 PBootJtag = '''
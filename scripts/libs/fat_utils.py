@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import random
+import struct
+import time
+
+logger = logging.getLogger('PetaLinux')
+
+SectorSize = 512
+ReservedSectors = 32
+NumFats = 2
+RootCluster = 2
+DirEntrySize = 32
+# FAT32 needs at least 65525 clusters
+Fat32MinClusters = 65525
+FatClusterSizes = (4096, 2048, 1024, 512)
+FatEndOfChain = 0x0FFFFFFF
+FatCopyBlockSize = 1024 * 1024
+# Minimum image size and free space to keep in image
+FatMinImageSize = 64 * 1024 * 1024
+FatHeadroomSize = 16 * 1024 * 1024
+ShortNameChars = '!#$%&\'()-@^_`{}~'
+
+
+def get_fat_layout(image_size):
+    '''Return sectors per cluster, FAT size in sectors and
+    cluster count for FAT32 image of given size'''
+    total_sectors = image_size // SectorSize
+    for cluster_size in FatClusterSizes:
+        sec_per_clus = cluster_size // SectorSize
+        tmp_val = (256 * sec_per_clus + NumFats) // 2
+        fat_sectors = (total_sectors - ReservedSectors + tmp_val - 1) // tmp_val
+        clusters = (total_sectors - ReservedSectors -
+                    NumFats * fat_sectors) // sec_per_clus
+        if clusters >= Fat32MinClusters:
+            return sec_per_clus, fat_sectors, clusters
+    raise Exception('Image size %d is too small for FAT32' % image_size)
+
+
+def get_fat_image_size(files):
+    '''Return the power of 2 image size to fit the files with headroom'''
+    content_size = sum(os.path.getsize(filename) for filename in files)
+    size = content_size + max(content_size // 10, FatHeadroomSize)
+    image_size = FatMinImageSize
+    while image_size < size:
+        image_size *= 2
+    return image_size
+
+
+def get_short_name(name, used_names):
+    '''Return the unique 11 bytes 8.3 short name for the long name'''
+    base, ext = os.path.splitext(name.upper())
+    ext = ext[1:]
+
+    def clean(value):
+        return ''.join(char if char.isalnum() or char in ShortNameChars
+                       else '_' for char in value if char not in ' .')
+    short_base = clean(base)
+    short_ext = clean(ext)[:3]
+    lossy = short_base != base or short_ext != ext or len(short_base) > 8
+    short_name = '%-8s%-3s' % (short_base[:8], short_ext)
+    num = 1
+    while lossy or short_name in used_names:
+        tail = '~%d' % num
+        short_name = '%-8s%-3s' % (short_base[:8 - len(tail)] + tail,
+                                   short_ext)
+        lossy = False
+        num += 1
+    used_names.add(short_name)
+    return short_name.encode('ascii')
+
+
+def get_lfn_entries(name, short_name):
+    '''Return the long file name directory entries for name'''
+    checksum = 0
+    for char in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + char) & 0xff
+    chars = name.encode('utf-16-le')
+    chars = [chars[i:i + 2] for i in range(0, len(chars), 2)]
+    if len(chars) % 13:
+        chars += [b'\0\0'] + [b'\xff\xff'] * (12 - len(chars) % 13)
+    entries = []
+    count = len(chars) // 13
+    for seq in range(count, 0, -1):
+        part = chars[(seq - 1) * 13:seq * 13]
+        order = seq | (0x40 if seq == count else 0)
+        entries.append(struct.pack('<B10sBBB12sH4s', order,
+                                   b''.join(part[0:5]), 0x0f, 0, checksum,
+                                   b''.join(part[5:11]), 0,
+                                   b''.join(part[11:13])))
+    return entries
+
+
+def get_dos_datetime(mtime):
+    '''Return the DOS date and time of mtime'''
+    tm = time.localtime(mtime)
+    dos_date = ((max(tm.tm_year, 1980) - 1980) << 9) | \
+        (tm.tm_mon << 5) | tm.tm_mday
+    dos_time = (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2)
+    return dos_date, dos_time
+
+
+def get_boot_sector(image_size, sec_per_clus, fat_sectors, label,
+                    hidden_sectors=0):
+    '''Return the FAT32 boot sector'''
+    boot = bytearray(SectorSize)
+    boot[0:3] = b'\xeb\x58\x90'
+    boot[3:11] = b'mkfs.fat'
+    struct.pack_into('<HBHBHHBHHHII', boot, 11, SectorSize, sec_per_clus,
+                     ReservedSectors, NumFats, 0, 0, 0xf8, 0, 32, 64,
+                     hidden_sectors, image_size // SectorSize)
+    struct.pack_into('<IHHIHH', boot, 36, fat_sectors, 0, 0,
+                     RootCluster, 1, 6)
+    struct.pack_into('<BBBI11s8s', boot, 64, 0x80, 0, 0x29,
+                     random.getrandbits(32), label.ljust(11)[:11].encode(),
+                     b'FAT32   ')
+    boot[510:512] = b'\x55\xaa'
+    return bytes(boot)
+
+
+def get_fsinfo_sector(free_clusters, next_free):
+    '''Return the FAT32 FSInfo sector'''
+    fsinfo = bytearray(SectorSize)
+    struct.pack_into('<I', fsinfo, 0, 0x41615252)
+    struct.pack_into('<IIII', fsinfo, 484, 0x61417272, free_clusters,
+                     next_free, 0)
+    struct.pack_into('<I', fsinfo, 508, 0xaa550000)
+    return bytes(fsinfo)
+
+
+def create_fat_image(image, files, image_size=0, label='BOOT', offset=0):
+    '''Create FAT32 image with given files in root directory
+    files - list of (name in image, source file path)
+    File data is copied directly from sources into the sparse image,
+    with offset the filesystem is written at offset of existing image'''
+    if not image_size:
+        image_size = get_fat_image_size([src for name, src in files])
+    sec_per_clus, fat_sectors, clusters = get_fat_layout(image_size)
+    cluster_size = sec_per_clus * SectorSize
+    data_start = (ReservedSectors + NumFats * fat_sectors) * SectorSize
+
+    # Root directory entries
+    used_names = set()
+    entries = []
+    file_entries = []
+    for name, src in files:
+        short_name = get_short_name(name, used_names)
+        display_name = short_name[:8].decode().rstrip()
+        if short_name[8:].strip():
+            display_name += '.' + short_name[8:].decode().rstrip()
+        # Long name entries to keep the case and length of name
+        if display_name != name:
+            entries.extend(get_lfn_entries(name, short_name))
+        file_entries.append((len(entries), short_name, src))
+        entries.append(b'')
+    root_clusters = max(1, -(-(len(entries) + 1) * DirEntrySize //
+                             cluster_size))
+
+    # Allocate the clusters contiguously
+    fat = [0x0ffffff8, FatEndOfChain]
+    chains = [(RootCluster, root_clusters)]
+    next_cluster = RootCluster + root_clusters
+    for index, short_name, src in file_entries:
+        size = os.path.getsize(src)
+        count = -(-size // cluster_size)
+        start = next_cluster if count else 0
+        chains.append((start, count))
+        next_cluster += count
+        dos_date, dos_time = get_dos_datetime(os.path.getmtime(src))
+        entries[index] = struct.pack('<11sBBBHHHHHHHI', short_name, 0x20, 0,
+                                     0, dos_time, dos_date, dos_date,
+                                     start >> 16, dos_time, dos_date,
+                                     start & 0xffff, size)
+    if next_cluster - RootCluster > clusters:
+        raise Exception('Files does not fit in FAT image of size %d'
+                        % image_size)
+    for start, count in chains:
+        for cluster in range(start, start + count):
+            fat.append(cluster + 1 if cluster < start + count - 1
+                       else FatEndOfChain)
+    fat_data = struct.pack('<%dI' % len(fat), *fat)
+    root_data = b''.join(entries)
+
+    with open(image, 'r+b' if offset else 'wb') as image_data:
+        if image_data.seek(0, os.SEEK_END) < offset + image_size:
+            image_data.truncate(offset + image_size)
+        boot = get_boot_sector(image_size, sec_per_clus, fat_sectors, label,
+                               offset // SectorSize)
+        fsinfo = get_fsinfo_sector(clusters - (next_cluster - RootCluster),
+                                   next_cluster)
+        for sector in (0, 6):
+            image_data.seek(offset + sector * SectorSize)
+            image_data.write(boot + fsinfo)
+        for fat_num in range(NumFats):
+            image_data.seek(offset + (ReservedSectors + fat_num *
+                                      fat_sectors) * SectorSize)
+            image_data.write(fat_data)
+        image_data.seek(offset + data_start)
+        image_data.write(root_data)
+        for (index, short_name, src), (start, count) in zip(
+                file_entries, chains[1:]):
+            if not count:
+                continue
+            image_data.seek(offset + data_start +
+                            (start - RootCluster) * cluster_size)
+            with open(src, 'rb') as src_data:
+                while True:
+                    data = src_data.read(FatCopyBlockSize)
+                    if not data:
+                        break
+                    image_data.write(data)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import plnx_utils
+import plnx_vars
+
+logger = logging.getLogger('PetaLinux')
+
+
+def get_flash_part_macro(flash_ipname, num, conf):
+    '''Return the config macro of flash partition num'''
+    return '%s%s_PART%s%s' % (plnx_vars.FlashConfs['Prefix'],
+                              flash_ipname.upper(), num,
+                              plnx_vars.FlashConfs[conf])
+
+
+def read_flash_partitions(proot):
+    '''Read the flash partitions from system config
+    Returns flash IP name and list of {'num', 'name', 'offset', 'size'},
+    partitions are contiguous from offset 0'''
+    sysconf = plnx_vars.SysConfFile.format(proot)
+    flash_ipname = plnx_utils.get_config_value(plnx_vars.FlashIpConf, sysconf)
+    parts = []
+    if not flash_ipname:
+        return flash_ipname, parts
+    offset = 0
+    for num in range(0, plnx_vars.FlashMaxParts):
+        name = plnx_utils.get_config_value(
+            get_flash_part_macro(flash_ipname, num, 'Name'), sysconf)
+        if not name:
+            break
+        size = plnx_utils.get_config_value(
+            get_flash_part_macro(flash_ipname, num, 'Size'), sysconf)
+        size = int(size, base=16) if size else 0
+        parts.append({'num': num, 'name': name, 'offset': offset,
+                      'size': size})
+        offset += size
+    return flash_ipname, parts
+
+
+def get_flash_parts_offsets(proot, parts):
+    '''Return the parts with offset and size from flash_parts.txt,
+    parts not listed in it keep the system config values'''
+    hsm_file = plnx_vars.HsmOutFile.format(proot)
+    if not os.path.isfile(hsm_file):
+        return parts
+    hsm_parts = []
+    for part in parts:
+        fields = plnx_utils.get_config_value(part['name'], hsm_file).split()
+        try:
+            part = dict(part, offset=int(fields[0], base=16),
+                        size=int(fields[1], base=16))
+        except (IndexError, ValueError):
+            pass
+        hsm_parts.append(part)
+    return hsm_parts
+
+
+def get_flash_part_file(proot, name, xilinx_arch):
+    '''Return the image file to program in partition name,
+    empty if partition is not having image(e.g. bootenv)'''
+    file_key = plnx_vars.FlashPartFiles.get(name, '')
+    if xilinx_arch == 'microblaze' and name == 'boot':
+        file_key = 'UBOOT_MICROBLAZE'
+    if not file_key:
+        return ''
+    return os.path.join(plnx_vars.BuildImagesDir.format(proot),
+                        plnx_vars.BootFileNames.get(file_key, file_key))
+
+
+def align_up(value, align):
+    '''Round up value to the multiple of align'''
+    return -(-value // align) * align
+
+
+def plan_flash_layout(parts, files, erase_size, headroom):
+    '''Compute the erase block aligned contiguous partitions fitting the
+    image sizes plus headroom(%), partitions without image keep the size
+    files - {partition name: image file}'''
+    plan = []
+    offset = 0
+    for part in parts:
+        new_part = dict(part, offset=offset, used=0)
+        image = files.get(part['name'], '')
+        if image and os.path.isfile(image):
+            used = os.path.getsize(image)
+            new_part['used'] = used
+            new_part['size'] = align_up(used + used * headroom // 100,
+                                        erase_size)
+        else:
+            new_part['size'] = align_up(max(part['size'], erase_size),
+                                        erase_size)
+        offset += new_part['size']
+        plan.append(new_part)
+    return plan
+
+
+def check_flash_headroom(parts, files, headroom):
+    '''Warn the partitions with free space below headroom(%) of image,
+    returns False if any image does not fit in its partition'''
+    fits = True
+    for part in parts:
+        image = files.get(part['name'], '')
+        if not image or not os.path.isfile(image):
+            continue
+        used = os.path.getsize(image)
+        if used > part['size']:
+            logger.warning('%s(%d bytes) does not fit in %s partition '
+                           'of size 0x%x' % (image, used, part['name'],
+                                             part['size']))
+            fits = False
+        elif (part['size'] - used) * 100 < used * headroom:
+            logger.warning('%s partition headroom is %d bytes, below %d%%'
+                           % (part['name'], part['size'] - used, headroom))
+    return fits
+
+
+def get_flash_layout_config(flash_ipname, parts):
+    '''Return the system config lines for partitions'''
+    config = ''
+    for part in parts:
+        config += '%s="%s"\n' % (get_flash_part_macro(
+            flash_ipname, part['num'], 'Name'), part['name'])
+        config += '%s=0x%x\n' % (get_flash_part_macro(
+            flash_ipname, part['num'], 'Size'), part['size'])
+    return config
+
+
+def get_flash_layout_dtsi(flash_ipname, parts):
+    '''Return the device tree flash partition nodes for partitions'''
+    dtsi = plnx_vars.SystemconfFlash.format(flash_ipname)
+    for part in parts:
+        dtsi += plnx_vars.FlashPartNode.format(
+            part['num'], part['name'], hex(part['offset']), hex(part['size']))
+    return dtsi + plnx_vars.FlashendSymbols
+
+
+def apply_flash_layout(proot, flash_ipname, parts):
+    '''Update the partition sizes in system config and the offsets
+    in flash_parts.txt'''
+    trans = plnx_utils.config_transaction_begin(
+        plnx_vars.SysConfFile.format(proot))
+    for part in parts:
+        plnx_utils.config_transaction_update_value(
+            trans, get_flash_part_macro(flash_ipname, part['num'], 'Size'),
+            '0x%x' % part['size'])
+    plnx_utils.config_transaction_commit(trans)
+    hsm_file = plnx_vars.HsmOutFile.format(proot)
+    if not os.path.isfile(hsm_file):
+        return
+    parts_dict = {part['name']: part for part in parts}
+    with open(hsm_file, 'r') as hsm_data:
+        lines = plnx_utils.split_file_lines(hsm_data.read())
+    # Edit the exact name= lines in place to keep the file order
+    for index, line in enumerate(lines):
+        name, sep, value = line.partition('=')
+        part = parts_dict.get(name)
+        if not sep or not part or not value.strip():
+            continue
+        # Keep the fields after offset and size
+        fields = ['0x%x' % part['offset'], '0x%x' % part['size']]
+        lines[index] = '%s=%s\n' % (
+            name, ' '.join(fields + value.replace('"', '').split()[2:]))
+    trans = plnx_utils.config_transaction_begin(hsm_file)
+    plnx_utils.config_transaction_add_str(trans, ''.join(lines), mode='w')
+    plnx_utils.config_transaction_commit(trans)
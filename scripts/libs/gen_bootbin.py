@@ -10,7 +10,9 @@
 
 import logging
 import os
+import re
 import sys
+import package_common
 import plnx_utils
 import plnx_vars
 from package_common import (AddedLinuxId, AddedSubBootId, BootFilesSeq,
@@ -18,6 +20,10 @@ from package_common import (AddedLinuxId, AddedSubBootId, BootFilesSeq,
 
 logger = logging.getLogger('PetaLinux')
 
+# Metadata macro updates of pool workers, written by the parent to
+# avoid racing on metadata file. None writes the metadata directly
+MetadataUpdates = None
+
 
 def AddBifSubsystemId(Attribute, Value, xilinx_arch, notfile=False):
     ''' Bif format as per the xilinx arch
@@ -40,9 +46,9 @@ def AddBifSubsystemId(Attribute, Value, xilinx_arch, notfile=False):
     return string
 
 
-def GenQemuBootImage(args, proot):
-    ''' Generate the qemu-boot.img file for versal{-net} qemu boot'''
-    BootBinDir = os.path.dirname(args.output)
+def GetQemuBootImageFiles(args, proot):
+    ''' Return the boot script and rootfs files to add in qemu_boot.img
+    and the missing rootfs file if any'''
     Bootscript = os.path.join(plnx_vars.BuildImagesDir.format(proot),
                               plnx_vars.BootFileNames['BOOTSCRIPT']
                               )
@@ -50,16 +56,9 @@ def GenQemuBootImage(args, proot):
         Bootscript = os.path.join(plnx_vars.PreBuildsImagesDir.format(proot),
                                   plnx_vars.BootFileNames['BOOTSCRIPT']
                                   )
-    logger.info('Generating QEMU boot images...')
-    BootBinTmpDir = os.path.join(plnx_vars.BuildDir.format(proot),
-                                 'bootbin')
-    plnx_utils.CreateDir(BootBinTmpDir)
-    plnx_utils.CopyFile(args.output, os.path.join(BootBinTmpDir,
-                                                  plnx_vars.BootFileNames['BOOTBIN']))
-    logger.info('File in qemu_boot.img: %s' % args.output)
-    plnx_utils.CopyFile(Bootscript, os.path.join(BootBinTmpDir,
-                                                 os.path.basename(Bootscript)))
-    logger.info('File in qemu_boot.img: %s' % Bootscript)
+    QemuFiles = []
+    if os.path.isfile(Bootscript):
+        QemuFiles.append(Bootscript)
     QemuRootfs = args.qemu_rootfs
     initramfs_image = plnx_utils.get_config_value(
         'CONFIG_SUBSYSTEM_INITRAMFS_IMAGE_NAME',
@@ -72,30 +71,94 @@ def GenQemuBootImage(args, proot):
             QemuRootfs = os.path.join(plnx_vars.BuildImagesDir.format(proot),
                                       plnx_vars.BootFileNames['RFS_FILE'])
 
+    MissingRootfs = ''
     if QemuRootfs and QemuRootfs not in ('no', 'none'):
         if not os.path.isabs(QemuRootfs):
             QemuRootfs = os.path.join(proot, QemuRootfs)
 
         if not os.path.isfile(QemuRootfs):
-            logger.warning('Missing file %s, Specify it using '
-                           '--qemu-rootfs <rfs file>' % QemuRootfs)
+            MissingRootfs = QemuRootfs
         else:
-            QemuRootfs = os.path.realpath(QemuRootfs)
-            plnx_utils.CopyFile(QemuRootfs, os.path.join(BootBinTmpDir,
-                                                         os.path.basename(QemuRootfs)))
-            logger.info('File in qemu_boot.img: %s' % QemuRootfs)
-
-    plnx_utils.check_tool('mkfatimg')
-    MkFatCmd = 'mkfatimg %s %s %s' % (BootBinTmpDir,
-                                      os.path.join(
-                                          BootBinDir, 'qemu_boot.img'),
-                                      '262144')
-    plnx_utils.runCmd(MkFatCmd, os.getcwd(), shell=True)
-    plnx_utils.RemoveDir(BootBinTmpDir)
-
-
-def RunBootGen(biffile, args, proot):
-    ''' Run bootgen command with given biffile path '''
+            QemuFiles.append(os.path.realpath(QemuRootfs))
+    return QemuFiles, MissingRootfs
+
+
+def GenQemuBootImage(args, proot):
+    ''' Generate the qemu-boot.img file for versal{-net} qemu boot
+    FAT image is written directly from the source files, skipped if
+    the files are not changed since the last generated image'''
+    import fat_utils
+    import hashlib
+    BootBinDir = os.path.dirname(args.output)
+    QemuImage = os.path.join(BootBinDir, plnx_vars.BootFileNames['QEMUIMG'])
+    logger.info('Generating QEMU boot images...')
+    QemuFiles, MissingRootfs = GetQemuBootImageFiles(args, proot)
+    if MissingRootfs:
+        logger.warning('Missing file %s, Specify it using '
+                       '--qemu-rootfs <rfs file>' % MissingRootfs)
+    ImageFiles = [(plnx_vars.BootFileNames['BOOTBIN'], args.output)]
+    ImageFiles += [(os.path.basename(QemuFile), QemuFile)
+                   for QemuFile in QemuFiles]
+    method = hashlib.sha256(QemuImage.encode() + b'\0')
+    for Name, QemuFile in ImageFiles:
+        logger.info('File in qemu_boot.img: %s' % QemuFile)
+        method.update(Name.encode() + b'\0')
+        method.update(plnx_utils.get_filehashvalue_cached(
+            proot, QemuFile).encode())
+    metadata = plnx_vars.MetaDataFile.format(proot)
+    ImageMacro = plnx_vars.QemuBootImgMacro
+    if getattr(args, 'variant', ''):
+        ImageMacro += '_%s' % re.sub('[^A-Z0-9_]', '_', args.variant.upper())
+    ImageChecksum = '%s:%s' % (method.hexdigest(),
+                               GetQemuBootImageStat(QemuImage))
+    if ImageChecksum == plnx_utils.get_config_value(ImageMacro, metadata):
+        logger.info('%s is up to date' % QemuImage)
+        return
+    fat_utils.create_fat_image(QemuImage, ImageFiles)
+    ImageChecksum = '%s:%s' % (method.hexdigest(),
+                               GetQemuBootImageStat(QemuImage))
+    if MetadataUpdates is not None:
+        MetadataUpdates[ImageMacro] = ImageChecksum
+    else:
+        plnx_utils.update_config_value(ImageMacro, ImageChecksum, metadata)
+
+
+def GetQemuBootImageStat(QemuImage):
+    ''' Return the size:mtime:inode string of qemu_boot.img'''
+    fingerprint = plnx_utils.get_file_fingerprint(QemuImage)
+    if not fingerprint:
+        return ''
+    return '%d:%d:%d' % (fingerprint[1], fingerprint[0], fingerprint[2])
+
+
+def GetBootBinCacheKey(biffile, bif_files, BootGenArgs, args, proot):
+    ''' Return the BOOT.BIN cache key from BIF text with file paths
+    replaced by their content hash, bootgen args and qemu image files'''
+    import hashlib
+    import shutil
+    with open(biffile, 'r') as file_data:
+        bif_content = file_data.read()
+    for FilePath in sorted(set(bif_files), key=len, reverse=True):
+        bif_content = bif_content.replace(
+            FilePath, plnx_utils.get_filehashvalue_cached(proot, FilePath))
+    method = hashlib.sha256()
+    bootgen = shutil.which('bootgen') or ''
+    for value in (bif_content, BootGenArgs, os.path.basename(args.output),
+                  args.format, bootgen,
+                  str(plnx_utils.get_file_fingerprint(bootgen))):
+        method.update(value.encode() + b'\0')
+    if args.xilinx_arch in ('versal', 'versal-net') and \
+            args.format == 'BIN':
+        for QemuFile in GetQemuBootImageFiles(args, proot)[0]:
+            method.update(os.path.basename(QemuFile).encode() + b'\0')
+            method.update(plnx_utils.get_filehashvalue_cached(
+                proot, QemuFile).encode())
+    return method.hexdigest()
+
+
+def RunBootGen(biffile, args, proot, bif_files=None):
+    ''' Run bootgen command with given biffile path
+    bif_files - files referred in biffile to cache the outputs'''
     logger.info('Generating %s binary package %s...' % (
                 args.xilinx_arch, os.path.basename(args.output))
                 )
@@ -108,12 +171,41 @@ def RunBootGen(biffile, args, proot):
     BootGenCmd = 'bootgen -arch %s -image %s -o %s %s' % (
         bootgen_arch, biffile,
         args.output, extra_bootargs)
+    BootBinDir = os.path.dirname(args.output)
+    cache_dir = plnx_utils.get_cache_dir(plnx_vars.BootBinCacheEnv,
+                                         plnx_vars.BootBinCacheDir)
+    cache_key = ''
+    if cache_dir and bif_files is not None:
+        cache_key = GetBootBinCacheKey(
+            biffile, bif_files, '%s %s' % (bootgen_arch, extra_bootargs),
+            args, proot)
+        if plnx_utils.restore_cache_entry(cache_dir, cache_key, BootBinDir):
+            logger.info('Restored %s from cache' %
+                        os.path.basename(args.output))
+            logger.info('Binary is ready.')
+            return
+    outputs = {}
+    for _file in os.listdir(BootBinDir):
+        outputs[_file] = plnx_utils.get_file_fingerprint(
+            os.path.join(BootBinDir, _file))
     stdout = plnx_utils.runCmd(BootGenCmd, os.getcwd(),
                                failed_msg='Fail to create BOOT image', shell=True)
     logger.info(''.join(stdout))
     if args.xilinx_arch in ('versal', 'versal-net') and \
             args.format == 'BIN':
         GenQemuBootImage(args, proot)
+        # Up to date qemu_boot.img is not regenerated, store it anyway
+        outputs.pop(plnx_vars.BootFileNames['QEMUIMG'], None)
+    if cache_key:
+        # Store the outputs generated by bootgen and qemu_boot.img
+        out_files = [os.path.join(BootBinDir, _file)
+                     for _file in os.listdir(BootBinDir)
+                     if outputs.get(_file) != plnx_utils.get_file_fingerprint(
+                         os.path.join(BootBinDir, _file))]
+        out_files = [out_file for out_file in out_files
+                     if os.path.isfile(out_file)]
+        plnx_utils.store_cache_entry(cache_dir, cache_key, out_files)
+        package_common.EvictBootBinCache(cache_dir)
     logger.info('Binary is ready.')
 
 
@@ -123,6 +215,7 @@ def GenerateBif(args, proot):
     global AddedLinuxId
     # Parse BootParams to create Bif file
     bif_content = '%s:\n{\n' % plnx_vars.BifImagePrefix
+    bif_files = []
     for File in BootFilesSeq[args.xilinx_arch]:
         FilteredFiles = [key for key in BootParams.keys()
                          if key.startswith(File)]
@@ -190,6 +283,7 @@ def GenerateBif(args, proot):
                     File_Attr_.strip(',').strip(),
                     FilePath, args.xilinx_arch)
                 logger.info('File in BOOT BIN: "%s"' % FilePath)
+                bif_files.append(FilePath)
             if BootParams[File].get('BifAttr'):
                 File_Attr_ += BootParams[File].get('BifAttr')
             if BootParams[File].get('Value'):
@@ -208,8 +302,8 @@ def GenerateBif(args, proot):
     if args.xilinx_arch in ('versal', 'versal-net'):
         bif_content += '}\n'
     logger.debug(bif_content)
-    plnx_utils.RemoveFile(plnx_vars.BifFile.format(proot))
-    plnx_utils.CreateFile(plnx_vars.BifFile.format(proot))
-    plnx_utils.add_str_to_file(plnx_vars.BifFile.format(proot),
-                               bif_content)
-    RunBootGen(plnx_vars.BifFile.format(proot), args, proot)
+    biffile = args.bif or plnx_vars.BifFile.format(proot)
+    plnx_utils.RemoveFile(biffile)
+    plnx_utils.CreateFile(biffile)
+    plnx_utils.add_str_to_file(biffile, bif_content)
+    RunBootGen(biffile, args, proot, bif_files)
@@ -12,9 +12,12 @@ import logging
 import os
 import re
 import sys
+import tempfile
+import bitstream_utils
 import package_common
 import plnx_utils
 import plnx_vars
+import xsa_utils
 from package_common import BootParams
 
 logger = logging.getLogger('PetaLinux')
@@ -38,8 +41,6 @@ def CreateDownloadbit(args, proot, download_bit_out):
     SystemBitFile = BootParams['FPGA']['Path']
     download_bit_prefix = 'DOWNLOAD_BIT_image_CONTENT'
     package_common.CheckOutFile(download_bit_out, args.force)
-    plnx_utils.check_tool('updatemem',
-                          'Please source Xilinx Tools settings first.')
     if args.mmi:
         mmi_filename = args.mmi
     else:
@@ -49,6 +50,11 @@ def CreateDownloadbit(args, proot, download_bit_out):
         sys.exit(255)
     mmi_filepath = os.path.join(plnx_vars.HWDescDir.format(proot),
                                 mmi_filename)
+    if not os.path.isfile(mmi_filepath) and not args.mmi:
+        # Extract the mmi from XSA
+        mmi_filepath = xsa_utils.extract_xsa_file(
+            plnx_utils.get_xsaordts_path(proot), mmi_filename,
+            plnx_vars.XsaExtractDir.format(proot))
     if not os.path.isfile(mmi_filepath):
         logger.warning('Default MMI file not found')
         logger.warning('Auto Detecting MMI file from %s' %
@@ -62,6 +68,7 @@ def CreateDownloadbit(args, proot, download_bit_out):
             sys.exit(255)
     logger.info('Creating download.bit')
     logger.info('Fpga bitstream: %s' % SystemBitFile)
+    bitstream_utils.log_bitstream_info(SystemBitFile)
     logger.info('Fpga bitstream %s file: %s' % ('MMI', mmi_filepath))
     logger.info('Fsbl file: %s' % FsblFile)
     logger.info('Output download.bit: %s' % download_bit_out)
@@ -81,6 +88,30 @@ def CreateDownloadbit(args, proot, download_bit_out):
                     plnx_vars.ProcConfs['InstanceName']),
         plnx_vars.SysConfFile.format(proot)
     )
+    cache_dir = plnx_utils.get_cache_dir(plnx_vars.BootBinCacheEnv,
+                                         plnx_vars.BootBinCacheDir)
+    cache_key = ''
+    if cache_dir:
+        cache_key = GetDownloadBitCacheKey(
+            proot, SystemBitFile, mmi_filepath, FsblFile, proc_inst_name,
+            args.updatemem_extra_args)
+        # Cached file name is from the earlier output, restore it in a
+        # temp dir to not overwrite other files in output dir
+        plnx_utils.CreateDir(os.path.dirname(download_bit_out))
+        tmp_dir = tempfile.mkdtemp(prefix='.download-bit.',
+                                   dir=os.path.dirname(download_bit_out))
+        try:
+            restored = plnx_utils.restore_cache_entry(cache_dir, cache_key,
+                                                      tmp_dir)
+            if restored:
+                os.replace(restored[0], download_bit_out)
+        finally:
+            plnx_utils.RemoveDir(tmp_dir)
+        if restored:
+            logger.info('Restored download.bit from cache')
+            return
+    plnx_utils.check_tool('updatemem',
+                          'Please source Xilinx Tools settings first.')
     updatemem_cmd = 'updatemem -meminfo %s -bit %s -data %s \
 		            -proc %s %s -out %s' % (mmi_filepath, SystemBitFile,
                                       FsblFile, proc_inst_name, args.updatemem_extra_args,
@@ -94,5 +125,26 @@ def CreateDownloadbit(args, proot, download_bit_out):
         logger.error(
             'Failed to create download bit file for MicroBlaze %s file.' % args.format)
         sys.exit(255)
+    if cache_key and os.path.isfile(download_bit_out):
+        plnx_utils.store_cache_entry(cache_dir, cache_key,
+                                     [download_bit_out])
+        package_common.EvictBootBinCache(cache_dir)
 
     return
+
+
+def GetDownloadBitCacheKey(proot, SystemBitFile, mmi_filepath, FsblFile,
+                           proc_inst_name, updatemem_extra_args):
+    ''' Return the download.bit cache key from bitstream, MMI and FSBL
+    content hash, processor instance and updatemem args'''
+    import hashlib
+    import shutil
+    method = hashlib.sha256(b'download.bit\0')
+    for InFile in (SystemBitFile, mmi_filepath, FsblFile):
+        method.update(plnx_utils.get_filehashvalue_cached(
+            proot, InFile).encode() + b'\0')
+    updatemem = shutil.which('updatemem') or ''
+    for value in (proc_inst_name, updatemem_extra_args, updatemem,
+                  str(plnx_utils.get_file_fingerprint(updatemem))):
+        method.update(value.encode() + b'\0')
+    return method.hexdigest()
@@ -10,8 +10,9 @@
 
 import logging
 import os
-import shutil
 import sys
+import bitstream_utils
+import cfgmem_utils
 import gen_downloadbit
 import plnx_utils
 import plnx_vars
@@ -49,47 +50,11 @@ def GetFlashInterface(flash_intf_arg, flash_type, flash_width, bitfile):
     if flash_type == 'spi':
         auto_flash_intf = 'SPIx1'
         if bitfile:
-            spi_width = ''
-            if not shutil.which('xxd'):
-                logger.warning(
-                    'Failed to detect SPI width from bitstream since xxd is not in your path.')
-                logger.warning('Using default one: %s' % auto_flash_intf)
+            spi_intf = bitstream_utils.get_spi_width_intf(bitfile)
+            if spi_intf:
+                auto_flash_intf = spi_intf
             else:
-                for i in range(24, 49):
-                    # Check the first 1024 bytes from the bitstream only
-                    spi_widthcmd = 'xxd -p -c %s -l 1024 %s' % (i, bitfile)
-                    stdout = plnx_utils.runCmd(
-                        spi_widthcmd, os.getcwd(), shell=True)
-                    for line in ''.join(stdout).splitlines():
-                        try:
-                            line = line.decode('utf-8')
-                        except AttributeError:
-                            pass
-                        if line.upper().startswith('FFFFFFFFFFFFFFFFAA99556620000000'):
-                            n = 2
-                            spi_width_ = [(line[i:i + n])
-                                          for i in range(0, len(line), n)]
-                            if spi_width_:
-                                spi_width = '0x%s' % spi_width_[22]
-                                spi_width = int(spi_width, base=16)
-                                break
-                    if spi_width:
-                        break
-
-                if spi_width == '':
-                    logger.warning(
-                        'Failed to detect SPI width from bitstream.')
-                    logger.warning('Using default one: %s' % auto_flash_intf)
-                elif spi_width == 0:
-                    auto_flash_intf = 'SPIx1'
-                elif spi_width == 1:
-                    auto_flash_intf = 'SPIx2'
-                elif spi_width == 2:
-                    auto_flash_intf = 'SPIx4'
-                else:
-                    logger.warning(
-                        'Unknown SPI width detected: %s.' % spi_width)
-                    logger.warning('Using default one: %s' % auto_flash_intf)
+                logger.warning('Using default one: %s' % auto_flash_intf)
     elif flash_type == 'parallel':
         if flash_width in ('8', '16'):
             auto_flash_intf = 'BPIx%s' % flash_width
@@ -157,6 +122,7 @@ def CreateMBBootBin(args, proot):
     cfgmem_args = ''
     fpga_args = ''
     data_args = ''
+    cfgmem_regions = []
     # Check the Offset value for given keys
     for file_ in BootParams.keys():
         if file_ in ('FSBL', 'DTB'):
@@ -198,27 +164,53 @@ def CreateMBBootBin(args, proot):
             file_offset = hex(int(int(file_offset, base=16) / 2))
 
         logger.info('Add File %s at %s' % (file_path, file_offset))
+        cfgmem_regions.append(cfgmem_utils.get_cfgmem_region(
+            int(BootParams[file_].get('Offset'), base=16), file_path,
+            loadbit=file_ == 'FPGA'))
         if file_ == 'FPGA':
             fpga_args = '-loadbit "up %s %s"' % (file_offset, file_path)
         else:
             data_args += ' up %s %s' % (file_offset, file_path)
+    native = os.environ.get(plnx_vars.CfgMemNativeEnv, '')
+    if flash_intf not in cfgmem_utils.CfgMemInterfaces:
+        native = ''
+    if native == '1':
+        logger.info('Generating %s file...' % args.format)
+        cfgmem_utils.write_cfgmem(cfgmem_regions, flash_size, flash_intf,
+                                  args.format, args.output)
+        return
     if data_args:
         data_args = '-loaddata "%s"' % data_args
     cfgmem_args = '-force -format %s -size %s -interface %s' % (
         args.format, flash_size, flash_intf)
     writecfg_cmd = 'write_cfgmem %s %s %s %s' % (
         cfgmem_args, fpga_args, data_args, args.output)
-    plnx_utils.RemoveDir(plnx_vars.CfgMemDir.format(proot))
-    plnx_utils.CreateDir(plnx_vars.CfgMemDir.format(proot))
-    write_cfgmemfile = os.path.join(plnx_vars.CfgMemDir.format(proot),
+    cfgmem_dir = plnx_vars.CfgMemDir.format(proot)
+    if getattr(args, 'variant', ''):
+        cfgmem_dir = os.path.join(cfgmem_dir, args.variant)
+    plnx_utils.RemoveDir(cfgmem_dir)
+    plnx_utils.CreateDir(cfgmem_dir)
+    write_cfgmemfile = os.path.join(cfgmem_dir,
                                     'write_cfgmem_hsm.tcl')
     plnx_utils.CreateFile(write_cfgmemfile)
     plnx_utils.add_str_to_file(write_cfgmemfile, writecfg_cmd)
-    cfgmemlog = os.path.join(plnx_vars.CfgMemDir.format(proot), 'cfgmem.log')
-    cfgmemjou = os.path.join(plnx_vars.CfgMemDir.format(proot), 'cfgmem.jou')
+    cfgmemlog = os.path.join(cfgmem_dir, 'cfgmem.log')
+    cfgmemjou = os.path.join(cfgmem_dir, 'cfgmem.jou')
     vivado_cmd = 'vivado -log %s -jou %s -mode batch -s %s' % (
         cfgmemlog, cfgmemjou, write_cfgmemfile)
     logger.info('Generating %s file...' % args.format)
     stdout, stderr = plnx_utils.runCmd(vivado_cmd,
-                                       plnx_vars.CfgMemDir.format(proot), shell=True)
+                                       cfgmem_dir, shell=True)
+    if native == 'verify':
+        native_out = os.path.join(cfgmem_dir,
+                                  'native.%s' % args.format.lower())
+        cfgmem_utils.write_cfgmem(cfgmem_regions, flash_size, flash_intf,
+                                  args.format, native_out)
+        mismatch = cfgmem_utils.compare_cfgmem(args.output, native_out,
+                                               args.format)
+        if mismatch is None:
+            logger.info('Native %s file matches with vivado one' % args.format)
+        else:
+            logger.warning('Native %s file %s differs from vivado one at '
+                           'offset 0x%x' % (args.format, native_out, mismatch))
     return
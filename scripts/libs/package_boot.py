@@ -9,6 +9,7 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import copy
 import logging
 import os
 import random
@@ -20,6 +21,7 @@ import gen_mbbootbin
 import package_common
 import plnx_utils
 import plnx_vars
+import sync_utils
 from package_common import BootParamDisable, BootParams
 
 logger = logging.getLogger('PetaLinux')
@@ -55,6 +57,8 @@ def add_bootfile(dict_key, sub_key='Path'):
     def f(arg):
         if arg in ('no', 'none'):
             BootParamDisable.append(dict_key)
+            # Drop the file if specified before(e.g. in boot variants)
+            BootParams.pop(dict_key, None)
             arg = None
         elif arg:
             arg = plnx_utils.argreadlink(arg)
@@ -114,6 +118,9 @@ def CreateBootBin(args, proot):
     else:
         ''' Generate the Bif File with Build Images '''
         args.bif = plnx_vars.BifFile.format(proot)
+        if getattr(args, 'variant', ''):
+            args.bif = os.path.join(os.path.dirname(args.output),
+                                    os.path.basename(args.bif))
         ''' Run Bootgen Command '''
         gen_bootbin.GenerateBif(args, proot)
 
@@ -129,7 +136,8 @@ def CopyImageToTftp(args, proot):
 
     output_dir = os.path.dirname(args.output)
     output_file = os.path.basename(args.output)
-    if images_dir != output_dir:
+    variant = getattr(args, 'variant', '')
+    if images_dir != output_dir and not variant:
         plnx_utils.CopyFile(args.output, images_dir)
         if args.xilinx_arch in ('versal', 'versal-net'):
             bh_file = '%s_bh.bin' % output_file.split('.')[0]
@@ -164,13 +172,17 @@ def CopyImageToTftp(args, proot):
         logger.warning(
             'TFTPDIR_DISABLE env set to TRUE, skip images copy to TFTPBOOT folder!!!')
         return 0
-    plnx_utils.CopyFile(args.output, tftp_dir)
+    if variant:
+        tftp_dir = os.path.join(tftp_dir, variant)
+        plnx_utils.CreateDir(tftp_dir)
+    tftp_files = [(args.output, os.path.basename(args.output))]
     if fsbl_path:
-        plnx_utils.CopyFile(fsbl_path, tftp_dir)
+        tftp_files.append((fsbl_path, os.path.basename(fsbl_path)))
+    sync_utils.sync_files(tftp_files, tftp_dir)
 
 
-def PackageBootImage(args, proot):
-    ''' Packaging different type of Boot Images '''
+def PrepareBootImage(args, proot):
+    ''' Validate the args and resolve the default boot files and output '''
     args.arch = plnx_utils.get_system_arch(proot)
     args.xilinx_arch = plnx_utils.get_xilinx_arch(proot)
     arg = ValidateArgArch(args, args.arch)
@@ -198,12 +210,20 @@ def PackageBootImage(args, proot):
             ''' Get output file name variable BootBINFile '''
             args.output = eval(
                 'plnx_vars.Boot%sFile.format("%s")' % (formate, proot))
+        if getattr(args, 'variant', ''):
+            # Variant outputs in images/linux/<variant>/
+            args.output = os.path.join(os.path.dirname(args.output),
+                                       args.variant,
+                                       os.path.basename(args.output))
     package_common.CheckOutFile(args.output, args.force)
     # Add Default Boot Files to Dictionary
     package_common.AddDefaultBootFile(args, proot)
     # Create outputdir directory
     plnx_utils.CreateDir(os.path.dirname(args.output))
-    # Run Respective funtion per arch and format type
+
+
+def GenerateBootImage(args, proot):
+    ''' Run respective funtion per arch and format type '''
     if args.format in ('BIN', 'MCS'):
         FailedMsg = 'Please source Xilinx Tools settings first.'
         if args.arch in ('arm', 'aarch64'):
@@ -216,6 +236,151 @@ def PackageBootImage(args, proot):
         gen_downloadbit.CreateDownloadbit(args, proot, args.output)
 
     logger.info('Successfully Generated %s File' % args.format)
+
+
+def SetBootParams(boot_params, boot_disable):
+    ''' Replace the BootParams and BootParamDisable contents in place,
+    other modules are referring the same objects '''
+    BootParams.clear()
+    BootParams.update(copy.deepcopy(boot_params))
+    BootParamDisable[:] = boot_disable
+
+
+def ReadBootVariants(variants_file):
+    ''' Read the variants manifest file
+    Each line is <name> <petalinux-package boot args>, # for comments.
+    Returns list of (name, args list) '''
+    import re
+    import shlex
+    if not os.path.isfile(variants_file):
+        logger.error('Specified variants file: %s doesnot exist.'
+                     % variants_file)
+        sys.exit(255)
+    variants = []
+    with open(variants_file, 'r') as file_data:
+        for line in file_data:
+            try:
+                fields = shlex.split(line, comments=True)
+            except ValueError as e:
+                logger.error('Failed to parse variants file %s: %s'
+                             % (variants_file, e))
+                sys.exit(255)
+            if not fields:
+                continue
+            if not re.match(r'^[A-Za-z0-9_.-]+$', fields[0]) or \
+                    fields[0] in [name for name, argv in variants]:
+                logger.error('Invalid or duplicate variant name "%s" in %s'
+                             % (fields[0], variants_file))
+                sys.exit(255)
+            variants.append((fields[0], fields[1:]))
+    if not variants:
+        logger.error('No variants found in %s' % variants_file)
+        sys.exit(255)
+    return variants
+
+
+def RunBootVariant(proot, job):
+    ''' Generate the boot image of one variant in pool worker
+    Returns the exit code, hash cache and metadata updates for parent '''
+    args, boot_params, boot_disable = job
+    SetBootParams(boot_params, boot_disable)
+    gen_bootbin.AddedSubBootId = False
+    gen_bootbin.AddedLinuxId = False
+    gen_bootbin.MetadataUpdates = {}
+    plnx_utils.HashCacheUpdates = {}
+    package_common.DeferCacheEviction = True
+    logger.info('Generating boot variant %s: %s' % (args.variant,
+                                                    args.output))
+    ret = 0
+    try:
+        GenerateBootImage(args, proot)
+    except SystemExit as e:
+        ret = e.code or 255
+    except Exception as e:
+        logger.error('Failed to generate boot variant %s: %s'
+                     % (args.variant, e))
+        ret = 255
+    return ret, plnx_utils.HashCacheUpdates, gen_bootbin.MetadataUpdates
+
+
+def PackageBootVariants(args, proot):
+    ''' Package the boot images of all variants in variants file
+    Variant args are applied on top of the command line args,
+    all variants are validated before generating them in parallel '''
+    import concurrent.futures
+    import multiprocessing
+    if args.output:
+        logger.error('"--output" is not valid with "--variants", '
+                     'specify it per variant in %s' % args.variants)
+        sys.exit(255)
+    base_params = copy.deepcopy(BootParams)
+    base_disable = list(BootParamDisable)
+    variant_parser = argparse.ArgumentParser(
+        prog='%s boot variant' % os.path.basename(sys.argv[0]),
+        add_help=False)
+    pkgboot_args(variant_parser)
+    jobs = []
+    output_dirs = {}
+    for name, variant_argv in ReadBootVariants(args.variants):
+        logger.info('Preparing boot variant %s' % name)
+        SetBootParams(base_params, base_disable)
+        variant_args = variant_parser.parse_args(
+            variant_argv, namespace=copy.deepcopy(args))
+        if variant_args.variants != args.variants:
+            logger.error('"--variants" is not valid in variant %s' % name)
+            sys.exit(255)
+        variant_args.variant = name
+        PrepareBootImage(variant_args, proot)
+        # qemu_boot.img, download.bit and bif are per output directory
+        output_dir = os.path.dirname(variant_args.output)
+        if output_dir in output_dirs:
+            logger.error('Variants %s and %s are having same output '
+                         'directory %s' % (output_dirs[output_dir], name,
+                                           output_dir))
+            sys.exit(255)
+        output_dirs[output_dir] = name
+        jobs.append((variant_args, copy.deepcopy(BootParams),
+                     list(BootParamDisable)))
+
+    max_jobs = min(len(jobs), os.cpu_count() or 1)
+    # fork to inherit the logger and project state in workers
+    with concurrent.futures.ProcessPoolExecutor(
+            max_jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+        results = list(executor.map(RunBootVariant, [proot] * len(jobs),
+                                    jobs))
+    hash_updates = {}
+    metadata_trans = plnx_utils.config_transaction_begin(
+        plnx_vars.MetaDataFile.format(proot))
+    for ret, hash_cache, metadata in results:
+        hash_updates.update(hash_cache)
+        for macro, value in metadata.items():
+            plnx_utils.config_transaction_update_value(
+                metadata_trans, macro, value)
+    plnx_utils.store_filehash_cache(proot, hash_updates)
+    plnx_utils.config_transaction_commit(metadata_trans)
+    package_common.EvictBootBinCache(plnx_utils.get_cache_dir(
+        plnx_vars.BootBinCacheEnv, plnx_vars.BootBinCacheDir))
+    failed = []
+    for job, (ret, hash_cache, metadata) in zip(jobs, results):
+        if ret:
+            failed.append(job[0].variant)
+            continue
+        SetBootParams(job[1], job[2])
+        CopyImageToTftp(job[0], proot)
+    if failed:
+        logger.error('Failed to generate boot variants: %s'
+                     % ' '.join(failed))
+        sys.exit(255)
+    logger.info('Successfully Generated %d boot variants' % len(jobs))
+
+
+def PackageBootImage(args, proot):
+    ''' Packaging different type of Boot Images '''
+    if args.variants:
+        PackageBootVariants(args, proot)
+        return
+    PrepareBootImage(args, proot)
+    GenerateBootImage(args, proot)
     # Copy Output files to TFTP directory
     CopyImageToTftp(args, proot)
 
@@ -395,6 +560,12 @@ def pkgboot_args(boot_parser):
     boot_parser.add_argument('--updatemem-extra-args', default='',
                              help='Microblaze only. Extra arguments to be passed while invoking updatemem command'
                              )
+    boot_parser.add_argument('--variants', type=os.path.realpath, metavar='<VARIANTS_FILE>',
+                             help='Generate multiple boot images in parallel.'
+                             '\nEach line of file is <name> <package boot args>,'
+                             '\nthe args are applied on top of command line args.'
+                             '\nDefault output: images/linux/<name>/<boot image>'
+                             )
 
     boot_parser.set_defaults(func=PackageBootImage)
     return
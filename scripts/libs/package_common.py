@@ -14,6 +14,7 @@ import os
 import sys
 import plnx_utils
 import plnx_vars
+import xsa_utils
 
 logger = logging.getLogger('PetaLinux')
 
@@ -27,6 +28,9 @@ BootParams = {}
 # Dict variable to store command line
 # args if no/none specified
 BootParamDisable = []
+# Pool workers leave the boot images cache eviction to the parent,
+# evicting from concurrent workers races on the same entries
+DeferCacheEviction = False
 # Dependency key values for Boot Params
 ParamDepKeys = {
     'Default': {
@@ -127,6 +131,14 @@ DefaultBootAttributes = {
 }
 
 
+def EvictBootBinCache(cache_dir):
+    ''' Evict the least recently used boot images cache entries,
+    skipped in pool workers and done by the parent after the pool'''
+    if cache_dir and os.path.isdir(cache_dir) and not DeferCacheEviction:
+        plnx_utils.evict_lru_cache(cache_dir, plnx_vars.BootBinCacheSizeEnv,
+                                   plnx_vars.BootBinCacheSize)
+
+
 def AddFpgaBootFile(fpga_arg, proot, xilinx_arch):
     ''' Get the default bit file path and add it to BootParams dict'''
     if_fpga_manager = plnx_utils.get_config_value(
@@ -142,7 +154,14 @@ def AddFpgaBootFile(fpga_arg, proot, xilinx_arch):
         if not os.path.isfile(bootfile):
             bootfile = os.path.join(plnx_vars.HWDescDir.format(proot),
                                     bootfile_name)
-            if not os.path.isfile(bootfile):
+        if not os.path.isfile(bootfile):
+            # Extract the bitstream from XSA
+            bootfile = ''
+            if bootfile_name:
+                bootfile = xsa_utils.extract_xsa_file(
+                    plnx_utils.get_xsaordts_path(proot), bootfile_name,
+                    plnx_vars.XsaExtractDir.format(proot))
+            if not bootfile:
                 logger.error('Default bitsream(%s) is not found,'
                              'please specify a bitstream file path with --fpga <BITSTREAM>'
                              % (bootfile_name))
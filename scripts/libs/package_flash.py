@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import sys
+import tempfile
+import cfgmem_utils
+import flash_utils
+import plnx_utils
+import plnx_vars
+
+logger = logging.getLogger('PetaLinux')
+
+
+def GetFlashPartFiles(args, proot, parts):
+    ''' Return the {partition name: image file} for flash partitions'''
+    files = {}
+    for part in parts:
+        image = flash_utils.get_flash_part_file(proot, part['name'],
+                                                args.xilinx_arch)
+        if image:
+            files[part['name']] = image
+    return files
+
+
+def LogFlashLayout(parts, files):
+    ''' Print the partitions with image size and utilisation'''
+    logger.info('%-10s %-12s %-12s %-12s %s' % (
+        'Partition', 'Offset', 'Size', 'Image size', 'Used'))
+    for part in parts:
+        image = files.get(part['name'], '')
+        used = os.path.getsize(image) if image and os.path.isfile(image) \
+            else 0
+        usage = '%d%%' % (used * 100 // part['size']) if part['size'] \
+            else '-'
+        logger.info('%-10s 0x%-10x 0x%-10x 0x%-10x %s' % (
+            part['name'], part['offset'], part['size'], used, usage))
+
+
+def GetFlashSize(proot):
+    ''' Return the flash size in bytes from flash_parts.txt, 0 if unknown'''
+    flash_size = plnx_utils.get_config_value(
+        'flash_size', plnx_vars.HsmOutFile.format(proot))
+    try:
+        return int(flash_size, base=16)
+    except ValueError:
+        return 0
+
+
+def PlanFlashLayout(args, proot):
+    ''' Plan the flash partitions from the image sizes and write the
+    system config and device tree fragments '''
+    flash_ipname, parts = flash_utils.read_flash_partitions(proot)
+    if not parts:
+        logger.error('No flash partitions found in system config, '
+                     'select the flash in petalinux-config first')
+        sys.exit(255)
+    files = GetFlashPartFiles(args, proot, parts)
+    logger.info('Current flash layout of %s:' % flash_ipname)
+    LogFlashLayout(parts, files)
+    flash_utils.check_flash_headroom(parts, files, args.headroom)
+    plan = flash_utils.plan_flash_layout(parts, files, args.erase_size,
+                                         args.headroom)
+    logger.info('Planned flash layout(erase size 0x%x, headroom %d%%):'
+                % (args.erase_size, args.headroom))
+    LogFlashLayout(plan, files)
+    flash_end = plan[-1]['offset'] + plan[-1]['size']
+    flash_size = GetFlashSize(proot)
+    if flash_size and flash_end > flash_size:
+        logger.error('Planned flash layout ends at 0x%x, exceeds the '
+                     'flash size 0x%x' % (flash_end, flash_size))
+        sys.exit(255)
+    logger.info('Flash used: 0x%x bytes, before: 0x%x bytes' % (
+        flash_end, parts[-1]['offset'] + parts[-1]['size']))
+
+    layout_dir = plnx_vars.FlashLayoutDir.format(proot)
+    plnx_utils.CreateDir(layout_dir)
+    config_file = os.path.join(layout_dir, 'flash-layout.cfg')
+    dtsi_file = os.path.join(layout_dir, 'flash-parts.dtsi')
+    plnx_utils.add_str_to_file(config_file, flash_utils.get_flash_layout_config(
+        flash_ipname, plan))
+    plnx_utils.add_str_to_file(dtsi_file, flash_utils.get_flash_layout_dtsi(
+        flash_ipname, plan))
+    logger.info('Flash layout config: %s' % config_file)
+    logger.info('Flash partition nodes: %s' % dtsi_file)
+    if args.apply:
+        flash_utils.apply_flash_layout(proot, flash_ipname, plan)
+        logger.info('Updated the flash partitions in %s, run '
+                    'petalinux-config --silentconfig to regenerate the '
+                    'configs' % plnx_vars.SysConfFile.format(proot))
+
+
+def WriteFlashImage(regions, outfile, image_size, fill, outformat):
+    ''' Write the regions into outfile through a temp file'''
+    fd, tmpfile = tempfile.mkstemp(prefix='.%s.' % os.path.basename(outfile),
+                                   dir=os.path.dirname(outfile))
+    os.close(fd)
+    try:
+        if outformat == 'MCS':
+            cfgmem_utils.write_mcs(regions, tmpfile)
+        else:
+            cfgmem_utils.write_bin(regions, tmpfile, image_size, fill)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfile, 0o666 & ~umask)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        plnx_utils.RemoveFile(tmpfile)
+        raise
+    logger.info('Flash image: %s' % outfile)
+
+
+def PackageFlashImage(args, proot):
+    ''' Package the partition images at flash_parts.txt offsets into
+    one programming image'''
+    flash_ipname, parts = flash_utils.read_flash_partitions(proot)
+    if not parts:
+        logger.error('No flash partitions found in system config, '
+                     'select the flash in petalinux-config first')
+        sys.exit(255)
+    parts = flash_utils.get_flash_parts_offsets(proot, parts)
+    files = GetFlashPartFiles(args, proot, parts)
+    for part_file in args.add or []:
+        name, _, image = part_file.partition('=')
+        if name not in [part['name'] for part in parts] or not image:
+            logger.error('Invalid --add %s, should be <partition>=<file> '
+                         'of a %s partition' % (part_file, flash_ipname))
+            sys.exit(255)
+        files[name] = os.path.realpath(image)
+    regions = []
+    for part in parts:
+        image = files.get(part['name'], '')
+        if not image:
+            continue
+        if not os.path.isfile(image):
+            logger.warning('%s not found, %s partition is left erased'
+                           % (image, part['name']))
+            files.pop(part['name'])
+            continue
+        regions.append(cfgmem_utils.get_cfgmem_region(part['offset'], image))
+    logger.info('Flash layout of %s:' % flash_ipname)
+    LogFlashLayout(parts, files)
+    if not regions:
+        logger.error('No partition images found in %s'
+                     % plnx_vars.BuildImagesDir.format(proot))
+        sys.exit(255)
+    if not flash_utils.check_flash_headroom(parts, files, 0):
+        logger.error('Partition images do not fit, resize the partitions '
+                     'with petalinux-package flash --apply')
+        sys.exit(255)
+    image_size = max(part['offset'] + part['size'] for part in parts)
+    flash_size = GetFlashSize(proot)
+    if flash_size and image_size > flash_size:
+        logger.error('Flash partitions end at 0x%x, exceeds the flash size '
+                     '0x%x' % (image_size, flash_size))
+        sys.exit(255)
+    try:
+        regions = cfgmem_utils.validate_cfgmem_regions(
+            regions, -(-image_size // (1024 * 1024)))
+    except Exception as e:
+        logger.error(e)
+        sys.exit(255)
+    output = args.output or os.path.join(
+        plnx_vars.BuildImagesDir.format(proot), plnx_vars.FlashImageFile)
+    plnx_utils.CreateDir(os.path.dirname(output))
+    WriteFlashImage(regions, output, image_size, args.fill, 'BIN')
+    if args.mcs:
+        WriteFlashImage(regions, os.path.splitext(output)[0] + '.mcs',
+                        image_size, args.fill, 'MCS')
+
+
+def PackageFlash(args, proot):
+    ''' Package the flash layout '''
+    args.xilinx_arch = plnx_utils.get_xilinx_arch(proot)
+    if args.erase_size <= 0 or args.erase_size & (args.erase_size - 1):
+        logger.error('Erase size 0x%x is invalid, it should be the power '
+                     'of 2.' % args.erase_size)
+        sys.exit(255)
+    if args.image:
+        PackageFlashImage(args, proot)
+    else:
+        PlanFlashLayout(args, proot)
+
+
+def pkgflash_args(flash_parser):
+    flash_parser.add_argument('-p', '--project', metavar='PROJECT_DIR', type=os.path.realpath,
+                              help='Specify full path to a PetaLinux project.'
+                              '\nDefault is the working project.')
+    flash_parser.add_argument('--erase-size', type=lambda value: int(value, 0),
+                              default=plnx_vars.FlashEraseSize,
+                              help='Flash erase block size, partitions are aligned to it.'
+                              '\nDefault: 0x%x' % plnx_vars.FlashEraseSize)
+    flash_parser.add_argument('--headroom', type=int, default=plnx_vars.FlashHeadroom,
+                              help='Free space to keep in each partition in %% of image size,'
+                              '\nwarn if the current partitions are having less.'
+                              '\nDefault: %d' % plnx_vars.FlashHeadroom)
+    flash_parser.add_argument('--apply', action='store_true',
+                              help='Update the planned partition sizes in system config')
+
+    flash_parser.add_argument('--image', action='store_true',
+                              help='Package the partition images at flash_parts.txt offsets'
+                              '\ninto one flash programming image')
+    flash_parser.add_argument('-o', '--output', metavar='OUTPUT', type=os.path.realpath,
+                              help='Flash image output file with --image.'
+                              '\nDefault: images/linux/%s' % plnx_vars.FlashImageFile)
+    flash_parser.add_argument('-a', '--add', metavar='<partition>=<file>', action='append',
+                              help='Program the file in partition with --image instead of'
+                              '\nthe default image, can be specified multiple times')
+    flash_parser.add_argument('--mcs', action='store_true',
+                              help='Also write the MCS file of the flash image with --image')
+    flash_parser.add_argument('--fill', type=lambda value: int(value, 0),
+                              default=0xff, choices=(0x0, 0xff), metavar='{0xff,0x0}',
+                              help='Byte to pad the unused flash with --image, 0x0 leaves'
+                              '\nholes in the image file. Default: 0xff')
+
+    flash_parser.set_defaults(func=PackageFlash)
+
+    return
@@ -13,6 +13,7 @@ import logging
 import os
 import sys
 import bitbake_utils
+import bitstream_utils
 import package_common
 import plnx_utils
 import plnx_vars
@@ -69,6 +70,9 @@ def PackagePrebuilt(args, proot):
                            'implementation')
     for fpgafile in args.fpga:
         if os.path.isfile(fpgafile):
+            if fpgafile.endswith('.bit'):
+                logger.info('Adding bitstream %s' % fpgafile)
+                bitstream_utils.log_bitstream_info(fpgafile)
             plnx_utils.CopyFile(fpgafile, FpgaDir)
     logger.info('Pre-built directory is updated.')
 
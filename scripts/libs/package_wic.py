@@ -15,8 +15,10 @@ import os
 import re
 import sys
 import bitbake_utils
+import fat_utils
 import plnx_utils
 import plnx_vars
+import sdimage_utils
 
 logger = logging.getLogger('PetaLinux')
 
@@ -28,6 +30,43 @@ RootPartSize = '4G'
 PseudoCmd = 'PSEUDO_LOCALSTATEDIR={0}/pseudo PSEUDO_NOSYMLINKEXP=1 \
         PSEUDO_IGNORE_PATHS="/usr/,/etc/,/lib,/dev/" PSEUDO_UNLOAD=1 PSEUDO_PREFIX={1} {2}'
 
+# fstab entry added for boot partition
+FstabBootEntry = 'LABEL=boot\t/boot\tvfat\tdefaults\t0\t0\n'
+
+# First boot hook to grow root partition and filesystem to disk size
+GrowFsScriptFile = '/usr/sbin/plnx-growfs'
+GrowFsScript = '''#!/bin/sh
+# Grow the root partition and ext4 filesystem to the end of the disk
+DEVNUM=$(mountpoint -d /) || exit 0
+SYSDIR=$(readlink -f /sys/dev/block/$DEVNUM)
+PARTNUM=$(cat $SYSDIR/partition 2>/dev/null) || exit 0
+DISK=/dev/$(basename $(dirname $SYSDIR))
+for tool in sfdisk partx resize2fs; do
+    if ! command -v $tool >/dev/null; then
+        echo "plnx-growfs: $tool not found, not growing the rootfs"
+        exit 0
+    fi
+done
+echo ", +" | sfdisk --no-reread -N $PARTNUM $DISK || exit 1
+partx -u -n $PARTNUM $DISK || exit 1
+resize2fs /dev/$(basename $SYSDIR) || exit 1
+rm -f {0} "$0"
+'''
+GrowFsSysvLink = '/etc/rcS.d/S99plnx-growfs'
+GrowFsSystemdUnitFile = '/lib/systemd/system/plnx-growfs.service'
+GrowFsSystemdLink = '/etc/systemd/system/multi-user.target.wants/plnx-growfs.service'
+GrowFsSystemdUnit = '''[Unit]
+Description=Grow root filesystem to the disk size
+After=systemd-remount-fs.service
+
+[Service]
+Type=oneshot
+ExecStart={0}
+
+[Install]
+WantedBy=multi-user.target
+'''
+
 # wks file
 WksFileStr = '''
 # Description: Creates a partitioned SD card image. Boot files
@@ -96,6 +135,201 @@ def GetDefaultWicFiles(args, proot):
     return WicDefaultFiles
 
 
+def GetWicRootfsKey(proot, rfs_file, pseudo, rootfs_dir):
+    ''' Return the extracted rootfs cache key of rfs_file, pseudo
+    database has the absolute paths so rootfs_dir is part of the key'''
+    return '%s:%s:%s' % (plnx_utils.get_filehashvalue_cached(proot, rfs_file),
+                         pseudo, os.path.abspath(rootfs_dir))
+
+
+def ExtractWicRootfs(proot, rfs_file, pseudo_prefix, pseudo):
+    ''' Extract the rootfs under pseudo into build/wic-rootfs/rootfs,
+    reuse if already extracted from the same tarball.
+    Pseudo database has the absolute paths, so it is extracted in place
+    and the key file is written once extraction is completed'''
+    rootfs_dir = os.path.join(plnx_vars.WicRootfsDir.format(proot), 'rootfs')
+    key_file = os.path.join(plnx_vars.WicRootfsDir.format(proot),
+                            plnx_vars.WicRootfsKeyFile)
+    if not os.path.exists(rfs_file):
+        logger.error('%s File doesnot exists' % rfs_file)
+        sys.exit(255)
+    rootfs_key = GetWicRootfsKey(proot, rfs_file, pseudo, rootfs_dir)
+    try:
+        with open(key_file, 'r') as file_data:
+            if file_data.read() == rootfs_key and os.path.isdir(rootfs_dir):
+                logger.info('Reusing the extracted rootfs of %s' % rfs_file)
+                return rootfs_dir
+    except OSError:
+        pass
+    # Rootfs changed or extraction not completed
+    plnx_utils.RemoveDir(plnx_vars.WicRootfsDir.format(proot))
+    plnx_utils.CreateDir(rootfs_dir)
+    plnx_utils.CreateDir(os.path.join(
+        plnx_vars.WicRootfsDir.format(proot), 'pseudo'))
+    logger.info('Extracting rootfs, This may take time!')
+    if os.path.exists(os.path.join(pseudo_prefix, 'var')):
+        plnx_utils.RemoveDir(os.path.join(pseudo_prefix, 'var'))
+    TarCmd = PseudoCmd.format(plnx_vars.WicRootfsDir.format(proot),
+                              pseudo_prefix, pseudo)
+    TarCmd += ' tar %s -xf "%s" -C "%s"' % (
+        plnx_utils.get_tar_decompress_args(rfs_file), rfs_file, rootfs_dir)
+    plnx_utils.runCmd(TarCmd, out_dir=os.getcwd(), shell=True)
+    plnx_utils.write_file_atomic(key_file, rootfs_key)
+    return rootfs_dir
+
+
+def GetSdImageBootFiles(images_dir, boot_files):
+    ''' Return the [(name, file)] of IMAGE_BOOT_FILES for boot partition
+    root directory, None if any file is to be installed in a sub
+    directory or is not a regular file'''
+    files = []
+    for entry in re.findall(r'[\w;\-\./\*]+', boot_files):
+        src, _, dest = entry.partition(';')
+        if '*' in src:
+            if dest:
+                return None
+            matches = sorted(glob.glob(os.path.join(images_dir, src)))
+            files += [(os.path.basename(match), match) for match in matches]
+        else:
+            files.append((dest or src, os.path.join(images_dir, src)))
+    for name, bootfile in files:
+        if '/' in name.strip('/') or not os.path.isfile(bootfile):
+            return None
+    return [(name.strip('/'), bootfile) for name, bootfile in files]
+
+
+def UseNativeSdImage(args, pseudo, tools_dir):
+    ''' Check the SD image can be created without wic, returns the
+    mkfs.ext4 to use or empty'''
+    if os.environ.get(plnx_vars.WicNativeEnv, '') == '0':
+        return ''
+    if args.wks or args.wic_extra_args.strip() or not os.path.isfile(pseudo):
+        return ''
+    try:
+        boot_size = sdimage_utils.get_size_bytes(BootPartSize)
+        sdimage_utils.get_size_bytes(RootPartSize)
+        if not args.auto_size:
+            fat_utils.get_fat_layout(boot_size)
+    except Exception:
+        return ''
+    return sdimage_utils.get_mkfs_ext4(tools_dir)
+
+
+def PackageNativeSdImage(args, proot, boot_files, rfs_file, pseudo_prefix,
+                         pseudo, tools_dir):
+    ''' Create the SD image without wic if possible, returns True if
+    created'''
+    mkfs = UseNativeSdImage(args, pseudo, tools_dir)
+    files = GetSdImageBootFiles(args.images_dir, boot_files) if mkfs else None
+    if not files:
+        return False
+    PackageSdImage(args, proot, files, rfs_file, mkfs, pseudo_prefix, pseudo)
+    return True
+
+
+def GetBootFilesPaths(images_dir, boot_files):
+    ''' Return the source paths of IMAGE_BOOT_FILES entries'''
+    paths = []
+    for entry in re.findall(r'[\w;\-\./\*]+', boot_files):
+        paths += sorted(glob.glob(os.path.join(
+            images_dir, entry.partition(';')[0])))
+    return paths
+
+
+def SetAutoPartSizes(args, boot_paths, rootfs_dir):
+    ''' Set the boot and root partition sizes fitting the boot files and
+    rootfs content with headroom'''
+    global BootPartSize, RootPartSize
+    align = plnx_vars.WicAutoSizeAlign
+    # Largest cluster size rounds up the most, smaller ones fit in it
+    cluster_size = fat_utils.FatClusterSizes[0]
+    inodes, blocks = sdimage_utils.get_files_usage(boot_paths, cluster_size)
+    # Root directory with 8.3 and long name entries(13 chars each)
+    dir_size = fat_utils.DirEntrySize * (1 + sum(
+        2 + len(os.path.basename(path)) // 13 for path in boot_paths))
+    boot_used = (blocks + -(-dir_size // cluster_size)) * cluster_size
+    boot_used += boot_used * args.headroom // 100
+    boot_size = max(fat_utils.FatMinImageSize,
+                    -(-boot_used // align) * align)
+    # Add the reserved sectors and FAT tables
+    while True:
+        sec_per_clus, fat_sectors, clusters = fat_utils.get_fat_layout(
+            boot_size)
+        if clusters * sec_per_clus * fat_utils.SectorSize >= boot_used:
+            break
+        boot_size += align
+    inodes, blocks = sdimage_utils.get_files_usage(
+        [rootfs_dir], sdimage_utils.Ext4BlockSize)
+    root_size = sdimage_utils.get_ext4_fit_size(inodes, blocks,
+                                                args.headroom, align)
+    BootPartSize = '%dM' % (boot_size // (1024 * 1024))
+    RootPartSize = '%dM' % (root_size // (1024 * 1024))
+    logger.info('Auto size partitions(%d%% headroom): boot %s, root %s'
+                '(%d inodes, %d blocks used)' % (
+                    args.headroom, BootPartSize, RootPartSize, inodes,
+                    blocks))
+
+
+def GetGrowFsFiles(rootfs_dir):
+    ''' Return the files and links to add the first boot grow rootfs hook
+    for the init systems found in rootfs_dir'''
+    links = []
+    if os.path.isdir(os.path.join(rootfs_dir, 'etc', 'rcS.d')):
+        links.append((GrowFsSysvLink, GrowFsScriptFile))
+    files = []
+    if os.path.lexists(os.path.join(rootfs_dir, 'lib', 'systemd', 'systemd')) \
+            or os.path.lexists(os.path.join(rootfs_dir, 'usr', 'lib',
+                                            'systemd', 'systemd')):
+        files.append((GrowFsSystemdUnitFile,
+                      GrowFsSystemdUnit.format(GrowFsScriptFile), 0o644))
+        links.append((GrowFsSystemdLink, GrowFsSystemdUnitFile))
+    if not links:
+        logger.warning('No init system found in rootfs, skip adding the '
+                       'grow rootfs hook')
+        return [], []
+    # One shot hook, drop the links, unit and the script after first run
+    files.append((GrowFsScriptFile, GrowFsScript.format(
+        ' '.join([link for link, target in links] +
+                 [_file for _file, content, mode in files])), 0o755))
+    return files, links
+
+
+def PackageSdImage(args, proot, boot_files, rfs_file, mkfs, pseudo_prefix,
+                   pseudo):
+    ''' Create the SD image for default wks layout without wic '''
+    logger.info('Creating SD image')
+    rootfs_dir = ExtractWicRootfs(proot, rfs_file, pseudo_prefix, pseudo)
+    if args.auto_size:
+        SetAutoPartSizes(args, [bootfile for name, bootfile in boot_files],
+                         rootfs_dir)
+    files, links = GetGrowFsFiles(rootfs_dir) if args.grow_rootfs \
+        else ([], [])
+    fstab = sdimage_utils.get_fstab_update(rootfs_dir, [FstabBootEntry])
+    if fstab:
+        files.append(('/etc/fstab', fstab, 0o644))
+    plnx_utils.RemoveDir(plnx_vars.WicTmpWorkDir.format(proot))
+    plnx_utils.CreateDir(plnx_vars.WicTmpWorkDir.format(proot))
+    plnx_utils.CreateDir(args.outdir)
+    out_file = os.path.join(args.outdir, plnx_vars.WicOutFile)
+    tmp_file = os.path.join(plnx_vars.WicTmpWorkDir.format(proot),
+                            plnx_vars.WicOutFile)
+    cmd_prefix = PseudoCmd.format(plnx_vars.WicRootfsDir.format(proot),
+                                  pseudo_prefix, pseudo)
+    sdimage_utils.create_sd_image(
+        tmp_file, boot_files, sdimage_utils.get_size_bytes(BootPartSize),
+        rootfs_dir, sdimage_utils.get_size_bytes(RootPartSize), mkfs,
+        plnx_vars.WicNativeAlign, cmd_prefix, files, links)
+    plnx_utils.MoveFile(tmp_file, out_file)
+    plnx_utils.RemoveDir(plnx_vars.WicTmpWorkDir.format(proot))
+    # QEMU SD needs power of 2 size, pad the hole before bmap and
+    # compression so petalinux-boot qemu does not resize the image
+    plnx_utils.MakePowerof2(out_file)
+    sdimage_utils.write_bmap(out_file, out_file + '.bmap')
+    if args.compress:
+        sdimage_utils.compress_image(out_file, args.compress, args.threads)
+    logger.info('Successfully Generated image: %s' % out_file)
+
+
 def PackageWic(args, proot):
     ''' Generate the WIC image'''
     args.arch = plnx_utils.get_system_arch(proot)
@@ -104,13 +338,24 @@ def PackageWic(args, proot):
         args.images_dir = os.path.join(proot, args.images_dir)
     logger.info('Sourcing build environment')
 
+    if args.auto_size and args.size:
+        logger.error('--auto-size and --size cannot be used together')
+        sys.exit(255)
+    if args.headroom < 0:
+        logger.error('--headroom should not be negative: %d' % args.headroom)
+        sys.exit(255)
+    if args.threads < 0:
+        logger.error('--threads should not be negative: %d' % args.threads)
+        sys.exit(255)
+    if not args.threads:
+        args.threads = os.cpu_count() or 1
+    if args.auto_size and args.wks:
+        logger.warning('--auto-size is ignored, partition sizes are taken '
+                       'from %s' % args.wks)
     WicDefaultFiles = args.bootfiles
     if not WicDefaultFiles:
         WicDefaultFiles = GetDefaultWicFiles(args, proot)
 
-    WicTmpRootfs = os.path.join(
-        plnx_vars.WicTmpWorkDir.format(proot), 'rootfs')
-
     WicRfsFile = args.rootfs_file
     if not WicRfsFile:
         WicRfsFile = os.path.join(args.images_dir, 'rootfs.tar.gz')
@@ -128,15 +373,6 @@ def PackageWic(args, proot):
         '${PROOT}', proot).replace('$PROOT', proot)
     ConfigTmpDir = os.path.expandvars(ConfigTmpDir)
 
-    # Check Yocto SDK env script exists or not
-    if not os.path.exists(plnx_vars.EsdkInstalledDir.format(proot)) or \
-            not glob.glob(os.path.join(plnx_vars.EsdkInstalledDir.format(proot),
-                          'environment-setup*')):
-        logger.error(
-            'Failed to get yocto SDK environment file, This is required to create wic image.')
-        logger.error('Run petalinux-config to install yocto SDK')
-        sys.exit(255)
-
     # Check if TMPDIR is NFS
     if not os.path.exists(ConfigTmpDir) or plnx_utils.get_filesystem_id(ConfigTmpDir) == '6969':
         logger.error(
@@ -147,13 +383,36 @@ def PackageWic(args, proot):
     PseudoPrefix = os.path.join(
         ConfigTmpDir, 'sysroots-components', 'x86_64', 'pseudo-native', 'usr')
     Pseudo = os.path.join(PseudoPrefix, 'bin', 'pseudo')
+    WicToolsDir = os.path.join(ConfigTmpDir, 'work', plnx_vars.YoctoEnvFile[args.arch],
+                               'wic-tools', '1.0-r0', 'recipe-sysroot-native')
+    # Update petalinux-bsp.conf file with boot files given for both
+    # native and wic SD images
+    plnx_utils.update_config_value('IMAGE_BOOT_FILES:%s ' % args.xilinx_arch,
+                                   ' "%s"' % WicDefaultFiles,
+                                   plnx_vars.PlnxBspConfig.format(proot))
+    # Default layout can be created without wic and bitbake
+    if PackageNativeSdImage(args, proot, WicDefaultFiles, WicRfsFile,
+                            PseudoPrefix, Pseudo, WicToolsDir):
+        return
+
+    # Check Yocto SDK env script exists or not
+    if not os.path.exists(plnx_vars.EsdkInstalledDir.format(proot)) or \
+            not glob.glob(os.path.join(plnx_vars.EsdkInstalledDir.format(proot),
+                          'environment-setup*')):
+        logger.error(
+            'Failed to get yocto SDK environment file, This is required to create wic image.')
+        logger.error('Run petalinux-config to install yocto SDK')
+        sys.exit(255)
+
     if not os.path.isfile(Pseudo):
         logger.info('bitbake pseudo-native')
         bitbake_utils.run_bitbakecmd('bitbake pseudo-native',
                                      proot, shell=True, logfile=args.logfile)
+        # Only pseudo was missing to create it without wic-tools
+        if PackageNativeSdImage(args, proot, WicDefaultFiles, WicRfsFile,
+                                PseudoPrefix, Pseudo, WicToolsDir):
+            return
     # Check wictool dir if not build it
-    WicToolsDir = os.path.join(ConfigTmpDir, 'work', plnx_vars.YoctoEnvFile[args.arch],
-                               'wic-tools', '1.0-r0', 'recipe-sysroot-native')
     if not os.path.isdir(WicToolsDir):
         logger.info('bitbake wic-tools')
         bitbake_utils.run_bitbakecmd('bitbake wic-tools',
@@ -166,22 +425,13 @@ def PackageWic(args, proot):
     WicTmpBuildDir = os.path.join(plnx_vars.WicTmpWorkDir.format(proot),
                                   'wic-tmp')
     plnx_utils.CreateDir(WicTmpBuildDir)
-    # Extract the rootfs if not exists in given path
-    if not os.path.exists(WicTmpRootfs):
-        plnx_utils.CreateDir(WicTmpRootfs)
-        plnx_utils.CreateDir(os.path.join(
-            plnx_vars.WicTmpWorkDir.format(proot), 'pseudo'))
-        logger.info('Extracting rootfs, This may take time!')
-        if not os.path.exists(WicRfsFile):
-            logger.error('%s File doesnot exists' % WicRfsFile)
-            sys.exit(255)
-        if os.path.exists(os.path.join(PseudoPrefix, 'var')):
-            plnx_utils.RemoveDir(os.path.join(PseudoPrefix, 'var'))
-
-        TarCmd = PseudoCmd.format(plnx_vars.WicTmpWorkDir.format(proot),
-                                  PseudoPrefix, Pseudo)
-        TarCmd += ' tar -xf "%s" -C "%s"' % (WicRfsFile, WicTmpRootfs)
-        plnx_utils.runCmd(TarCmd, out_dir=os.getcwd(), shell=True)
+    WicTmpRootfs = ExtractWicRootfs(proot, WicRfsFile, PseudoPrefix, Pseudo)
+    if args.auto_size and not args.wks:
+        SetAutoPartSizes(args, GetBootFilesPaths(args.images_dir, WicDefaultFiles),
+                         WicTmpRootfs)
+    if args.grow_rootfs:
+        logger.warning('--grow-rootfs is supported only when the SD image is '
+                       'created without wic, skipping it')
 
     logger.info('Creating wic image')
     # Generate the wks file if user not given
@@ -191,10 +441,6 @@ def PackageWic(args, proot):
         plnx_utils.CreateFile(WksFile)
         plnx_utils.add_str_to_file(WksFile,
                                    WksFileStr.format(BootPartSize, RootPartSize))
-    # Update petalinux-bsp.conf file with boot files given
-    plnx_utils.update_config_value('IMAGE_BOOT_FILES:%s ' % args.xilinx_arch,
-                                   ' "%s"' % WicDefaultFiles,
-                                   plnx_vars.PlnxBspConfig.format(proot))
     # wic create command to create sd image
     WicCmd = 'wic create %s --rootfs-dir %s --bootimg-dir %s \
 --kernel-dir %s --outdir  %s -n %s %s' % (
@@ -214,10 +460,19 @@ def PackageWic(args, proot):
         'direct', 'wic')
     # Copy final image to outdir
     plnx_utils.CreateDir(args.outdir)
-    plnx_utils.RenameFile(WicOutFile, os.path.join(args.outdir,
-                                                   'petalinux-sdimage.%s' % WicOutExt))
+    WicImage = os.path.join(args.outdir, 'petalinux-sdimage.%s' % WicOutExt)
+    plnx_utils.MoveFile(WicOutFile, WicImage)
     # Remove wic tmp dir
     plnx_utils.RemoveDir(plnx_vars.WicTmpWorkDir.format(proot))
+    # Block map for flashing only the used blocks of raw image
+    if WicOutExt == 'wic':
+        # Padded for QEMU SD as in PackageSdImage
+        plnx_utils.MakePowerof2(WicImage)
+        sdimage_utils.write_bmap(WicImage, WicImage + '.bmap')
+        if args.compress:
+            sdimage_utils.compress_image(WicImage, args.compress, args.threads)
+    elif args.compress:
+        logger.warning('Image is already compressed by wic, skipping --compress')
     logger.info('Successfully Generated image: %s' % os.path.join(args.outdir,
                                                                   'petalinux-sdimage.%s' % WicOutExt))
 
@@ -259,6 +514,27 @@ def pkgwic_args(wic_parser):
                                  '\nDefault size: boot - 2G, root - 4G.'
                                  '\nExample: --size 2G,2G -> boot - 2G, root - 2G.'
                             )
+    wic_parser.add_argument('--auto-size', action='store_true',
+                            help='Size the boot and root partitions to fit the boot files'
+                            '\nand rootfs content with headroom, instead of fixed size.'
+                            )
+    wic_parser.add_argument('--headroom', type=int, default=plnx_vars.WicHeadroom,
+                            help='Free space to keep with --auto-size in %% of content size.'
+                            '\nDefault: %d' % plnx_vars.WicHeadroom
+                            )
+    wic_parser.add_argument('--grow-rootfs', action='store_true',
+                            help='Grow the root partition and filesystem to the SD card'
+                            '\nsize on first boot, needs sfdisk, partx and resize2fs in rootfs.'
+                            )
+    wic_parser.add_argument('--compress', choices=sdimage_utils.ImageCompressors.keys(),
+                            help='Also write the compressed petalinux-sdimage.wic.<zst|xz|gz>.'
+                            '\nzstd-seekable writes independent 4MB zstd frames with seek'
+                            '\ntable to read any offset without decompressing whole image.'
+                            )
+    wic_parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                            help='Number of threads to compress the image, 0 for number'
+                            '\nof CPUs. Default: number of CPUs'
+                            )
     wic_parser.add_argument('--wic-extra-args', default='',
                             help='Extra arguments to be passed while invoking wic command'
                             )
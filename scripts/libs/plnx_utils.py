@@ -14,8 +14,11 @@ import re
 import shutil
 import subprocess
 import sys
+import tempfile
 import bitbake_utils
+import flash_utils
 import plnx_vars
+import xsa_utils
 from common_utils import *
 
 logger = logging.getLogger('PetaLinux')
@@ -30,21 +33,56 @@ def is_hwflow_sdt(proot):
     return hdf_ext
 
 
-def get_plnx_projects_from_bsp(source):
-    '''Get the Projects from BSP tar ball'''
-    contents_cmd = 'tar --exclude="*/*/*" -tf "%s"' % (source)
-    contents, stderr = runCmd(contents_cmd, os.getcwd(), shell=True)
+def get_tar_decompress_args(source):
+    '''Return the tar args to decompress the source based on its
+    compression type, using parallel decompressor if available.
+    Empty for plain tar'''
+    with open(source, 'rb') as file_data:
+        magic = file_data.read(8)
+    for magic_bytes, tar_args, decompressors in plnx_vars.TarDecompressors:
+        if magic.startswith(magic_bytes):
+            for decompressor in decompressors:
+                if shutil.which(decompressor.split()[0]):
+                    return '-I "%s"' % decompressor
+            return tar_args
+    return ''
+
+
+def extract_bsp_projects(source, outdir):
+    '''Extract the BSP into a staging dir in outdir in single pass,
+    projects are found from the extracted members and progress of each
+    project is logged. Returns the staging dir and projects in it'''
+    staging_dir = tempfile.mkdtemp(prefix='.bsp.', dir=outdir)
+    extract_cmd = 'tar %s -xvf "%s"' % (get_tar_decompress_args(source),
+                                       source)
+    logger.debug(extract_cmd)
+    process = subprocess.Popen(extract_cmd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, shell=True,
+                               executable='/bin/bash', cwd=staging_dir)
+    extracted = {}
     projects = []
-    for content in contents.split():
-        project_name = content.split('/')[0]
-        projects.append(project_name) if project_name not in projects else ''
-
-    real_proj = []
-    for p in projects:
-        if plnx_vars.MetaDataDir.format(p) in contents:
-            real_proj.append(p)
-
-    return real_proj
+    messages = []
+    for line in process.stdout:
+        line = line.decode('utf-8', 'replace')
+        member = line.strip().split('/')
+        if len(member) < 2 or line.startswith('tar:'):
+            messages.append(line)
+            continue
+        if member[0] not in extracted:
+            logger.info('Extracting %s' % member[0])
+            extracted[member[0]] = 0
+        extracted[member[0]] += 1
+        if member[1] == os.path.basename(plnx_vars.MetaDataDir) and \
+                member[0] not in projects:
+            projects.append(member[0])
+    process.wait()
+    if process.returncode != 0:
+        RemoveDir(staging_dir)
+        raise Exception('\n%s\nFailed to extract BSP %s!' % (
+            ''.join(messages), source))
+    for name, members in extracted.items():
+        logger.debug('Extracted %d files of %s' % (members, name))
+    return staging_dir, projects
 
 
 def exit_not_plnx_project(proot):
@@ -224,7 +262,10 @@ def GetFileFromXsa(proot, hw_file='', bootfile_ext=''):
                 '*_boot.%s' % bootfile_ext))
         return bootfile[0]
 
-    import tempfile
+    bootfile = xsa_utils.get_xsa_files_bytype(proot, hw_file, bootfile_ext)
+    if bootfile is not None:
+        return bootfile
+    # Unknown XSA manifest format, fallback to xsct
     filehandle = tempfile.NamedTemporaryFile()
     xsctfile = filehandle.name
     add_str_to_file(xsctfile,
@@ -318,34 +359,76 @@ def gen_sysconf_dtsi_file(proot):
         add_str_to_file(SdtSystemConfDtsi,
                         plnx_vars.SystemconfEth.format(
                             eth_ipname, eth_mac), mode='a')
-    flash_ipname = get_config_value(plnx_vars.FlashIpConf,
-                                    plnx_vars.SysConfFile.format(proot))
+    flash_ipname, flash_parts = flash_utils.read_flash_partitions(proot)
     if flash_ipname:
-        prev_part_offset = '0x0'
-        prev_part_size = '0x0'
-        add_str_to_file(SdtSystemConfDtsi,
-                        plnx_vars.SystemconfFlash.format(
-                            flash_ipname), mode='a')
-        for num in range(0, 19):
-            part_offset = add_offsets(prev_part_offset, prev_part_size)
-            part_name = get_config_value('%s%s%s%s' % (
-                plnx_vars.FlashConfs['Prefix'], '%s_PART' % flash_ipname.upper(),
-                num, plnx_vars.FlashConfs['Name']),
-                plnx_vars.SysConfFile.format(proot))
-            part_size = get_config_value('%s%s%s%s' % (
-                plnx_vars.FlashConfs['Prefix'], '%s_PART' % flash_ipname.upper(),
-                num, plnx_vars.FlashConfs['Size']),
-                plnx_vars.SysConfFile.format(proot))
-            prev_part_offset = part_offset
-            prev_part_size = part_size
-            if part_name:
-                add_str_to_file(SdtSystemConfDtsi,
-                                plnx_vars.FlashPartNode.format(
-                                    num, part_name, part_offset, part_size), mode='a')
-            else:
-                break
         add_str_to_file(SdtSystemConfDtsi,
-                        plnx_vars.FlashendSymbols, mode='a')
+                        flash_utils.get_flash_layout_dtsi(
+                            flash_ipname, flash_parts), mode='a')
+
+
+# Hash cache entries of pool workers, written by the parent with
+# store_filehash_cache to avoid racing on the cache file. None writes
+# the entries directly
+HashCacheUpdates = None
+
+
+def load_filehash_cache(proot):
+    '''Return the project hash cache, recently used files at the end'''
+    import json
+    cache_file = plnx_vars.HashCacheFile.format(proot)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as file_data:
+                return json.load(file_data)
+        except ValueError:
+            pass
+    return {}
+
+
+def store_filehash_cache(proot, entries):
+    '''Add the file path to [stat, hash] entries as recently used ones
+    Cache keeps only the HashCacheSize recently used files'''
+    import json
+    cache_file = plnx_vars.HashCacheFile.format(proot)
+    if not entries or not os.path.isdir(os.path.dirname(cache_file)):
+        return
+    cache = load_filehash_cache(proot)
+    for filepath in entries:
+        cache.pop(filepath, None)
+    start = max(len(cache) - plnx_vars.HashCacheSize + len(entries), 0)
+    cache = dict(list(cache.items())[start:])
+    cache.update(list(entries.items())[-plnx_vars.HashCacheSize:])
+    write_file_atomic(cache_file, json.dumps(cache))
+    # Drop the old unbounded hash entries from metadata
+    metadata = plnx_vars.MetaDataFile.format(proot)
+    if get_config_lines_startswith(plnx_vars.HashCachePrefix, metadata):
+        remove_str_from_file(metadata, '^%s' % plnx_vars.HashCachePrefix)
+
+
+def get_filehashvalue_cached(proot, filename):
+    '''Get sha256 for given file from project hash cache,
+    hash the file only if its (path, size, mtime, inode) changed'''
+    filepath = os.path.realpath(filename)
+    fingerprint = get_file_fingerprint(filepath)
+    if not fingerprint:
+        return get_filehashvalue(filename)
+    stat_str = '%d:%d:%d' % (fingerprint[1], fingerprint[0], fingerprint[2])
+    cache = load_filehash_cache(proot)
+    if HashCacheUpdates:
+        cache.update(HashCacheUpdates)
+    cached = cache.get(filepath)
+    if cached and cached[0] == stat_str:
+        hashvalue = cached[1]
+        if list(cache)[-1] == filepath:
+            return hashvalue
+    else:
+        hashvalue = get_filehashvalue(filepath)
+    if HashCacheUpdates is not None:
+        HashCacheUpdates.pop(filepath, None)
+        HashCacheUpdates[filepath] = [stat_str, hashvalue]
+    else:
+        store_filehash_cache(proot, {filepath: [stat_str, hashvalue]})
+    return hashvalue
 
 
 def validate_hwchecksum(proot):
@@ -362,11 +445,11 @@ def validate_hwchecksum(proot):
     '''Checksum of get-hw-description path stored in metadata file'''
     hw_path_checksum = ''
     if os.path.isfile(hw_path):
-        hw_path_checksum = get_filehashvalue(hw_path)
+        hw_path_checksum = get_filehashvalue_cached(proot, hw_path)
     '''Checksum of project-spec/hw-description'''
     hw_checksum = ''
     if os.path.isfile(hw_file):
-        hw_checksum = get_filehashvalue(hw_file)
+        hw_checksum = get_filehashvalue_cached(proot, hw_file)
     validate_chksum = get_config_value('VALIDATE_HW_CHKSUM',
                                        plnx_vars.MetaDataFile.format(proot))
 
@@ -378,11 +461,112 @@ def validate_hwchecksum(proot):
                             plnx_vars.MetaDataFile.format(proot))
 
 
+def get_files_hashvalue(files):
+    '''Return the sha256 of given files content and paths'''
+    import hashlib
+    method = hashlib.sha256()
+    for filename in files:
+        method.update(filename.encode() + b'\0')
+        if os.path.isfile(filename):
+            method.update(get_filehashvalue(filename).encode())
+        elif os.path.isdir(filename):
+            for dname, dirs, dfiles in sorted(os.walk(filename)):
+                for fname in sorted(dfiles):
+                    method.update(str(get_file_fingerprint(
+                        os.path.join(dname, fname))).encode())
+    return method.hexdigest()
+
+
+def get_setup_fingerprints(proot, gen_confargs, add_layers):
+    '''Return the input fingerprint of each setup_plnwrapper phase'''
+    import hashlib
+    metadata = plnx_vars.MetaDataFile.format(proot)
+    sysconf = plnx_vars.SysConfFile.format(proot)
+    hw_file = get_xsaordts_path(proot)
+    hw_path = get_config_value('HARDWARE_PATH', metadata)
+    tool_version = [plnx_vars.PetaLinux, plnx_vars.PetaLinux_Ver]
+    local_conf = [plnx_vars.LocalConf.format(proot),
+                  plnx_vars.BBLayersConf.format(proot)]
+    sysconf_hash = get_files_hashvalue([sysconf])
+    yocto_esdkpath, arch = get_yocto_path(proot, get_system_arch(proot))
+    esdk_metadata_file = os.path.join(os.path.dirname(yocto_esdkpath),
+                                      '.statistics', arch)
+    workspace_path = get_workspace_path(proot)
+    dts_dir = get_config_value('CONFIG_SUBSYSTEM_DT_XSCT_WORKSPACE', sysconf)
+    dts_dir = dts_dir.replace('${PROOT}', proot).replace('$PROOT', proot)
+    phase_inputs = {
+        'HWCHECKSUM': [hw_file, hw_path, str(get_file_fingerprint(hw_file)),
+                       str(get_file_fingerprint(hw_path)),
+                       get_config_value('VALIDATE_HW_CHKSUM', metadata)],
+        'YOCTO_SOURCE': tool_version + [
+            get_config_value('BASE_SDK', esdk_metadata_file),
+            get_config_value('YOCTO_SDK', metadata),
+            str(os.path.exists(plnx_vars.EsdkBBLayerconf.format(proot)))],
+        'BITBAKE_ENV': tool_version + [
+            bitbake_utils.get_bitbake_env_key(proot),
+            get_files_hashvalue(local_conf)],
+        'GENMACHINECONF': tool_version + [
+            gen_confargs, str(add_layers), get_xilinx_arch(proot),
+            get_files_hashvalue([plnx_vars.HWDescDir.format(proot)]),
+            get_filehashvalue_cached(proot, hw_file)
+            if os.path.isfile(hw_file) else '',
+            sysconf_hash,
+            get_files_hashvalue([plnx_vars.RfsConfig.format(proot),
+                                 plnx_vars.UsrRfsConfig.format(proot),
+                                 plnx_vars.PlnxToolConf.format(proot),
+                                 plnx_vars.SdtAutoConf.format(proot)])],
+        'WORKSPACE': [str(add_layers), workspace_path,
+                      str(os.path.exists(os.path.join(
+                          workspace_path, 'conf', 'layer.conf'))),
+                      get_files_hashvalue(local_conf)],
+        'INITSCRIPTS': [sysconf_hash, get_files_hashvalue([
+            plnx_vars.P_Interfaces.format(proot),
+            plnx_vars.P_SystemdWired.format(proot),
+            plnx_vars.P_InetDConf.format(proot)])],
+        'SYSCONF_DTSI': [sysconf_hash, get_files_hashvalue([
+            os.path.join(dts_dir, 'system-conf.dtsi')])]
+    }
+    fingerprints = {}
+    for phase, inputs in phase_inputs.items():
+        fingerprints[phase] = hashlib.sha256(
+            '\0'.join(inputs).encode()).hexdigest()
+    return fingerprints
+
+
+def get_old_setup_fingerprints(proot, phases):
+    '''Return the phase fingerprints of last successful setup'''
+    fingerprint_file = plnx_vars.SetupFingerprintFile.format(proot)
+    if not os.path.isfile(fingerprint_file):
+        return {}
+    return {phase: get_config_value(phase, fingerprint_file)
+            for phase in phases}
+
+
+def is_setup_phase_dirty(phase, fingerprints, old_fingerprints, dirty):
+    '''Check the phase fingerprint with the last successful setup
+    Once a phase is dirty all the next phases has to run'''
+    if not dirty:
+        dirty = old_fingerprints.get(phase) != fingerprints[phase]
+    if not dirty:
+        logger.debug('Skipping %s setup, inputs unchanged' % phase.lower())
+    return dirty
+
+
+def save_setup_fingerprints(proot, gen_confargs, add_layers):
+    '''Store the phase fingerprints of successful setup'''
+    fingerprints = get_setup_fingerprints(proot, gen_confargs, add_layers)
+    fingerprint_trans = config_transaction_begin(
+        plnx_vars.SetupFingerprintFile.format(proot))
+    config_transaction_add_str(fingerprint_trans, '', mode='w')
+    for phase, fingerprint in fingerprints.items():
+        config_transaction_update_value(fingerprint_trans, phase, fingerprint)
+    config_transaction_commit(fingerprint_trans)
+
+
 def setup_plnwrapper(args, proot, config_target, gen_confargs):
-    '''Setting up the PetaLinux wrapper to generate the configs'''
-    validate_hwchecksum(proot)
-    bitbake_utils.get_yocto_source(proot)
-    bitbake_utils.setup_bitbake_env(proot, args.logfile)
+    '''Setting up the PetaLinux wrapper to generate the configs
+    Each phase runs only if its input fingerprint changed from the
+    last successful setup or --force-setup specified'''
     add_layers = False
     if args.command == 'petalinux-config' and args.component != 'rootfs':
         # Not run for petalinux-config -c rootfs
@@ -391,24 +575,58 @@ def setup_plnwrapper(args, proot, config_target, gen_confargs):
         # Run for petalinux-!{config}
         add_layers = True
 
+    fingerprints = get_setup_fingerprints(proot, gen_confargs, add_layers)
+    dirty = getattr(args, 'force_setup', False)
+    old_fingerprints = get_old_setup_fingerprints(proot, fingerprints)
+    # Remove old fingerprints, so failed setup will run again
+    RemoveFile(plnx_vars.SetupFingerprintFile.format(proot))
+    dirty = is_setup_phase_dirty(
+        'HWCHECKSUM', fingerprints, old_fingerprints, dirty)
+    if dirty:
+        validate_hwchecksum(proot)
+    dirty = is_setup_phase_dirty(
+        'YOCTO_SOURCE', fingerprints, old_fingerprints, dirty)
+    if dirty:
+        bitbake_utils.get_yocto_source(proot)
+    dirty = is_setup_phase_dirty(
+        'BITBAKE_ENV', fingerprints, old_fingerprints, dirty)
+    if dirty:
+        bitbake_utils.setup_bitbake_env(proot, args.logfile)
+
     xilinx_arch = get_xilinx_arch(proot)
-    bitbake_utils.run_genmachineconf(
-        proot, xilinx_arch, gen_confargs, add_layers, args.logfile)
-    if add_layers:
+    dirty = is_setup_phase_dirty(
+        'GENMACHINECONF', fingerprints, old_fingerprints, dirty)
+    # Always run the menuconfig
+    if dirty or gen_confargs.find('--menuconfig') != -1:
+        bitbake_utils.run_genmachineconf(
+            proot, xilinx_arch, gen_confargs, add_layers, args.logfile)
+        dirty = True
+    dirty = is_setup_phase_dirty(
+        'WORKSPACE', fingerprints, old_fingerprints, dirty)
+    if add_layers and dirty:
         workspace_path = get_workspace_path(proot)
         logger.info('Generating workspace directory')
         workspace_cmd = 'devtool create-workspace "%s"' % workspace_path
         bitbake_utils.run_bitbakecmd(
             workspace_cmd, proot, logfile=args.logfile, shell=True)
-        remove_str_from_file(plnx_vars.LocalConf.format(proot),
-                             '^include conf\/petalinuxbsp.conf')
-        add_str_to_file(plnx_vars.LocalConf.format(proot),
-                        'include conf/petalinuxbsp.conf\n',
-                        ignore_if_exists=True, mode='a+')
-    config_initscripts(proot)
-
-    if is_hwflow_sdt(proot) == 'sdt':
+        localconf_trans = config_transaction_begin(
+            plnx_vars.LocalConf.format(proot))
+        config_transaction_remove_str(localconf_trans,
+                                      '^include conf\/petalinuxbsp.conf')
+        config_transaction_add_str(localconf_trans,
+                                   'include conf/petalinuxbsp.conf\n',
+                                   ignore_if_exists=True)
+        config_transaction_commit(localconf_trans)
+    dirty = is_setup_phase_dirty(
+        'INITSCRIPTS', fingerprints, old_fingerprints, dirty)
+    if dirty:
+        config_initscripts(proot)
+
+    dirty = is_setup_phase_dirty(
+        'SYSCONF_DTSI', fingerprints, old_fingerprints, dirty)
+    if is_hwflow_sdt(proot) == 'sdt' and dirty:
         gen_sysconf_dtsi_file(proot)
+    save_setup_fingerprints(proot, gen_confargs, add_layers)
 
 
 def PlnxTraceback(e):
@@ -116,6 +116,30 @@ bb_extraenv = os.environ.get('BB_ENV_PASSTHROUGH_ADDITIONS', '')
 plnx_bbenv = 'PETALINUX PETALINUX_VER PETALINUX_MAJOR_VER'
 os.environ['BB_ENV_PASSTHROUGH_ADDITIONS'] = bb_extraenv + ' ' + plnx_bbenv
 
+'''Resident bitbake server'''
+# Idle timeout in seconds to keep bitbake server alive between commands
+BBServerTimeoutEnv = 'PLNX_BB_SERVER_TIMEOUT'
+BBServerSocket = os.path.join(BuildDir, 'bitbake.sock')
+
+'''setup_plnwrapper phase fingerprints'''
+SetupFingerprintFile = os.path.join(BuildDir, '.setup-fingerprints')
+
+'''Bitbake environment snapshot'''
+BBEnvSnapshotFile = os.path.join(BuildDir, '.bitbake-env.json')
+# Shell variables which are not part of the environment snapshot
+BBEnvSkipVars = ('PWD', 'OLDPWD', 'SHLVL', '_')
+
+'''gen-machineconf output cache'''
+# Shared cache dir, set to empty to disable the cache
+GenMachineConfCacheEnv = 'PLNX_GENMACHINECONF_CACHE_DIR'
+GenMachineConfCacheDir = os.path.join(
+    os.path.expanduser('~'), '.cache', 'petalinux', 'gen-machineconf')
+# Cache size limit in MB, least recently used entries are evicted
+GenMachineConfCacheSizeEnv = 'PLNX_GENMACHINECONF_CACHE_SIZE'
+GenMachineConfCacheSize = 512
+# Placeholder for project path in cached files
+CacheProotToken = '@PLNX_PROOT@'
+
 YoctoEnvPrefix = 'environment-setup'
 YoctoEnvFile = {
     'aarch64': 'cortexa72-cortexa53-xilinx-linux',
@@ -291,6 +315,21 @@ FlashPartNode = '''
             }};
 '''
 FlashendSymbols = '''\t};\n};\n'''
+FlashMaxParts = 19
+# Image file(BootFileNames key or name) per flash partition name
+FlashPartFiles = {
+    'boot': 'BOOTBIN',
+    'fpga': 'download.bit',
+    'kernel': 'KERNEL',
+    'bootscr': 'BOOTSCRIPT',
+    'dtb': 'DTB',
+    'jffs2': 'rootfs.jffs2'
+}
+FlashEraseSize = 0x10000
+# Minimum free space in partition in % of image size
+FlashHeadroom = 10
+FlashLayoutDir = os.path.join(BuildDir, 'flash-layout')
+FlashImageFile = 'flash.bin'
 
 BifImagePrefix = 'the_ROM_image'
 
@@ -334,6 +373,41 @@ UbootConfs = {
     'BootScrOffset': 'CONFIG_SUBSYSTEM_UBOOT_BOOTSCR_OFFSET'
 }
 
+'''BOOT.BIN cache'''
+BootBinCacheEnv = 'PLNX_BOOTBIN_CACHE_DIR'
+BootBinCacheDir = os.path.join(
+    os.path.expanduser('~'), '.cache', 'petalinux', 'bootbin')
+BootBinCacheSizeEnv = 'PLNX_BOOTBIN_CACHE_SIZE'
+BootBinCacheSize = 1024
+
+'''MicroBlaze flash image'''
+# "1" uses native cfgmem writer(SPI only, writes the .prm file too) instead
+# of vivado write_cfgmem,
+# "verify" runs both and compares the native output with vivado one
+CfgMemNativeEnv = 'PLNX_CFGMEM_NATIVE'
+
+'''File hash cache, most recently used files kept at the end'''
+HashCacheFile = os.path.join(MetaDataDir, 'hash-cache.json')
+HashCacheSize = 256
+# Old unbounded hash cache entries in metadata
+HashCachePrefix = 'HASH_CACHE_'
+# Input files hash and stat of generated qemu_boot.img
+QemuBootImgMacro = 'QEMU_BOOT_IMG_CHECKSUM'
+
+'''Tar decompression, parallel decompressors first'''
+TarDecompressors = (
+    (b'\xfd7zXZ\x00', '-J', ('pixz', 'xz -T0')),
+    (b'\x1f\x8b', '-z', ('pigz',)),
+    (b'\x28\xb5\x2f\xfd', '--zstd', ('zstd -T0',)),
+    (b'BZh', '-j', ('lbzip2', 'pbzip2'))
+)
+
+'''XSA reader'''
+XsaManifestFiles = ('xsa.xml', 'sysdef.xml')
+XsaHwFilesCache = os.path.join(MetaDataDir, 'xsa-hwfiles.json')
+XsaHwFilesCacheSize = 8
+XsaExtractDir = os.path.join(BuildDir, 'xsa')
+
 '''XSCT commands'''
 OpenHWCmd = 'openhw {0}'
 HdfDataMacro = '@#%HDF_DATA@#%'
@@ -341,3 +415,39 @@ GetHWFilesCmd = 'set lu_data [hsi get_hw_files -filter {{TYPE == {0}}}];\
         puts "{1}${{lu_data}}"; exit;'
 XsctFileIn = 'xsct -sdx -nodisp {0}'
 XsdbConnectCmd = 'gdbremote connect {0}:{1} {2}'
+
+'''Incremental TFTP directory sync'''
+SyncManifestFile = '.petalinux-sync.json'
+# Set to 1 to skip the SDK and archiver files
+SyncExcludeSdkEnv = 'PLNX_TFTP_EXCLUDE_SDK'
+SyncSdkFiles = ('sdk.sh', 'esdk.sh', '*.sdk.sh', 'archiver.tar.gz')
+
+'''package wic rootfs and SD image'''
+# Pseudo extracted rootfs reused across package wic runs
+WicRootfsDir = os.path.join(BuildDir, 'wic-rootfs')
+WicRootfsKeyFile = 'rootfs.key'
+# Set to 0 to always create the SD image with wic
+WicNativeEnv = 'PLNX_WIC_NATIVE'
+WicNativeAlign = 4096
+WicOutFile = 'petalinux-sdimage.wic'
+# Free space in % of content for --auto-size partitions
+WicHeadroom = 20
+WicAutoSizeAlign = 1024 * 1024
+
+'''FPGA manager bitstream .bit.bin conversion for dfx_user_dts apps'''
+UserAppsDir = os.path.join(MetaUserDir, 'recipes-apps')
+BitBinDir = os.path.join(BuildDir, 'bitbin')
+BitBinConfFile = os.path.join(ConfDir, 'plnx-bitbin.conf')
+BitBinIncludeStr = 'include conf/plnx-bitbin.conf\n'
+# Replace the app .bit with pre-converted .bit.bin
+BitBinConfStr = '''SRC_URI:remove:pn-{0} = "{1}"
+SRC_URI:append:pn-{0} = " file://{2}"
+'''
+BitBinCacheEnv = 'PLNX_BITBIN_CACHE_DIR'
+BitBinCacheDir = os.path.join(
+    os.path.expanduser('~'), '.cache', 'petalinux', 'bitbin')
+BitBinCacheSizeEnv = 'PLNX_BITBIN_CACHE_SIZE'
+BitBinCacheSize = 512
+BitBinBif = 'all:\n{{\n\t[destination_device = pl] {0}\n}}\n'
+# Architectures using .bit.bin for fpga-manager
+BitBinArchs = ('zynq', 'zynqmp')
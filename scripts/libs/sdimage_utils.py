@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import fat_utils
+import plnx_utils
+
+logger = logging.getLogger('PetaLinux')
+
+SectorSize = 512
+# MBR partition types
+MbrPartTypes = {
+    'vfat': 0x0c,
+    'ext4': 0x83
+}
+MbrDiskIdOffset = 440
+MbrPartOffset = 446
+MbrMaxParts = 4
+# Minimum e2fsprogs version having mkfs.ext4 -d
+Ext4PopulateVersion = (1, 43)
+# mkfs.ext4 options used and the default layout to estimate size
+Ext4BlockSize = 4096
+Ext4InodeRatio = 8192
+Ext4InodeSize = 256
+Ext4ReservedInodes = 11
+# Bitmaps, group descriptors, reserved GDT and extent blocks(1 of 128)
+Ext4GroupOverhead = 128
+# mke2fs.conf used instead of host /etc/mke2fs.conf, features and
+# defaults should not depend on the host e2fsprogs
+Ext4MkfsConf = '''[defaults]
+\tbase_features = sparse_super,large_file,filetype,resize_inode,dir_index,ext_attr
+\tdefault_mntopts = acl,user_xattr
+\tenable_periodic_fsck = 0
+
+[fs_types]
+\text4 = {
+\t\tfeatures = has_journal,extent,huge_file,flex_bg,64bit,dir_nlink,extra_isize
+\t}
+'''
+# Minimum size having a journal
+Ext4MinSize = 16 * 1024 * 1024
+# Symlink target stored in inode
+Ext4FastLinkSize = 59
+# (fs blocks below, journal blocks) from ext2fs_default_journal_size
+Ext4JournalBlocks = ((2048, 0), (32768, 1024), (256 * 1024, 4096),
+                     (512 * 1024, 8192), (4096 * 1024, 16384),
+                     (8192 * 1024, 32768), (16384 * 1024, 65536),
+                     (32768 * 1024, 131072), (1 << 62, 262144))
+SizeUnits = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# Compressor: (file extension, commands tried in order with {0} threads)
+ImageCompressors = {
+    'zstd': ('zst', ('zstd -q -c -T{0}', )),
+    'zstd-seekable': ('zst', ('zstd -q -c', )),
+    'xz': ('xz', ('xz -c -T{0}', )),
+    'gz': ('gz', ('pigz -c -p {0}', 'gzip -c'))
+}
+CompressBlockSize = 1024 * 1024
+# Seekable zstd format frame size and seek table magic numbers
+ZstdSeekableFrameSize = 4 * 1024 * 1024
+ZstdSkippableMagic = 0x184D2A5E
+ZstdSeekableMagic = 0x8F92EAB1
+BmapBlockSize = 4096
+BmapChecksumLen = 64
+BmapHeader = '''<?xml version="1.0" ?>
+<!-- Block map of {0}, flash with: bmaptool copy {0} <device> -->
+<bmap version="2.0">
+    <ImageSize> {1} </ImageSize>
+    <BlockSize> {2} </BlockSize>
+    <BlocksCount> {3} </BlocksCount>
+    <MappedBlocksCount> {4} </MappedBlocksCount>
+    <ChecksumType> sha256 </ChecksumType>
+    <BmapFileChecksum> {5} </BmapFileChecksum>
+    <BlockMap>
+'''
+BmapRange = '        <Range chksum="{0}"> {1} </Range>\n'
+BmapFooter = '''    </BlockMap>
+</bmap>
+'''
+
+
+def get_size_bytes(size):
+    '''Return the bytes of size with K/M/G unit, default unit is M'''
+    unit = size[-1].upper() if size[-1].isalpha() else 'M'
+    number = size[:-1] if size[-1].isalpha() else size
+    if unit not in SizeUnits or not number.isnumeric():
+        raise Exception('Invalid size: %s' % size)
+    return int(number) * SizeUnits[unit]
+
+
+def get_sd_layout(sizes, align):
+    '''Return the (start, size) of partitions in bytes and disk size,
+    first partition is after the MBR and all are aligned to align'''
+    layout = []
+    offset = SectorSize
+    for size in sizes:
+        offset = -(-offset // align) * align
+        layout.append((offset, size))
+        offset += size
+    return layout, offset
+
+
+def get_mbr_entry(active, part_type, start, size):
+    '''Return the MBR partition entry, CHS fields are set to LBA'''
+    return struct.pack('<B3sB3sII', 0x80 if active else 0, b'\xfe\xff\xff',
+                       part_type, b'\xfe\xff\xff', start // SectorSize,
+                       size // SectorSize)
+
+
+def get_mbr(partitions, disk_id=None):
+    '''Return the MBR sector of partitions
+    partitions - list of (active, part type, start, size) in bytes'''
+    if len(partitions) > MbrMaxParts:
+        raise Exception('MBR supports only %d primary partitions'
+                        % MbrMaxParts)
+    mbr = bytearray(SectorSize)
+    if disk_id is None:
+        disk_id = random.getrandbits(32)
+    struct.pack_into('<I', mbr, MbrDiskIdOffset, disk_id)
+    for num, partition in enumerate(partitions):
+        entry = get_mbr_entry(*partition)
+        mbr[MbrPartOffset + num * 16:MbrPartOffset + (num + 1) * 16] = entry
+    mbr[510:512] = b'\x55\xaa'
+    return bytes(mbr)
+
+
+def get_mkfs_ext4(tools_dir=''):
+    '''Return the mkfs.ext4 supporting -d from tools_dir or host,
+    empty if not found'''
+    for mkfs in (os.path.join(tools_dir, 'usr', 'sbin', 'mkfs.ext4')
+                 if tools_dir else '', shutil.which('mkfs.ext4') or ''):
+        if not mkfs or not os.access(mkfs, os.X_OK):
+            continue
+        output, error = plnx_utils.runCmd('"%s" -V' % mkfs, os.getcwd(),
+                                          shell=True)
+        match = re.search(r'mke2fs (\d+)\.(\d+)', error + output)
+        if match and tuple(map(int, match.groups())) >= Ext4PopulateVersion:
+            return mkfs
+    return ''
+
+
+def get_fstab_update(rootfs_dir, entries):
+    '''Return the rootfs fstab with entries appended,
+    empty if rootfs is not having fstab or entries are already there'''
+    fstab_file = os.path.join(rootfs_dir, 'etc', 'fstab')
+    if not os.path.isfile(fstab_file) or os.path.islink(fstab_file):
+        return ''
+    with open(fstab_file, 'r') as file_data:
+        fstab = file_data.read()
+    mounts = [line.split()[1] for line in fstab.splitlines()
+              if len(line.split()) > 1 and not line.startswith('#')]
+    entries = [entry for entry in entries if entry.split()[1] not in mounts]
+    if not entries:
+        return ''
+    if fstab and not fstab.endswith('\n'):
+        fstab += '\n'
+    return fstab + ''.join(entries)
+
+
+def get_debugfs_cmds(rootfs_dir, tmp_dir, files, links):
+    '''Return the debugfs commands to add files(list of (path, content,
+    mode)) and links(list of (path, target)) owned by root'''
+    cmds = []
+    dirs = set()
+    for path in [path for path, content, mode in files] + \
+            [path for path, target in links]:
+        parent = os.path.dirname(path)
+        while parent != '/' and parent not in dirs and \
+                not os.path.lexists(os.path.join(rootfs_dir,
+                                                 parent.lstrip('/'))):
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+    for path in sorted(dirs):
+        cmds += ['mkdir %s' % path, 'sif %s mode 040755' % path]
+    for num, (path, content, mode) in enumerate(files):
+        tmp_file = os.path.join(tmp_dir, 'file%d' % num)
+        plnx_utils.add_str_to_file(tmp_file, content)
+        if os.path.lexists(os.path.join(rootfs_dir, path.lstrip('/'))):
+            cmds.append('rm %s' % path)
+        cmds += ['write %s %s' % (tmp_file, path),
+                 'sif %s mode 0%o' % (path, 0o100000 | mode)]
+    for path, target in links:
+        cmds.append('symlink %s %s' % (path, target))
+    for path in sorted(dirs) + [path for path, content, mode in files] + \
+            [path for path, target in links]:
+        cmds += ['sif %s uid 0' % path, 'sif %s gid 0' % path]
+    return cmds
+
+
+def create_ext4_part(image, offset, size, rootfs_dir, label, mkfs,
+                     cmd_prefix='', files=None, links=None):
+    '''Create ext4 filesystem populated from rootfs_dir at offset of
+    image, cmd_prefix is to run mkfs under pseudo for file ownership.
+    files and links are added on top of rootfs_dir content'''
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(image))
+    try:
+        conf_file = os.path.join(tmp_dir, 'mke2fs.conf')
+        plnx_utils.add_str_to_file(conf_file, Ext4MkfsConf)
+        plnx_utils.runCmd('%s "%s" -q -F -T ext4 -b %d -i %d -I %d -L %s '
+                          '-E offset=%d -d "%s" "%s" %dk' % (
+                              cmd_prefix, mkfs, Ext4BlockSize, Ext4InodeRatio,
+                              Ext4InodeSize, label, offset, rootfs_dir, image,
+                              size // 1024),
+                          os.getcwd(), extraenv={'MKE2FS_CONFIG': conf_file},
+                          failed_msg='Fail to create ext4 %s' % label,
+                          shell=True)
+        if not files and not links:
+            return
+        debugfs = os.path.join(os.path.dirname(mkfs), 'debugfs')
+        if not os.access(debugfs, os.X_OK):
+            debugfs = shutil.which('debugfs') or 'debugfs'
+        cmd_file = os.path.join(tmp_dir, 'debugfs.cmd')
+        plnx_utils.add_str_to_file(cmd_file, '\n'.join(get_debugfs_cmds(
+            rootfs_dir, tmp_dir, files or [], links or [])) + '\n')
+        plnx_utils.runCmd('"%s" -w -f "%s" "%s?offset=%d"' % (
+            debugfs, cmd_file, image, offset), os.getcwd(),
+            failed_msg='Fail to update files in %s' % label, shell=True)
+    finally:
+        plnx_utils.RemoveDir(tmp_dir)
+
+
+def create_sd_image(image, boot_files, boot_size, rootfs_dir, root_size,
+                    mkfs, align, cmd_prefix='', files=None, links=None):
+    '''Create MBR disk image with vfat boot partition having boot_files
+    (list of (name, file)) and ext4 root partition from rootfs_dir.
+    Filesystems are written directly at their offsets in sparse image'''
+    (boot_start, boot_size), (root_start, root_size) = get_sd_layout(
+        (boot_size, root_size), align)[0]
+    disk_size = root_start + root_size
+    with open(image, 'wb') as image_data:
+        image_data.truncate(disk_size)
+        image_data.write(get_mbr([
+            (True, MbrPartTypes['vfat'], boot_start, boot_size),
+            (False, MbrPartTypes['ext4'], root_start, root_size)]))
+    fat_utils.create_fat_image(image, boot_files, boot_size, 'boot',
+                               offset=boot_start)
+    create_ext4_part(image, root_start, root_size, rootfs_dir, 'root', mkfs,
+                     cmd_prefix, files, links)
+    return disk_size
+
+
+def get_files_usage(paths, block_size):
+    '''Return the (inodes, blocks) used by paths recursively,
+    hardlinks are counted once'''
+    import stat
+    inodes = set()
+    blocks = 0
+
+    def add_usage(name):
+        nonlocal blocks
+        file_stat = os.lstat(name)
+        if (file_stat.st_dev, file_stat.st_ino) in inodes:
+            return
+        inodes.add((file_stat.st_dev, file_stat.st_ino))
+        file_blocks = -(-file_stat.st_size // block_size)
+        if stat.S_ISDIR(file_stat.st_mode):
+            blocks += max(1, file_blocks)
+        elif stat.S_ISREG(file_stat.st_mode) or \
+                file_stat.st_size > Ext4FastLinkSize:
+            blocks += file_blocks
+
+    for path in paths:
+        add_usage(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, filenames in os.walk(path):
+                for name in dirs + filenames:
+                    add_usage(os.path.join(root, name))
+    return len(inodes), blocks
+
+
+def get_ext4_journal_blocks(blocks):
+    '''Return the mke2fs default journal size in blocks'''
+    for max_blocks, journal_blocks in Ext4JournalBlocks:
+        if blocks < max_blocks:
+            return journal_blocks
+    return Ext4JournalBlocks[-1][1]
+
+
+def get_ext4_fit_size(inodes, blocks, headroom, align):
+    '''Return the aligned ext4 size in bytes to fit inodes and blocks
+    (4K) with headroom(%), including the inode tables, bitmaps and
+    journal overhead of mkfs.ext4 -i Ext4InodeRatio'''
+    need_inodes = inodes + inodes * headroom // 100 + Ext4ReservedInodes
+    need_blocks = blocks + blocks * headroom // 100
+    size = max(need_blocks * Ext4BlockSize, need_inodes * Ext4InodeRatio,
+               Ext4MinSize)
+    while True:
+        size_blocks = size // Ext4BlockSize
+        # Inode tables, group descriptors and bitmaps
+        overhead = size_blocks * Ext4InodeSize // Ext4InodeRatio + \
+            size_blocks // Ext4GroupOverhead + \
+            get_ext4_journal_blocks(size_blocks)
+        fit_size = (need_blocks + overhead) * Ext4BlockSize
+        fit_size = max(fit_size, need_inodes * Ext4InodeRatio)
+        fit_size = -(-fit_size // align) * align
+        if fit_size <= size:
+            return size
+        size = fit_size
+
+
+def get_bmap_ranges(image):
+    '''Return the (first block, last block, sha256) of mapped blocks'''
+    ranges = []
+    size = os.path.getsize(image)
+    with open(image, 'rb') as image_data:
+        for start, end in plnx_utils.get_data_ranges(image_data.fileno(),
+                                                     size):
+            first = start // BmapBlockSize
+            last = (end - 1) // BmapBlockSize
+            if ranges and first <= ranges[-1][1] + 1:
+                # Data ranges sharing a block
+                first = ranges.pop()[0]
+            ranges.append((first, last))
+        bmap_ranges = []
+        for first, last in ranges:
+            method = hashlib.sha256()
+            image_data.seek(first * BmapBlockSize)
+            length = min((last + 1) * BmapBlockSize, size) - \
+                first * BmapBlockSize
+            while length > 0:
+                data = image_data.read(min(plnx_utils.HashBlockSize, length))
+                if not data:
+                    break
+                method.update(data)
+                length -= len(data)
+            bmap_ranges.append((first, last, method.hexdigest()))
+    return bmap_ranges
+
+
+def write_bmap(image, bmap_file):
+    '''Write the bmaptool block map(version 2.0) of sparse image'''
+    size = os.path.getsize(image)
+    ranges = get_bmap_ranges(image)
+    mapped = sum(last - first + 1 for first, last, checksum in ranges)
+    body = ''.join(BmapRange.format(checksum, first if first == last else
+                                    '%d-%d' % (first, last))
+                   for first, last, checksum in ranges) + BmapFooter
+    header = BmapHeader.format(os.path.basename(image), size, BmapBlockSize,
+                               -(-size // BmapBlockSize), mapped, '{0}')
+    # Bmap checksum is calculated with zeros in checksum field
+    checksum = hashlib.sha256((header.format('0' * BmapChecksumLen) +
+                               body).encode()).hexdigest()
+    plnx_utils.write_file_atomic(bmap_file, header.format(checksum) + body)
+    logger.info('Block map: %s(%d of %d blocks mapped)'
+                % (bmap_file, mapped, -(-size // BmapBlockSize)))
+
+
+def get_compress_cmd(compressor, threads):
+    '''Return the compress command of compressor found in host'''
+    for cmd in ImageCompressors[compressor][1]:
+        if shutil.which(cmd.split()[0]):
+            return cmd.format(threads)
+    raise Exception('%s is not found, install it to compress the image'
+                    % ' or '.join(cmd.split()[0] for cmd in
+                                  ImageCompressors[compressor][1]))
+
+
+def read_image_blocks(image_data, start, end, ranges):
+    '''Yield the image data from start to end in blocks, holes in ranges
+    (data ranges) are given as zeros without reading'''
+    zeros = memoryview(bytes(CompressBlockSize))
+    position = start
+    for data_start, data_end in ranges + [(end, end)]:
+        data_start = min(max(data_start, position), end)
+        data_end = min(data_end, end)
+        while position < data_start:
+            size = min(CompressBlockSize, data_start - position)
+            yield zeros[:size]
+            position += size
+        if position < data_end:
+            image_data.seek(position)
+        while position < data_end:
+            data = image_data.read(min(CompressBlockSize,
+                                       data_end - position))
+            if not data:
+                raise Exception('Unexpected end of image at %d' % position)
+            yield data
+            position += len(data)
+
+
+def compress_image_stream(image, outfile, cmd):
+    '''Compress the image into outfile with cmd reading from stdin'''
+    size = os.path.getsize(image)
+    with open(image, 'rb') as image_data, open(outfile, 'wb') as out_data:
+        ranges = plnx_utils.get_data_ranges(image_data.fileno(), size)
+        process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                                   stdout=out_data)
+        try:
+            for data in read_image_blocks(image_data, 0, size, ranges):
+                process.stdin.write(data)
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+    if returncode:
+        raise Exception('Fail to compress %s with %s' % (image, cmd))
+
+
+def compress_frame(cmd, data):
+    '''Return the compressed frame of data'''
+    return subprocess.run(cmd, shell=True, input=data, check=True,
+                          stdout=subprocess.PIPE).stdout
+
+
+def get_seek_table(frames):
+    '''Return the seekable zstd seek table skippable frame of frames
+    (list of (compressed size, decompressed size))'''
+    table = b''.join(struct.pack('<II', *frame) for frame in frames)
+    table += struct.pack('<IBI', len(frames), 0, ZstdSeekableMagic)
+    return struct.pack('<II', ZstdSkippableMagic, len(table)) + table
+
+
+def compress_image_seekable(image, outfile, cmd, threads):
+    '''Compress the image into zstd frames of ZstdSeekableFrameSize with
+    seek table, frames are compressed in parallel and hole only frames
+    are compressed once'''
+    size = os.path.getsize(image)
+    frames = []
+    zero_frames = {}
+    with open(image, 'rb') as image_data, open(outfile, 'wb') as out_data, \
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads) as executor:
+        ranges = plnx_utils.get_data_ranges(image_data.fileno(), size)
+        pending = []
+
+        def write_frames(count):
+            while len(pending) > count:
+                length, job = pending.pop(0)
+                frame = job.result() if job else zero_frames[length]
+                out_data.write(frame)
+                frames.append((len(frame), length))
+
+        for start in range(0, size, ZstdSeekableFrameSize):
+            end = min(start + ZstdSeekableFrameSize, size)
+            if not any(data_start < end and data_end > start
+                       for data_start, data_end in ranges):
+                if end - start not in zero_frames:
+                    zero_frames[end - start] = compress_frame(
+                        cmd, bytes(end - start))
+                pending.append((end - start, None))
+            else:
+                data = b''.join(read_image_blocks(image_data, start, end,
+                                                  ranges))
+                pending.append((end - start, executor.submit(
+                    compress_frame, cmd, data)))
+            # Limit the frames in memory
+            write_frames(threads * 2)
+        write_frames(0)
+        out_data.write(get_seek_table(frames))
+
+
+def compress_image(image, compressor, threads):
+    '''Compress the image into image.<ext> through a temp file, holes
+    are not read from the image. Returns the compressed file'''
+    outfile = '%s.%s' % (image, ImageCompressors[compressor][0])
+    cmd = get_compress_cmd(compressor, threads)
+    fd, tmpfile = tempfile.mkstemp(prefix='.%s.' % os.path.basename(outfile),
+                                   dir=os.path.dirname(outfile))
+    os.close(fd)
+    try:
+        if compressor == 'zstd-seekable':
+            compress_image_seekable(image, tmpfile, cmd, threads)
+        else:
+            compress_image_stream(image, tmpfile, cmd)
+        os.chmod(tmpfile, os.stat(image).st_mode & 0o777)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        plnx_utils.RemoveFile(tmpfile)
+        raise
+    logger.info('Compressed image: %s(%d bytes)'
+                % (outfile, os.path.getsize(outfile)))
+    return outfile
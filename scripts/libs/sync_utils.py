@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import tempfile
+import plnx_utils
+import plnx_vars
+
+logger = logging.getLogger('PetaLinux')
+
+
+def read_sync_manifest(outdir):
+    '''Read the sync manifest of outdir
+    {relative path: {'size', 'mtime', 'hash', 'src'}}'''
+    manifest_file = os.path.join(outdir, plnx_vars.SyncManifestFile)
+    try:
+        with open(manifest_file, 'r') as file_data:
+            return json.load(file_data)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_sync_excludes():
+    '''Return the file patterns to skip while syncing'''
+    if os.environ.get(plnx_vars.SyncExcludeSdkEnv, '') == '1':
+        return plnx_vars.SyncSdkFiles
+    return ()
+
+
+def copy_file_atomic(infile, outfile):
+    '''Copy infile to outfile through a temp file and rename,
+    reflink if filesystem supports it else copy. No hardlinks, in place
+    rewrites of infile should not change the outfile'''
+    outdir = os.path.dirname(outfile)
+    fd, tmpfile = tempfile.mkstemp(prefix='.%s.' % os.path.basename(outfile),
+                                   dir=outdir)
+    os.close(fd)
+    try:
+        plnx_utils.clone_file(infile, tmpfile)
+        shutil.copystat(infile, tmpfile)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        plnx_utils.RemoveFile(tmpfile)
+        raise
+
+
+def sync_file(infile, outfile, manifest, relpath):
+    '''Copy infile to outfile if its content is not same as the
+    outfile recorded in manifest. Returns True if copied'''
+    if os.path.islink(infile):
+        target = os.readlink(infile)
+        if os.path.islink(outfile) and os.readlink(outfile) == target:
+            return False
+        plnx_utils.RemoveFile(outfile)
+        os.symlink(target, outfile)
+        manifest.pop(relpath, None)
+        return True
+    src_stat = os.stat(infile)
+    src = [src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_ino]
+    entry = manifest.get(relpath, {})
+    try:
+        out_stat = os.stat(outfile)
+    except OSError:
+        out_stat = None
+    # Hardlinked outfile from older syncs has to be copied to break link
+    out_linked = out_stat and os.path.samestat(src_stat, out_stat)
+    out_unchanged = out_stat and not out_linked and \
+        entry.get('size') == out_stat.st_size and \
+        entry.get('mtime') == out_stat.st_mtime_ns
+    if out_unchanged and entry.get('src') == src:
+        return False
+    copied = False
+    if not out_unchanged and out_stat and not out_linked and \
+            out_stat.st_size == src_stat.st_size and \
+            out_stat.st_mtime_ns == src_stat.st_mtime_ns:
+        # Not in manifest, copied with same size and mtime before
+        # skip hashing the file till the infile changes
+        hashvalue = None
+    else:
+        hashvalue = plnx_utils.get_filehashvalue(infile)
+        if not out_unchanged or entry.get('hash') != hashvalue:
+            copy_file_atomic(infile, outfile)
+            copied = True
+    out_stat = os.stat(outfile)
+    manifest[relpath] = {'size': out_stat.st_size,
+                         'mtime': out_stat.st_mtime_ns,
+                         'hash': hashvalue, 'src': src}
+    return copied
+
+
+def sync_files(files, outdir, exclude=None):
+    '''Sync the files(list of (source, relative path in outdir))
+    into outdir, copy only the changed files
+    Returns the number of copied and unchanged files'''
+    if exclude is None:
+        exclude = get_sync_excludes()
+    manifest = read_sync_manifest(outdir)
+    copied = unchanged = 0
+    try:
+        for infile, relpath in files:
+            name = os.path.basename(relpath)
+            if any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+                logger.debug('Skip syncing %s' % infile)
+                continue
+            outfile = os.path.join(outdir, relpath)
+            plnx_utils.CreateDir(os.path.dirname(outfile))
+            if sync_file(infile, outfile, manifest, relpath):
+                copied += 1
+            else:
+                unchanged += 1
+    finally:
+        plnx_utils.write_file_atomic(
+            os.path.join(outdir, plnx_vars.SyncManifestFile),
+            json.dumps(manifest, indent=1, sort_keys=True))
+    return copied, unchanged
+
+
+def sync_dir(indir, outdir, exclude=None):
+    '''Sync the files of indir recursively into outdir'''
+    files = []
+    for root, dirs, filenames in os.walk(indir):
+        dirs.sort()
+        for filename in sorted(filenames + [dirname for dirname in dirs
+                                            if os.path.islink(
+                                                os.path.join(root, dirname))]):
+            infile = os.path.join(root, filename)
+            files.append((infile, os.path.relpath(infile, indir)))
+    copied, unchanged = sync_files(files, outdir, exclude)
+    logger.info('Synced %s: %d files copied, %d unchanged'
+                % (outdir, copied, unchanged))
+    return copied, unchanged
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021-2022, Xilinx, Inc.  All rights reserved.
+# Copyright (C) 2022-2024, Advanced Micro Devices, Inc.  All rights reserved.
+#
+# Author:
+#       Raju Kumar Pothuraju <rajukumar.pothuraju>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+import os
+import shutil
+import zipfile
+import plnx_vars
+import plnx_utils
+
+logger = logging.getLogger('PetaLinux')
+
+
+def read_xsa_manifest(hw_file):
+    '''Read the hardware files list from XSA manifest
+    Returns dict of {TYPE: [file names]} in lower case TYPE,
+    None if XSA or its manifest format is unknown'''
+    try:
+        with zipfile.ZipFile(hw_file) as xsa:
+            members = xsa.namelist()
+            manifest = ''
+            for name in plnx_vars.XsaManifestFiles:
+                if name in members:
+                    manifest = xsa.read(name)
+                    break
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.debug('Unable to read %s: %s' % (hw_file, e))
+        return None
+    if not manifest:
+        return None
+    import xml.etree.ElementTree as ET
+    try:
+        root = ET.fromstring(manifest)
+    except ET.ParseError as e:
+        logger.debug('Unable to parse XSA manifest: %s' % e)
+        return None
+    hw_files = {}
+    for element in root.iter():
+        if element.tag.split('}')[-1] != 'File':
+            continue
+        file_type = element.get('Type', '')
+        file_name = element.get('Name', '')
+        if not file_type or not file_name:
+            continue
+        hw_files.setdefault(file_type.lower(), []).append(file_name)
+    if not hw_files:
+        return None
+    return hw_files
+
+
+def get_xsa_hw_files(proot, hw_file):
+    '''Return the hardware files of XSA from project cache,
+    read the XSA manifest if not cached. None if manifest unknown'''
+    if not os.path.isfile(hw_file):
+        return None
+    checksum = plnx_utils.get_filehashvalue_cached(proot, hw_file)
+    cache_file = plnx_vars.XsaHwFilesCache.format(proot)
+    cache = {}
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as file_data:
+                cache = json.load(file_data)
+        except ValueError:
+            cache = {}
+    if checksum in cache:
+        return cache[checksum]
+    hw_files = read_xsa_manifest(hw_file)
+    if hw_files is None:
+        return None
+    # Keep only the latest XSAs
+    start = max(len(cache) - plnx_vars.XsaHwFilesCacheSize + 1, 0)
+    cache = dict(list(cache.items())[start:])
+    cache[checksum] = hw_files
+    if os.path.isdir(os.path.dirname(cache_file)):
+        plnx_utils.write_file_atomic(cache_file, json.dumps(cache))
+    return hw_files
+
+
+def get_xsa_files_bytype(proot, hw_file, file_type):
+    '''Return the space separated file names of given TYPE from XSA
+    as xsct get_hw_files does. None if manifest unknown'''
+    hw_files = get_xsa_hw_files(proot, hw_file)
+    if hw_files is None:
+        return None
+    return ' '.join(hw_files.get(file_type.lower(), []))
+
+
+def extract_xsa_file(hw_file, file_name, outdir):
+    '''Extract the given file from XSA into outdir and return the path,
+    empty if not found'''
+    try:
+        with zipfile.ZipFile(hw_file) as xsa:
+            for member in xsa.namelist():
+                if os.path.basename(member) != file_name:
+                    continue
+                outfile = os.path.join(outdir, file_name)
+                plnx_utils.CreateDir(outdir)
+                with xsa.open(member) as src, open(outfile, 'wb') as dest:
+                    shutil.copyfileobj(src, dest, 1024 * 1024)
+                return outfile
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.debug('Unable to extract %s from %s: %s' %
+                     (file_name, hw_file, e))
+    return ''